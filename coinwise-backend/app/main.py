@@ -4,7 +4,7 @@ import logging
 from routes.goals import router as goals_router
 from routes.transactions import router as transaction_router
 from routes.auth import router as auth_router
-from routes.upload import router as upload_router
+from routes.upload import UploadSizeLimitMiddleware, router as upload_router, upload_body_limits
 from routes.contributions import router as contributions_router
 from routes.budgets import router as budgets_router
 from routes.stats import router as stats_router
@@ -26,6 +26,7 @@ app = FastAPI(
 )
 
 
+app.add_middleware(UploadSizeLimitMiddleware, limits=upload_body_limits("/api/upload"))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
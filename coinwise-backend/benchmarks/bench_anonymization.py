@@ -0,0 +1,76 @@
+"""
+Compares the previous per-match str.replace anonymizer with the single-pass
+Anonymizer on synthetic statement text.
+
+Usage (from coinwise-backend/):
+    python -m benchmarks.bench_anonymization --pages 10 50 100
+"""
+import argparse
+import random
+import re
+import time
+from uuid import uuid4
+
+from service.anonymization_service import Anonymizer, generate_flexible_name_pattern
+
+FULL_NAME = "Ion Popescu"
+MERCHANTS = ["MEGA IMAGE", "LIDL", "KAUFLAND", "OMV PETROM", "NETFLIX.COM", "GLOVO", "CATENA"]
+
+
+def synthetic_statement(pages: int, lines_per_page: int = 40, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    ibans = [f"RO{rng.randint(10, 99)}BTRL{rng.randint(10**15, 10**16 - 1)}" for _ in range(20)]
+    cards = [" ".join(str(rng.randint(1000, 9999)) for _ in range(4)) for _ in range(5)]
+    lines = []
+    for page in range(pages):
+        lines.append(f"Extras de cont {FULL_NAME.upper()} IBAN {ibans[0]} Pagina {page + 1}")
+        for _ in range(lines_per_page):
+            day = rng.randint(1, 28)
+            merchant = rng.choice(MERCHANTS)
+            amount = rng.randint(100, 99999) / 100
+            if rng.random() < 0.3:
+                lines.append(f"{day:02d}/03/2025 Transfer catre {rng.choice(ibans)} {FULL_NAME} {amount:.2f}")
+            else:
+                lines.append(f"{day:02d}/03/2025 Plata la POS {merchant} card {rng.choice(cards)} {amount:.2f}")
+    return "\n".join(lines)
+
+
+def legacy_anonymize(text: str, full_name: str):
+    new_text = text
+    entity_map = {}
+    name_regex = re.compile(generate_flexible_name_pattern(full_name), flags=re.IGNORECASE | re.MULTILINE)
+    if name_regex.search(new_text):
+        anon_name = f"@name_{uuid4().hex[:6]}"
+        new_text = name_regex.sub(anon_name, new_text)
+        entity_map[anon_name] = full_name
+    for pattern, prefix in [(r"\b[A-Z]{2}\d{2}[A-Z0-9]{11,30}\b", "@iban_"), (r"\b(?:\d[ -]*?){13,16}\b", "@card_")]:
+        for match in re.findall(pattern, new_text):
+            new_text = new_text.replace(match, f"{prefix}{uuid4().hex[:6]}")
+    return new_text, entity_map
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    anonymizer = Anonymizer(FULL_NAME, key=b"benchmark")
+    for pages in args.pages:
+        text = synthetic_statement(pages)
+        legacy = best_of(lambda: legacy_anonymize(text, FULL_NAME), args.repeat)
+        single = best_of(lambda: anonymizer.anonymize(text), args.repeat)
+        print(f"pages={pages:<4} chars={len(text):<9} legacy={legacy:8.4f}s single-pass={single:8.4f}s x{legacy / single:.1f}")
+
+
+if __name__ == "__main__":
+    main()
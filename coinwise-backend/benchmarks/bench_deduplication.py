@@ -0,0 +1,115 @@
+"""
+Scaling of near-duplicate detection: the previous all-pairs scan against the
+blocking implementation in service/transactions_service.py, and the bounded
+similarity kernel against the SequenceMatcher reference mode.
+
+Usage (from coinwise-backend/):
+    python -m benchmarks.bench_deduplication --sizes 1000 10000 100000 1000000
+The all-pairs baseline is only run up to --max-legacy transactions. Both
+similarity modes must report the same duplicates, on the synthetic data and
+on FIXTURE_PAIRS.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from service.transactions_service import find_near_duplicate_transactions, is_duplicate, similar
+
+MERCHANTS = ["Mega Image", "Lidl", "Kaufland", "OMV", "Netflix", "Glovo", "Catena", "eMAG", "Uber", "Enel"]
+TYPES = ["expense"] * 7 + ["income", "deposit", "transfer"]
+
+# (a, b) description pairs covering exact, case/whitespace, single-edit and clearly different texts.
+FIXTURE_PAIRS = [
+    ("POS payment at Lidl", "pos payment at lidl "),
+    ("POS payment at Lidl", "POS payment at Kaufland"),
+    ("Netflix subscription", "Netflix subscriptions"),
+    ("Transfer to Ion Popescu", "Transfer to Ion Popesku"),
+    ("Uber trip", "Uber trips"),
+    ("OMV", "OMV 123"),
+    ("Mega Image", "Mega Image Bucuresti"),
+    ("Salary March", "Salary April"),
+    ("", "Glovo"),
+    ("", ""),
+]
+
+
+def perturb(text: str, rng: random.Random) -> str:
+    choice = rng.randrange(3)
+    if choice == 0:
+        return text + " "
+    if choice == 1:
+        return text.upper()
+    position = rng.randrange(len(text))
+    return text[:position] + rng.choice("abcdefghijklmnopqrstuvwxyz") + text[position + 1:]
+
+
+def synthetic_transactions(n: int, duplicate_rate: float = 0.02, seed: int = 11):
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    days = max(30, n // 40)
+    txs = []
+    for i in range(n):
+        if txs and rng.random() < duplicate_rate:
+            dup = dict(rng.choice(txs), id=str(i))
+            dup["description"] = perturb(dup["description"], rng)
+            txs.append(dup)
+            continue
+        merchant = rng.choice(MERCHANTS)
+        txs.append({
+            "id": str(i),
+            "type": rng.choice(TYPES),
+            "date": (start + timedelta(days=rng.randrange(days))).isoformat(),
+            "amount": rng.choice([9.99, 15.0, 25.5, 49.99, 100.0]) if rng.random() < 0.3 else rng.randint(100, 50000) / 100,
+            "description": f"POS payment at {merchant}",
+            "merchant": merchant,
+            "sender": "Ion Popescu",
+            "receiver": merchant,
+        })
+    return txs
+
+
+def legacy_find_near_duplicates(transactions, threshold=0.9):
+    duplicates = []
+    visited = set()
+    for i in range(len(transactions)):
+        for j in range(i + 1, len(transactions)):
+            tx1, tx2 = transactions[i], transactions[j]
+            key_pair = tuple(sorted([tx1["id"], tx2["id"]]))
+            if key_pair in visited:
+                continue
+            if is_duplicate(tx1, tx2, threshold, mode="reference"):
+                duplicates.append(tx2["id"])
+                visited.add(key_pair)
+    return duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--max-legacy", type=int, default=5000)
+    args = parser.parse_args()
+
+    for a, b in FIXTURE_PAIRS:
+        assert similar(a, b, mode="bounded") == similar(a, b, mode="reference"), f"modes disagree on {a!r}, {b!r}"
+
+    for n in args.sizes:
+        txs = synthetic_transactions(n)
+        start = time.perf_counter()
+        found = find_near_duplicate_transactions(txs, mode="bounded")
+        blocked = time.perf_counter() - start
+        start = time.perf_counter()
+        reference = find_near_duplicate_transactions(txs, mode="reference")
+        blocked_reference = time.perf_counter() - start
+        assert found == reference, "bounded similarity changed the detected duplicates"
+        line = f"n={n:<8} blocking={blocked:9.3f}s reference-similarity={blocked_reference:9.3f}s duplicates={len(found)}"
+        if n <= args.max_legacy:
+            start = time.perf_counter()
+            expected = legacy_find_near_duplicates(txs)
+            legacy = time.perf_counter() - start
+            assert set(found) == set(expected), "blocking changed the detected duplicates"
+            line += f"  all-pairs={legacy:9.3f}s x{legacy / blocked:.0f}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
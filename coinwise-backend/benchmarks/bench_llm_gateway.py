@@ -0,0 +1,92 @@
+"""
+Behaviour of service/llm_gateway.py against the local fake completion server:
+success rate and latency percentiles with and without hedging under injected
+tail latency and failures, and how fast calls fail once the breaker opens.
+
+Usage (from coinwise-backend/):
+    python -m benchmarks.bench_llm_gateway --requests 200 --tail-rate 0.05 --fail-rate 0.1
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from together import AsyncTogether
+
+from benchmarks.fake_completion_server import FakeCompletionConfig, start_server
+from service.llm_gateway import CircuitBreaker, LLMGateway
+
+PARAMS = {"model": "fake", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 100}
+
+
+async def run_calls(gateway: LLMGateway, requests: int, concurrency: int, stream: bool = False):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], {}
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if stream:
+                    async for _ in gateway.stream(**PARAMS):
+                        pass
+                else:
+                    await gateway.complete(**PARAMS)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+    await asyncio.gather(*(call() for _ in range(requests)))
+    return latencies, errors
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+async def scenario(name, config, args, hedge_after=0.0, stream=False, breaker=None):
+    server = start_server(config)
+    client = AsyncTogether(api_key="fake", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    gateway = LLMGateway(
+        client=client, breaker=breaker or CircuitBreaker(failures=10 ** 6), hedge_after=hedge_after,
+        attempt_timeout=args.attempt_timeout, deadline=args.deadline,
+    )
+    start = time.perf_counter()
+    latencies, errors = await run_calls(gateway, args.requests, args.concurrency, stream)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    print(
+        f"{name:<28} ok={len(latencies):>4}/{args.requests} p50={percentile(latencies, 50):6.2f}s "
+        f"p95={percentile(latencies, 95):6.2f}s p99={percentile(latencies, 99):6.2f}s "
+        f"wall={elapsed:6.2f}s upstream_requests={config.requests} errors={errors}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=3.0)
+    parser.add_argument("--fail-rate", type=float, default=0.1)
+    parser.add_argument("--hedge-after", type=float, default=0.5)
+    parser.add_argument("--attempt-timeout", type=float, default=10.0)
+    parser.add_argument("--deadline", type=float, default=30.0)
+    args = parser.parse_args()
+
+    def config(**overrides):
+        values = dict(latency=args.latency, tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+                      fail_rate=args.fail_rate, seed=7)
+        values.update(overrides)
+        return FakeCompletionConfig(**values)
+
+    await scenario("retries", config(), args)
+    await scenario("retries + hedging", config(), args, hedge_after=args.hedge_after)
+    await scenario("streaming retries", config(), args, stream=True)
+    await scenario("provider down, breaker", config(fail_rate=1.0), args,
+                   breaker=CircuitBreaker(failures=5, reset_seconds=60))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
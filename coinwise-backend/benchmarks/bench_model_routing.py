@@ -0,0 +1,360 @@
+"""
+Replays a corpus of recorded statements through sections_extraction and
+extract_transactions_chunked under each model routing, against the local fake
+completion server, and reports per-stage latency, token counts per model and
+field-level extraction accuracy against the expected transactions.
+
+Corpus cases are JSON files in benchmarks/corpus/:
+    {"name": ..., "statement_text": ..., "expected_transactions": [...],
+     "recordings": {"<stage>|<model>|<prompt hash>": "<completion text>"}}
+Record a case once against the provider (needs TOGETHER_API_KEY); replays are
+then offline and deterministic. Without a corpus, a synthetic sample case is
+used whose "models" are rule-based: the large one is exact and the small one
+merges a share of lines while flattening, so the report shows the trade-off
+without being a measurement of any real model.
+
+Usage (from coinwise-backend/):
+    python -m benchmarks.bench_model_routing
+    python -m benchmarks.bench_model_routing --routes "sections=<model>,normalize=<model>"
+    python -m benchmarks.bench_model_routing --record statement.txt --expected expected.json --name bt_march
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import statistics
+import time
+from collections import defaultdict
+from difflib import SequenceMatcher
+from pathlib import Path
+
+from together import AsyncTogether
+
+from benchmarks.fake_completion_server import FakeCompletionConfig, start_server
+from service.llm_cache_service import llm_cache
+from service.llm_gateway import llm_gateway
+from service.model_router import LLM_MODEL, LLM_SMALL_MODEL, ROUTING_PRESETS, ModelRouter, model_router
+from service.upload_service import (
+    EXTRACTION_SYSTEM_PROMPT, NORMALIZATION_SYSTEM_PROMPT, REPAIR_SYSTEM_PROMPT, SECTIONS_SYSTEM_PROMPT,
+    STRICT_EXTRACTION_SYSTEM_PROMPT,
+    extract_transactions_chunked, sections_extraction,
+)
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+EXACT_FIELDS = ("date", "amount", "type", "currency", "merchant", "category")
+DESCRIPTION_MATCH = 0.8
+# (seconds to first token, seconds per 1000 completion tokens) used when replaying.
+DEFAULT_MODEL_SPEED = {LLM_MODEL: (0.8, 25.0), LLM_SMALL_MODEL: (0.3, 6.0)}
+
+STAGE_BY_PROMPT = {
+    SECTIONS_SYSTEM_PROMPT: "sections",
+    NORMALIZATION_SYSTEM_PROMPT: "normalize",
+    EXTRACTION_SYSTEM_PROMPT: "extract",
+    STRICT_EXTRACTION_SYSTEM_PROMPT: "extract",
+    REPAIR_SYSTEM_PROMPT: "repair",
+}
+
+
+def request_stage(messages) -> str:
+    return STAGE_BY_PROMPT.get(messages[0]["content"], "unknown")
+
+
+def recording_key(model: str, messages) -> str:
+    prompt = "\n".join(m["content"] for m in messages)
+    return f"{request_stage(messages)}|{model}|{hashlib.sha256(prompt.encode()).hexdigest()[:16]}"
+
+
+# ----- synthetic sample case -----
+
+SYNTHETIC_LINE = re.compile(r"^(\d{2})/(\d{2})/(\d{4}) (.+?) (-?\d+\.\d{2}) RON$")
+SYNTHETIC_MERCHANTS = [
+    ("MEGA IMAGE", "Mega Image", "Groceries"), ("LIDL", "Lidl", "Groceries"),
+    ("OMV PETROM", "OMV Petrom", "Transport"), ("NETFLIX.COM", "Netflix", "Entertainment"),
+    ("GLOVO", "Glovo", "Food & Drinks"), ("CATENA", "Catena", "Health"),
+]
+
+
+def synthetic_case(transactions: int = 60, seed: int = 11) -> dict:
+    rng = random.Random(seed)
+    lines, expected = ["Extras de cont SYNTHETIC SAMPLE", "Sold initial 1000.00 RON"], []
+    for _ in range(transactions):
+        day = rng.randint(1, 28)
+        if rng.random() < 0.15:
+            amount = rng.randint(100000, 600000) / 100
+            description = "Incasare salariu COMPANY SRL"
+            row = {"type": "income", "merchant": None, "category": None}
+        else:
+            raw, merchant, category = rng.choice(SYNTHETIC_MERCHANTS)
+            amount = rng.randint(500, 50000) / 100
+            description = f"Plata la POS {raw}"
+            row = {"type": "expense", "merchant": merchant, "category": category}
+        lines.append(f"{day:02d}/03/2025 {description} {amount:.2f} RON")
+        if rng.random() < 0.1:
+            lines.append(f"Sold zilnic {rng.randint(100000, 900000) / 100:.2f} RON")
+        expected.append({"date": f"2025-03-{day:02d}", "amount": amount, "currency": "RON",
+                         "description": description, **row})
+    lines.append("Total intrari 0.00 Total iesiri 0.00")
+    return {"name": "synthetic-sample", "statement_text": "\n".join(lines),
+            "expected_transactions": expected, "recordings": None}
+
+
+def synthetic_row(line: str):
+    match = SYNTHETIC_LINE.match(line.strip())
+    if not match:
+        return None
+    day, month, year, description, amount = match.groups()
+    row = {"date": f"{year}-{month}-{day}", "amount": float(amount), "currency": "RON", "description": description,
+           "type": "income" if description.startswith("Incasare") else "expense"}
+    for raw, merchant, category in SYNTHETIC_MERCHANTS:
+        if raw in description:
+            row.update(merchant=merchant, category=category)
+    return row
+
+
+def synthetic_responder(body) -> str:
+    """Rule-based stand-in: exact for the large model, the small one merges some lines when flattening."""
+    model, messages = body["model"], body["messages"]
+    stage, text = request_stage(messages), messages[-1]["content"]
+    lines = [line.strip() for line in text.splitlines() if SYNTHETIC_LINE.match(line.strip())]
+    if stage == "sections":
+        return json.dumps({"transactions": "\n".join(lines), "money_in": None, "money_out": None})
+    if stage == "normalize":
+        if model == LLM_MODEL:
+            return "\n".join(lines)
+        merged = []
+        for line in lines:
+            if merged and int(hashlib.md5(line.encode()).hexdigest(), 16) % 100 < 4:
+                merged[-1] += " " + line
+            else:
+                merged.append(line)
+        return "\n".join(merged)
+    if stage == "extract":
+        rows = [row for row in map(synthetic_row, lines) if row]
+        return json.dumps({"root": rows})
+    return ""
+
+
+# ----- replay and recording -----
+
+def replay_responder(case: dict, misses: list):
+    def respond(body):
+        key = recording_key(body["model"], body["messages"])
+        if key not in case["recordings"]:
+            misses.append(key)
+            return json.dumps({"root": []}) if key.startswith("extract|") else "{}"
+        return case["recordings"][key]
+    return respond
+
+
+class RecordingClient:
+    """Wraps the provider client and stores every completion under its recording key."""
+
+    def __init__(self, client, recordings: dict):
+        self._client = client
+        self.recordings = recordings
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **params):
+        key = recording_key(params["model"], params["messages"])
+        if not params.get("stream"):
+            response = await self._client.chat.completions.create(**params)
+            self.recordings[key] = response.choices[0].message.content
+            return response
+        return self._record_stream(key, await self._client.chat.completions.create(**params))
+
+    async def _record_stream(self, key, stream):
+        parts = []
+        async for chunk in stream:
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+            yield chunk
+        self.recordings[key] = "".join(parts)
+
+
+class StageTimer:
+    """Times gateway calls per pipeline stage by wrapping the shared gateway's methods."""
+
+    def __init__(self):
+        self.seconds = defaultdict(list)
+        self._complete, self._stream = llm_gateway.complete, llm_gateway.stream
+
+    def install(self):
+        timer = self
+
+        async def complete(**params):
+            start = time.perf_counter()
+            try:
+                return await timer._complete(**params)
+            finally:
+                timer.seconds[request_stage(params["messages"])].append(time.perf_counter() - start)
+
+        async def stream(**params):
+            start = time.perf_counter()
+            try:
+                async for chunk in timer._stream(**params):
+                    yield chunk
+            finally:
+                timer.seconds[request_stage(params["messages"])].append(time.perf_counter() - start)
+
+        llm_gateway.complete, llm_gateway.stream = complete, stream
+
+    def uninstall(self):
+        llm_gateway.complete, llm_gateway.stream = self._complete, self._stream
+
+
+async def run_pipeline(statement_text: str):
+    start = time.perf_counter()
+    transactions_text, _, _ = await sections_extraction(statement_text)
+    rows, _, _ = await extract_transactions_chunked(transactions_text)
+    return rows, time.perf_counter() - start
+
+
+# ----- scoring -----
+
+def match_rows(expected, predicted):
+    """Pairs predicted rows with expected ones on (date, amount), best description first."""
+    remaining = defaultdict(list)
+    for row in predicted:
+        remaining[(row.get("date"), round(float(row.get("amount") or 0), 2))].append(row)
+    pairs = []
+    for row in expected:
+        candidates = remaining.get((row["date"], round(float(row["amount"]), 2)))
+        if not candidates:
+            continue
+        best = max(candidates, key=lambda c: description_ratio(row, c))
+        candidates.remove(best)
+        pairs.append((row, best))
+    return pairs
+
+
+def description_ratio(a, b) -> float:
+    return SequenceMatcher(None, (a.get("description") or "").lower(), (b.get("description") or "").lower()).ratio()
+
+
+def score(expected, predicted) -> dict:
+    pairs = match_rows(expected, predicted)
+    fields = {field: sum(e.get(field) == p.get(field) for e, p in pairs) for field in EXACT_FIELDS}
+    fields["description"] = sum(description_ratio(e, p) >= DESCRIPTION_MATCH for e, p in pairs)
+    return {
+        "precision": len(pairs) / len(predicted) if predicted else 0.0,
+        "recall": len(pairs) / len(expected) if expected else 0.0,
+        "fields": {field: count / len(pairs) if pairs else 0.0 for field, count in fields.items()},
+    }
+
+
+# ----- main -----
+
+def load_corpus(names):
+    paths = sorted(CORPUS_DIR.glob("*.json"))
+    cases = [json.loads(p.read_text()) for p in paths]
+    if names:
+        cases = [c for c in cases if c["name"] in names]
+    return cases
+
+
+def routings(args) -> dict:
+    configs = {name: ModelRouter(routes).routes for name, routes in ROUTING_PRESETS.items()}
+    if args.routes:
+        configs["custom"] = ModelRouter.from_spec(args.base_preset, args.routes).routes
+    return configs
+
+
+async def record(args):
+    case = {
+        "name": args.name,
+        "statement_text": Path(args.record).read_text(),
+        "expected_transactions": json.loads(Path(args.expected).read_text()),
+        "recordings": {},
+    }
+    llm_gateway.client = RecordingClient(llm_gateway.client, case["recordings"])
+    for name, routes in routings(args).items():
+        model_router.routes = routes
+        rows, seconds = await run_pipeline(case["statement_text"])
+        print(f"recorded {name:<8} rows={len(rows)} in {seconds:.1f}s")
+    CORPUS_DIR.mkdir(exist_ok=True)
+    path = CORPUS_DIR / f"{args.name}.json"
+    path.write_text(json.dumps(case, ensure_ascii=False, indent=1))
+    print(f"Wrote {len(case['recordings'])} recordings to {path}")
+
+
+async def replay(args, model_speed):
+    cases = load_corpus(args.cases) or [synthetic_case()]
+    print(f"Cases: {', '.join(c['name'] for c in cases)}")
+    for name, routes in routings(args).items():
+        model_router.routes = routes
+        misses, totals = [], defaultdict(list)
+        timer = StageTimer()
+        timer.install()
+        usage = {}
+        try:
+            for case in cases:
+                responder = synthetic_responder if case["recordings"] is None else replay_responder(case, misses)
+                config = FakeCompletionConfig(latency=0.0, responder=responder, model_speed=model_speed)
+                server = start_server(config)
+                llm_gateway.client = AsyncTogether(api_key="fake", base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                                                   max_retries=0)
+                rows, seconds = await run_pipeline(case["statement_text"])
+                server.shutdown()
+                result = score(case["expected_transactions"], rows)
+                totals["wall"].append(seconds)
+                totals["precision"].append(result["precision"])
+                totals["recall"].append(result["recall"])
+                for field, value in result["fields"].items():
+                    totals[field].append(value)
+                for model, counts in config.usage.items():
+                    merged = usage.setdefault(model, defaultdict(int))
+                    for key, value in counts.items():
+                        merged[key] += value
+        finally:
+            timer.uninstall()
+
+        print(f"\n== {name}: " + ", ".join(f"{stage}={model}" for stage, model in routes.items()))
+        stages = " ".join(f"{stage}={statistics.mean(values):.2f}s" for stage, values in timer.seconds.items())
+        print(f"  latency      wall/case={statistics.mean(totals['wall']):.2f}s mean per call: {stages}")
+        for model, counts in usage.items():
+            print(f"  tokens       {model}: requests={counts['requests']} prompt={counts['prompt_tokens']} "
+                  f"completion={counts['completion_tokens']}")
+        print(f"  rows         precision={statistics.mean(totals['precision']):.3f} "
+              f"recall={statistics.mean(totals['recall']):.3f}")
+        print("  fields       " + " ".join(
+            f"{field}={statistics.mean(totals[field]):.3f}" for field in EXACT_FIELDS + ("description",)))
+        if misses:
+            print(f"  {len(misses)} calls had no recording (prompts changed since recording?), e.g. {misses[0]}")
+
+
+def parse_speed(values):
+    speed = dict(DEFAULT_MODEL_SPEED)
+    for item in values or []:
+        model, _, timing = item.partition("=")
+        first_token, per_1k = (float(v) for v in timing.split(","))
+        speed[model] = (first_token, per_1k)
+    return speed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="*", help="corpus case names to replay (default: all)")
+    parser.add_argument("--routes", help='extra routing to compare, e.g. "normalize=<model>,extract=<model>"')
+    parser.add_argument("--base-preset", default="single", choices=sorted(ROUTING_PRESETS))
+    parser.add_argument("--speed", action="append",
+                        help='replayed model speed "model=first_token_s,s_per_1k_tokens"; repeatable')
+    parser.add_argument("--record", help="statement text file to record against the provider")
+    parser.add_argument("--expected", help="expected transactions JSON for --record")
+    parser.add_argument("--name", help="corpus case name for --record")
+    args = parser.parse_args()
+
+    # Cached stage outputs would hide both the latency and the routed model's answers.
+    llm_cache.enabled = False
+    if args.record:
+        if not (args.expected and args.name):
+            parser.error("--record needs --expected and --name")
+        await record(args)
+    else:
+        await replay(args, parse_speed(args.speed))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
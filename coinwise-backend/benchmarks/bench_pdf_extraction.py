@@ -0,0 +1,43 @@
+"""
+Compares the serial page loop against process-pool extraction.
+
+Usage (from coinwise-backend/):
+    python -m benchmarks.bench_pdf_extraction statement.pdf --workers 1 2 4 8 --repeat 3
+"""
+import argparse
+import time
+
+from service.pdf_extraction_service import count_pages, extract_pages, extract_pages_serial
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    page_count = count_pages(args.pdf)
+    print(f"{args.pdf}: {page_count} pages")
+
+    baseline, expected = timed(lambda: extract_pages_serial(args.pdf), args.repeat)
+    print(f"serial      {baseline:8.3f}s  {page_count / baseline:8.1f} pages/s")
+
+    for workers in args.workers:
+        elapsed, pages = timed(lambda: extract_pages(args.pdf, workers=workers), args.repeat)
+        assert pages == expected, "parallel extraction changed page text or order"
+        print(f"workers={workers:<3} {elapsed:8.3f}s  {page_count / elapsed:8.1f} pages/s  x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Local stand-in for the Together chat completions API, with injectable latency
+and failures, for exercising service/llm_gateway.py without the provider.
+
+Usage (from coinwise-backend/):
+    python -m benchmarks.fake_completion_server --port 8765 --latency 0.2 --tail-rate 0.05 --fail-rate 0.1
+    LLM_BASE_URL=http://127.0.0.1:8765/v1 TOGETHER_API_KEY=fake uvicorn app.main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT = json.dumps({"root": [
+    {"date": "2025-03-01", "amount": 59.99, "currency": "RON", "type": "expense",
+     "description": "POS payment at Mega Image", "merchant": "Mega Image", "category": "Groceries"},
+    {"date": "2025-03-02", "amount": 4500.0, "currency": "RON", "type": "income",
+     "description": "Salary from Company SRL"},
+]})
+
+
+class FakeCompletionConfig:
+    """
+    responder, when set, is called with the request body and returns the
+    completion text. model_speed maps a model to (seconds before the first
+    token, seconds per 1000 completion tokens) and replaces the fixed latency.
+    Token counts are estimated at 4 characters per token and accumulated per
+    model in `usage`.
+    """
+
+    def __init__(self, latency=0.1, tail_rate=0.0, tail_latency=5.0, fail_rate=0.0, fail_status=503,
+                 content=DEFAULT_CONTENT, stream_chunk_chars=40, seed=None, responder=None, model_speed=None):
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.content = content
+        self.stream_chunk_chars = stream_chunk_chars
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.responder = responder
+        self.model_speed = model_speed or {}
+        self.usage = {}
+
+    def completion_for(self, body):
+        return self.responder(body) if self.responder else self.content
+
+    def record_usage(self, model, body, content):
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        with self.lock:
+            totals = self.usage.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+        return prompt_tokens, completion_tokens
+
+    def generation_seconds(self, model, content):
+        first_token, per_1k = self.model_speed.get(model, (0.0, 0.0))
+        return first_token, per_1k * len(content) / 4 / 1000
+
+    def draw(self):
+        with self.lock:
+            self.requests += 1
+            return self.rng.random(), self.rng.random()
+
+
+def make_handler(config: FakeCompletionConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            fail_draw, tail_draw = config.draw()
+            time.sleep(config.tail_latency if tail_draw < config.tail_rate else config.latency)
+            if fail_draw < config.fail_rate:
+                self._json(config.fail_status, {"error": {"message": "injected failure"}})
+                return
+            content = config.completion_for(body)
+            prompt_tokens, completion_tokens = config.record_usage(body.get("model"), body, content)
+            first_token, generation = config.generation_seconds(body.get("model"), content)
+            time.sleep(first_token)
+            if body.get("stream"):
+                self._stream(body, content, generation)
+            else:
+                time.sleep(generation)
+                self._json(200, {
+                    "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+        def _json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, body, content, generation):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            step = config.stream_chunk_chars
+            pause = generation * step / max(len(content), 1)
+            for i in range(0, len(content), step):
+                time.sleep(pause)
+                chunk = {
+                    "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_server(config: FakeCompletionConfig, port: int = 0) -> ThreadingHTTPServer:
+    """Starts the server on a daemon thread; base URL is http://127.0.0.1:<server.server_port>/v1."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    args = parser.parse_args()
+    config = FakeCompletionConfig(args.latency, args.tail_rate, args.tail_latency, args.fail_rate, args.fail_status)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(config))
+    print(f"Fake completion server on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+
+StageStatus = Literal["pending", "running", "completed", "failed", "skipped"]
+JobStatus = Literal["queued", "running", "completed", "failed"]
+
+
+class UploadStage(BaseModel):
+    name: str
+    status: StageStatus = "pending"
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    detail: Optional[str] = None
+
+
+class UploadJob(BaseModel):
+    id: str
+    user_id: str
+    filename: str
+    status: JobStatus = "queued"
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    stages: List[UploadStage] = Field(default_factory=list)
+    extraction_path: Optional[str] = None
+    page_filter: Optional[Dict[str, Any]] = None
+    memory: Optional[Dict[str, Any]] = None
+    period_start: Optional[str] = None
+    period_end: Optional[str] = None
+    overlap: Optional[Dict[str, Any]] = None
+    duplicate_of: Optional[str] = None
+    inserted_transaction_ids: List[str] = Field(default_factory=list)
+    skipped_duplicates: int = 0
+    money_in: Optional[str] = None
+    money_out: Optional[str] = None
+    reconciliation: Optional[Dict[str, Any]] = None
+    llm_usage: Optional[Dict[str, Dict[str, Any]]] = None
+    resumable: bool = False
+    replay_of: Optional[str] = None
+    error: Optional[str] = None
+
+
+class UploadJobAccepted(BaseModel):
+    job_id: str
+    status: JobStatus
+    status_url: str
+
+
+class UploadBatchFile(BaseModel):
+    filename: str
+    job_id: Optional[str] = None
+    status: Literal["rejected", "queued", "running", "completed", "failed"] = "queued"
+    error: Optional[str] = None
+    inserted_transactions: int = 0
+    skipped_duplicates: int = 0
+    duplicate_of: Optional[str] = None
+    duration_seconds: Optional[float] = None
+
+
+class UploadBatch(BaseModel):
+    id: str
+    user_id: str
+    status: JobStatus = "queued"
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    files: List[UploadBatchFile] = Field(default_factory=list)
+    inserted_transactions: int = 0
+    link_budgets_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class UploadBatchAccepted(BaseModel):
+    batch_id: str
+    status: JobStatus
+    status_url: str
+    files: List[UploadBatchFile]
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime
 import logging
 from fastapi import APIRouter, Depends, HTTPException
@@ -15,6 +16,7 @@ from lib import get_supabase_client
 from models.transactions import PaginatedTransactions, Transaction, TransactionUpdate
 from routes.auth import get_current_user, User
 from service.budget_service import try_link_to_budget_and_update, update_budget_after_transaction_change
+from service.duplicate_check_service import split_existing_duplicates
 from service.transactions_service import find_near_duplicate_transactions
 security = HTTPBearer()
 router = APIRouter()
@@ -85,6 +87,7 @@ async def get_transactions(
 @router.post("/add", status_code=status.HTTP_201_CREATED)
 async def add_transaction(
     transaction: Dict[str, Any] = Body(...),
+    allow_duplicate: bool = Query(False, description="Insert even if a near-duplicate already exists"),
     current_user: User = Depends(get_current_user)
 ):
     logger.info(f"Adding transaction for user {current_user.id}")
@@ -120,6 +123,15 @@ async def add_transaction(
         else:
             raise HTTPException(status_code=400, detail=f"Invalid transaction type: {tx_type}")
 
+        if not allow_duplicate:
+            _, duplicates = await asyncio.to_thread(split_existing_duplicates, [transaction], str(current_user.id))
+            if duplicates:
+                existing = duplicates[0][1]
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail={"message": "A similar transaction already exists", "existing_id": existing.get("id")},
+                )
+
         res = supabase.table("transactions").insert(transaction).execute()
         inserted_tx = res.data[0]
 
@@ -282,7 +294,7 @@ async def remove_duplicate_transactions(
         if not all_txs:
             return DeduplicationResult(removed_count=0, removed_ids=[])
 
-        duplicate_ids = find_near_duplicate_transactions(all_txs)
+        duplicate_ids = await asyncio.to_thread(find_near_duplicate_transactions, all_txs)
 
         if duplicate_ids:
             for tx_id in duplicate_ids:
@@ -1,13 +1,34 @@
+import asyncio
+import json
 import logging
-import os
-import re
-import time
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
-import pdfplumber
+from models.uploads import UploadBatch, UploadBatchAccepted, UploadBatchFile, UploadJob, UploadJobAccepted
 from routes.auth import User, get_current_user
-from service.budget_service import auto_link_transactions_to_budgets
-from service.upload_service import anonymize_text, normalize_and_extract, sections_extraction, store_transactions_in_db
+from service.auth_service import ADMIN_USER_IDS, require_admin
+from service.llm_cache_service import llm_cache
+from service.llm_usage_service import fetch_usage, usage_report
+from service.statement_parsers import path_counts
+from service.upload_job_service import (
+    MAX_UPLOAD_BYTES,
+    UPLOAD_BATCH_MAX_FILES,
+    UploadNotResumable,
+    UploadQueueFull,
+    UploadRejected,
+    UploadTooLarge,
+    get_batch,
+    get_job,
+    get_job_events,
+    read_upload,
+    replay_storage_stages,
+    resume_upload_job,
+    submit_upload_batch,
+    submit_upload_job,
+    validate_upload,
+)
 
 
 
@@ -24,98 +45,258 @@ logging.basicConfig(
 )
 logger = logging.getLogger("upload_processor")
 
+# Room for the multipart boundaries and part headers around each file.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def upload_body_limits(prefix: str) -> Dict[str, int]:
+    """Request body limits of the upload routes mounted under prefix, by path."""
+    return {
+        f"{prefix}/": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+        f"{prefix}/batch": UPLOAD_BATCH_MAX_FILES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES),
+    }
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Enforces the upload body limits while the body streams in, before
+    Starlette spools the multipart form: a larger Content-Length is answered
+    with 413 without reading the body, and a body that runs past the limit is
+    cut off with 413 as soon as it does.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            logger.warning(f"Rejected upload to {scope['path']} declaring {int(content_length)} bytes")
+            await self._reject(send)
+            return
+
+        received = 0
+        response_started = False
+        rejected = False
 
-BANK_STATEMENT_KEYWORDS = [
-    r"\bCont(?:ul)?\b", r"\bIBAN\b", r"\bSold\b", r"\bData\b", r"\bTranzacții\b",
-    r"\bPlată\b", r"\bComision\b", r"\bSumă\b",
-    r"\bStatement\b", r"\bBalance\b", r"\bAccount\b", r"\bTransaction\b",
-    r"\bAmount\b", r"\bPayment\b"
-]
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit and not response_started:
+                    logger.warning(f"Rejected upload to {scope['path']} after {received} bytes")
+                    rejected = True
+                    await self._reject(send)
+                    # The route sees a disconnected client and stops reading; its error response is dropped.
+                    return {"type": "http.disconnect"}
+            return message
 
-def is_probably_bank_statement(text: str) -> bool:
-    hits = sum(bool(re.search(p, text, flags=re.IGNORECASE)) for p in BANK_STATEMENT_KEYWORDS)
-    return hits >= 2 
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            response_started = True
+            await send(message)
 
+        await self.app(scope, limited_receive, guarded_send)
 
-@router.post("/", response_model=dict)
+    @staticmethod
+    async def _reject(send):
+        body = json.dumps({"detail": "File is too large."}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+@router.post("/", response_model=UploadJobAccepted, status_code=status.HTTP_202_ACCEPTED)
 async def upload_pdf(file: UploadFile = File(...),  current_user: User = Depends(get_current_user)):
     logger.info(f"Processing upload for file: {file.filename}")
-    start_time = time.time()
-    
 
-    pdf_file_path = f"temp_{file.filename}"
-    logger.info(f"Saving uploaded file to {pdf_file_path}")
-    
     try:
-        with open(pdf_file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-            logger.info(f"File saved: {pdf_file_path} ({len(content)} bytes)")
+        buffer = await read_upload(file)
+    except UploadTooLarge as e:
+        logger.warning(f"Rejected oversized upload {file.filename}: {e}")
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
     except Exception as e:
-        logger.error(f"Error saving uploaded file: {str(e)}")
+        logger.error(f"Error reading uploaded file: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Error saving uploaded file: {str(e)}")
 
-   
     try:
-        logger.info(f"Extracting text from PDF: {pdf_file_path}")
-        with pdfplumber.open(pdf_file_path) as pdf:
-            pages = []
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                pages.append(page_text)
-                logger.debug(f"Extracted page {i+1}/{len(pdf.pages)}: {len(page_text)} characters")
-            
-            raw_text = "\n".join(pages)
-            logger.info(f"Extracted {len(raw_text)} characters from {len(pdf.pages)} pages")
+        await validate_upload(buffer)
+        job = await submit_upload_job(buffer, file.filename, current_user)
+    except UploadRejected as e:
+        buffer.close()
+        logger.warning(f"Rejected upload {file.filename}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadQueueFull as e:
+        buffer.close()
+        logger.warning(f"Rejecting upload for user {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except Exception as e:
-        logger.error(f"Error extracting text from PDF: {str(e)}")
-    
-        if os.path.exists(pdf_file_path):
-            os.remove(pdf_file_path)
-            logger.info(f"Removed temporary file: {pdf_file_path}")
-        raise HTTPException(status_code=400, detail=f"Error extracting text from PDF: {str(e)}")
-    
-
-    if os.path.exists(pdf_file_path):
-        os.remove(pdf_file_path)
-        logger.info(f"Removed temporary file: {pdf_file_path}")
-        
-    if len(raw_text.strip()) < 500:
-        logger.warning("PDF text is too short to be a valid bank statement.")
-        raise HTTPException(status_code=400, detail="This PDF is too short to be a valid bank statement.")
-
-    if not is_probably_bank_statement(raw_text):
-        logger.warning("Uploaded PDF does not appear to be a bank statement.")
-        raise HTTPException(status_code=400, detail="This PDF does not appear to be a bank statement.")
-
-
-    logger.info("Anonymizing extracted text")
-    anonymized_text, entity_map_id, entity_map = await anonymize_text(raw_text,current_user)
-    logger.info(f"Text anonymized with entity map ID: {entity_map_id}")
-
-    
-    logger.info("Extracting transaction sections")
-    transactions,money_in,money_out = sections_extraction(anonymized_text)
-
-    logger.info(f"Extracted {len(transactions)} transactions")
-    logger.info(f"Total money in: {money_in}, Total money out: {money_out}")
-
-    logger.info("Normalizing and extracting entities from transactions")
-    transactions = normalize_and_extract(transactions)
-
-    logger.info("Storing transactions in database")
-    inserted_transaction_ids =store_transactions_in_db(transactions["root"],current_user.id,entity_map)
-    logger.info(f"Inserted {len(inserted_transaction_ids)} transactions into the database")
-
-    logger.info("Attempting to auto-link transactions to budgets")
-    auto_link_transactions_to_budgets(current_user.id, inserted_transaction_ids)
-    logger.info("Auto-linking transactions to budgets completed")
-    
-    elapsed_time = time.time() - start_time
-    logger.info(f"Upload processing completed in {elapsed_time:.2f} seconds")
+        buffer.close()
+        logger.error(f"Error queueing uploaded file: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Error saving uploaded file: {str(e)}")
 
-    return {
-        "message": "Transactions processed and stored successfully!",
-    }
+    logger.info(f"Queued upload job {job.id} for file: {file.filename}")
+    return UploadJobAccepted(job_id=job.id, status=job.status, status_url=f"/api/upload/jobs/{job.id}")
+
+
+@router.post("/batch", response_model=UploadBatchAccepted, status_code=status.HTTP_202_ACCEPTED)
+async def upload_pdf_batch(files: List[UploadFile] = File(...), current_user: User = Depends(get_current_user)):
+    """
+    Accepts several statements at once. Files failing validation are reported
+    as rejected; the rest are processed concurrently and their transactions
+    are linked to budgets in one pass once every file has finished.
+    """
+    logger.info(f"Processing batch upload of {len(files)} files for user {current_user.id}")
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {UPLOAD_BATCH_MAX_FILES} files.")
+
+    accepted = []
+    rejected = []
+    seen_hashes = set()
+    for file in files:
+        buffer = None
+        try:
+            buffer = await read_upload(file)
+            if buffer.sha256 in seen_hashes:
+                raise UploadRejected("The same file appears more than once in this batch.")
+            await validate_upload(buffer)
+        except (UploadRejected, UploadTooLarge) as e:
+            if buffer:
+                buffer.close()
+            logger.warning(f"Rejected batch file {file.filename}: {e}")
+            rejected.append(UploadBatchFile(filename=file.filename, status="rejected", error=str(e)))
+            continue
+        except Exception as e:
+            if buffer:
+                buffer.close()
+            logger.error(f"Error reading batch file {file.filename}: {str(e)}")
+            rejected.append(UploadBatchFile(filename=file.filename, status="rejected", error=f"Error saving uploaded file: {str(e)}"))
+            continue
+        seen_hashes.add(buffer.sha256)
+        accepted.append((buffer, file.filename))
+
+    try:
+        batch = submit_upload_batch(accepted, rejected, current_user)
+    except UploadQueueFull as e:
+        for buffer, _ in accepted:
+            buffer.close()
+        logger.warning(f"Rejecting batch upload for user {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return UploadBatchAccepted(
+        batch_id=batch.id, status=batch.status, status_url=f"/api/upload/batches/{batch.id}", files=batch.files,
+    )
 
 
+@router.get("/batches/{batch_id}", response_model=UploadBatch)
+async def get_upload_batch(batch_id: str, current_user: User = Depends(get_current_user)):
+    batch = get_batch(batch_id)
+    if not batch or batch.user_id != str(current_user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload batch not found")
+    return batch
+
+
+@router.get("/jobs/{job_id}", response_model=UploadJob)
+async def get_upload_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = get_job(job_id)
+    # Admins can follow the replay jobs they start for other users.
+    if not job or (job.user_id != str(current_user.id) and str(current_user.id) not in ADMIN_USER_IDS):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/resume", response_model=UploadJobAccepted, status_code=status.HTTP_202_ACCEPTED)
+async def resume_upload(job_id: str, current_user: User = Depends(get_current_user)):
+    """Resumes a failed upload from the last stage it completed, without uploading the file again."""
+    try:
+        job = await resume_upload_job(job_id, current_user)
+    except UploadNotResumable as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except UploadQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return UploadJobAccepted(job_id=job.id, status=job.status, status_url=f"/api/upload/jobs/{job.id}")
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_upload_job_events(
+    job_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Server-Sent Events stream of an upload job: job status changes, stage
+    transitions with durations, and progress within stages (pages, LLM
+    chunks, inserted transactions). Replays past events on connect and
+    resumes after Last-Event-ID on reconnect; ends when the job finishes.
+    """
+    job = get_job(job_id)
+    events = get_job_events(job_id)
+    if not job or not events or job.user_id != str(current_user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload job not found")
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    async def event_stream():
+        async for event in events.stream(start):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/cache/stats", response_model=dict)
+async def get_llm_cache_stats(admin: User = Depends(require_admin)):
+    return await asyncio.to_thread(llm_cache.stats)
+
+
+@router.get("/parsers/stats", response_model=dict)
+async def get_parser_stats(admin: User = Depends(require_admin)):
+    return {"paths": dict(path_counts)}
+
+
+@router.get("/admin/llm-usage", response_model=dict)
+async def get_llm_usage_report(
+    days: int = Query(30, ge=1, le=365, description="Look-back window in days"),
+    user_id: Optional[str] = Query(None, description="Restrict to one user"),
+    top: int = Query(10, ge=1, le=100, description="How many of the most expensive uploads to list"),
+    admin: User = Depends(require_admin),
+):
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    try:
+        rows = await asyncio.to_thread(fetch_usage, since, user_id)
+    except Exception as e:
+        logger.error(f"Error fetching LLM usage: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"since": since, **usage_report(rows, top)}
+
+
+@router.post("/admin/jobs/{job_id}/replay", response_model=UploadJobAccepted, status_code=status.HTTP_202_ACCEPTED)
+async def replay_upload_storage(job_id: str, admin: User = Depends(require_admin)):
+    """Stores a job's checkpointed transactions again and re-links budgets, as a new job."""
+    try:
+        job = await replay_storage_stages(job_id)
+    except UploadNotResumable as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    logger.info(f"Admin {admin.id} replaying storage stages of job {job_id} as job {job.id}")
+    return UploadJobAccepted(job_id=job.id, status=job.status, status_url=f"/api/upload/jobs/{job.id}")
@@ -0,0 +1,118 @@
+import hashlib
+import hmac
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger("transaction_processor")
+
+# Server secret keying the placeholders; ANONYMIZATION_SALT is the name earlier deployments used.
+ANONYMIZATION_SECRET = os.getenv("ANONYMIZATION_SECRET") or os.getenv("ANONYMIZATION_SALT", "")
+
+IBAN_PATTERN = r"\b[A-Z]{2}\d{2}[A-Z0-9]{11,30}\b"
+CARD_PATTERN = r"\b(?:\d[ -]*?){13,16}\b"
+
+
+def generate_flexible_name_pattern(full_name: str) -> str:
+    """Creates a regex pattern to match name with optional spaces, hyphens, or newlines."""
+    parts = re.split(r'\s+', full_name.strip())
+    return r'[\s\-]*'.join(map(re.escape, parts))
+
+
+def placeholder_key(user_id: str) -> bytes:
+    """
+    Per-user key for placeholders, derived from the server secret, so the
+    provider cannot link placeholders across users or confirm a guessed value.
+    """
+    if not ANONYMIZATION_SECRET:
+        raise RuntimeError("ANONYMIZATION_SECRET must be set before statements can be anonymized")
+    return hmac.new(ANONYMIZATION_SECRET.encode("utf-8"), str(user_id).encode("utf-8"), hashlib.sha256).digest()
+
+
+def make_placeholder(key: bytes, prefix: str, value: str) -> str:
+    """
+    Keyed placeholder for a value, deterministic per user so the same
+    statement anonymizes to the same text and LLM stage outputs can be served
+    from the cache.
+    """
+    digest = hmac.new(key, f"{prefix}{value}".encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{prefix}{digest[:8]}"
+
+
+class Anonymizer:
+    """
+    Replaces the user's name, IBANs and card numbers in a single regex pass.
+    All patterns are compiled into one alternation; repeated values reuse the
+    same placeholder. Only the name is recorded in the entity map, IBANs and
+    card numbers are never restored.
+    """
+
+    def __init__(self, full_name: Optional[str], key: bytes):
+        self.full_name = (full_name or "").strip()
+        self.key = key
+        alternatives = []
+        if self.full_name:
+            alternatives.append(f"(?P<name>(?i:{generate_flexible_name_pattern(self.full_name)}))")
+        alternatives.append(f"(?P<iban>{IBAN_PATTERN})")
+        alternatives.append(f"(?P<card>{CARD_PATTERN})")
+        self.pattern = re.compile("|".join(alternatives), flags=re.MULTILINE)
+        self.name_placeholder = make_placeholder(self.key, "@name_", self.full_name) if self.full_name else None
+
+    def anonymize(self, text: str) -> Tuple[str, Dict[str, str]]:
+        entity_map: Dict[str, str] = {}
+        counts = {"name": 0, "iban": 0, "card": 0}
+
+        def replace(match: re.Match) -> str:
+            kind = match.lastgroup
+            counts[kind] += 1
+            if kind == "name":
+                entity_map[self.name_placeholder] = self.full_name
+                return self.name_placeholder
+            return make_placeholder(self.key, f"@{kind}_", match.group(0))
+
+        new_text = self.pattern.sub(replace, text)
+        if not counts["name"]:
+            logger.warning("User's name not found in the text.")
+        logger.info(f"Anonymized {counts['name']} names, {counts['iban']} IBANs and {counts['card']} card numbers")
+        return new_text, entity_map
+
+
+@lru_cache(maxsize=256)
+def get_anonymizer(user_id: str, full_name: Optional[str]) -> Anonymizer:
+    return Anonymizer(full_name, placeholder_key(user_id))
+
+
+class Deanonymizer:
+    """
+    Restores placeholders from an entity map. Built once per upload; every
+    placeholder is matched by one compiled alternation, longest first, so a
+    value is restored in a single pass regardless of the map size.
+    """
+
+    SEPARATOR = "\x00"
+
+    def __init__(self, entity_map: Dict[str, str]):
+        self.entity_map = entity_map
+        placeholders = sorted(entity_map, key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, placeholders))) if placeholders else None
+
+    def _replace(self, match: re.Match) -> str:
+        return self.entity_map[match.group(0)]
+
+    def restore(self, value):
+        if self.pattern is None or not isinstance(value, str):
+            return value
+        return self.pattern.sub(self._replace, value)
+
+    def restore_many(self, values: List) -> List:
+        """Restores a list of values with one pass over their joined text."""
+        if self.pattern is None:
+            return list(values)
+        strings = [v for v in values if isinstance(v, str)]
+        if any(self.SEPARATOR in v for v in strings):
+            return [self.restore(v) for v in values]
+        restored = iter(self.restore(self.SEPARATOR.join(strings)).split(self.SEPARATOR))
+        return [next(restored) if isinstance(v, str) else v for v in values]
@@ -1,5 +1,6 @@
 
 import logging
+import os
 from fastapi import APIRouter, Depends, HTTPException,status
 from fastapi import security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -17,6 +18,7 @@ logger = logging.getLogger("auth_routes")
 supabase: Client = get_supabase_client()
 router = APIRouter()
 security = HTTPBearer()
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
 class UserSignUp(BaseModel):
     email: EmailStr = Field(..., description="User email address")
     password: str = Field(..., description="User password")
@@ -111,3 +113,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+
+async def require_admin(current_user: User = Depends(get_current_user)):
+    """Allows only the users listed in ADMIN_USER_IDS."""
+    if str(current_user.id) not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
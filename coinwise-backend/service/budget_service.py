@@ -54,6 +54,14 @@ def auto_link_transactions_to_budgets(user_id: str, transaction_ids: List[str]):
         logger.warning("No matching transactions found.")
         return
 
+    # Linking the same transactions again (e.g. when an upload is replayed) must not duplicate links.
+    existing_res = (
+        supabase.table("budget_transactions")
+        .select("budget_id, transaction_id")
+        .in_("transaction_id", [tx["id"] for tx in transactions_res.data])
+        .execute()
+    )
+    existing_links = {(link["budget_id"], link["transaction_id"]) for link in existing_res.data or []}
     links_to_insert = []
 
     for tx in transactions_res.data:
@@ -63,7 +71,7 @@ def auto_link_transactions_to_budgets(user_id: str, transaction_ids: List[str]):
 
         matching_budgets = budgets_by_category.get(tx_cat, [])
         for budget in matching_budgets:
-            if budget["start_date"] <= tx_date <= budget["end_date"]:
+            if budget["start_date"] <= tx_date <= budget["end_date"] and (budget["id"], tx_id) not in existing_links:
                 links_to_insert.append({
                     "budget_id": budget["id"],
                     "transaction_id": tx_id,
@@ -0,0 +1,64 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from supabase import Client
+
+from lib import get_supabase_client
+from service.transactions_service import find_existing_duplicates
+
+
+logger = logging.getLogger("transaction_processor")
+supabase: Client = get_supabase_client()
+
+
+def fetch_transactions_in_window(user_id: str, start_date: str, end_date: str) -> List[Dict]:
+    return (
+        supabase.table("transactions")
+        .select("id, type, date, amount, description, merchant, sender, receiver")
+        .eq("user_id", str(user_id))
+        .gte("date", start_date)
+        .lte("date", end_date)
+        .execute()
+        .data
+        or []
+    )
+
+
+def split_existing_duplicates(
+    new_transactions: List[Dict],
+    user_id: str,
+    exclude_ids: Optional[Iterable[str]] = None,
+) -> Tuple[List[Dict], List[Tuple[Dict, Dict]]]:
+    """
+    Checks new transactions against the user's stored transactions in the same
+    date window before they are inserted. Returns the transactions to insert
+    and the (new, existing) duplicate pairs. Rows in exclude_ids, such as rows
+    already inserted by the same upload, are not treated as existing.
+    """
+    comparable = {}
+    for position, tx in enumerate(new_transactions):
+        try:
+            if tx.get("date") and tx.get("type"):
+                comparable[position] = dict(tx, amount=float(tx["amount"]), position=position)
+        except (TypeError, ValueError):
+            continue
+    if not comparable:
+        return new_transactions, []
+
+    dates = [tx["date"] for tx in comparable.values()]
+    excluded = set(exclude_ids or [])
+    existing = [
+        dict(tx, amount=float(tx["amount"]))
+        for tx in fetch_transactions_in_window(user_id, min(dates), max(dates))
+        if tx["id"] not in excluded and tx.get("amount") is not None
+    ]
+    if not existing:
+        return new_transactions, []
+
+    found = find_existing_duplicates(list(comparable.values()), existing)
+    matches = [(new_transactions[new["position"]], stored) for new, stored in found]
+    duplicate_positions = {new["position"] for new, _ in found}
+    accepted = [tx for position, tx in enumerate(new_transactions) if position not in duplicate_positions]
+    if matches:
+        logger.info(f"Skipping {len(matches)} transactions already stored for user {user_id}")
+    return accepted, matches
@@ -0,0 +1,83 @@
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+
+logger = logging.getLogger("transaction_processor")
+
+
+class IncrementalJSONArrayParser:
+    """
+    Incrementally parses streamed JSON text and returns each object of the
+    first array encountered as soon as its closing brace arrives. Works for a
+    bare array (`[{...}, ...]`) as well as an array nested in a wrapper object
+    (`{"root": [{...}, ...]}`). Consumed text is discarded so memory stays
+    bounded by the size of a single object. Objects that are not valid JSON
+    are kept in `malformed` with their position among all array objects.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth = None
+        self._object_start = None
+        self.objects_seen = 0
+        self.malformed: List[Tuple[int, str]] = []
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        self._buffer += text
+        objects = []
+        buffer = self._buffer
+        for i in range(self._pos, len(buffer)):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch == "[":
+                self._stack.append(ch)
+                if self._array_depth is None:
+                    self._array_depth = len(self._stack)
+            elif ch == "{":
+                self._stack.append(ch)
+                if self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._object_start = i
+            elif ch in "]}":
+                if self._stack:
+                    self._stack.pop()
+                if ch == "}" and self._object_start is not None and len(self._stack) == self._array_depth:
+                    raw = buffer[self._object_start:i + 1]
+                    self._object_start = None
+                    try:
+                        objects.append(json.loads(raw))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Skipping malformed streamed object: {e}")
+                        self.malformed.append((self.objects_seen, raw))
+                    self.objects_seen += 1
+
+        self._pos = len(buffer)
+        keep_from = self._object_start if self._object_start is not None else self._pos
+        self._buffer = buffer[keep_from:]
+        self._pos -= keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return objects
+
+    @property
+    def found_array(self) -> bool:
+        return self._array_depth is not None
+
+    @property
+    def pending_text(self) -> str:
+        """Text of an object that was started but never closed."""
+        return self._buffer if self._object_start is not None else ""
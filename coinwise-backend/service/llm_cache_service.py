@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+
+logger = logging.getLogger("transaction_processor")
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+
+class LLMCache:
+    """
+    Content-addressed store for parsed LLM stage outputs, backed by SQLite.
+    Entries are evicted least-recently-used first once the stored payloads
+    exceed max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+        self._evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._total_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            self._conn.commit()
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            self._total_bytes = row[0]
+        return self._conn
+
+    @staticmethod
+    def make_key(stage: str, model: str, prompt_version: str, system_prompt: str, text: str) -> str:
+        payload = json.dumps([stage, model, prompt_version, system_prompt, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, stage: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._misses[stage] += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self._hits[stage] += 1
+        logger.info(f"LLM cache hit for stage {stage}")
+        return json.loads(row[0])
+
+    def put(self, key: str, stage: str, value: Any):
+        if not self.enabled:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, stage, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, data, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection):
+        while self._total_bytes > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC LIMIT 1").fetchone()
+            if row is None:
+                self._total_bytes = 0
+                return
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (row[0],))
+            self._total_bytes -= row[1]
+            self._evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = 0
+            if self.enabled:
+                entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            stages = sorted(set(self._hits) | set(self._misses))
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "hits": sum(self._hits.values()),
+                "misses": sum(self._misses.values()),
+                "stages": {
+                    stage: {"hits": self._hits[stage], "misses": self._misses[stage]}
+                    for stage in stages
+                },
+            }
+
+
+llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_ENABLED)
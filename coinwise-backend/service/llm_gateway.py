@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Optional
+
+from together import AsyncTogether
+
+from service.llm_usage import prompt_chars, record_call
+
+
+logger = logging.getLogger("transaction_processor")
+
+# Points the gateway at another OpenAI-compatible server, e.g. the fake one in benchmarks/.
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "120"))
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "300"))
+LLM_STREAM_IDLE_TIMEOUT_SECONDS = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+# Seconds to wait before sending a duplicate of a slow non-streaming request; 0 disables hedging.
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = ("Timeout", "RateLimit", "ServiceUnavailable", "APIConnection", "Connection")
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when a call did not succeed within its deadline, retries included."""
+
+
+class LLMStreamInterrupted(Exception):
+    """Raised when a stream fails after content was delivered and cannot be retried transparently."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "http_status", None) or getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    return any(name in type(exc).__name__ for name in RETRYABLE_ERROR_NAMES)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    status = getattr(exc, "http_status", None) or getattr(exc, "status_code", None)
+    return status == 429 or "RateLimit" in type(exc).__name__
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry attempt (1-based)."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls and rejects calls for
+    `reset_seconds`; then lets a single probe through (half-open) and closes
+    again on its success. A call counts once, after its retries, and being
+    rate limited does not count as a provider failure.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> Optional[object]:
+        """Admits a call or raises LLMUnavailable; returns a probe token when the call is the half-open probe."""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probe is not None):
+            raise LLMUnavailable("The language model provider is degraded, please retry the upload later.")
+        if state == "half_open":
+            self._probe = object()
+            return self._probe
+        return None
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe = None
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            if self.opened_at is None:
+                logger.error(f"LLM circuit breaker opened after {self.consecutive_failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+    def record_rate_limited(self):
+        """Ends a call that gave up on rate limiting without counting it either way."""
+        self._probe = None
+
+    def release(self, probe: Optional[object]):
+        """Frees the probe slot if `probe` still holds it, e.g. when the call was cancelled before an outcome."""
+        if probe is not None and self._probe is probe:
+            self._probe = None
+
+    def record_outcome(self, exc: BaseException):
+        if is_rate_limited(exc):
+            self.record_rate_limited()
+        else:
+            self.record_failure()
+
+
+class LLMGateway:
+    """
+    Async access to the completion API with a deadline per call, jittered
+    exponential retries of transient errors, optional hedged requests and a
+    circuit breaker shared by every upload.
+    """
+
+    def __init__(
+        self,
+        client: Any = None,
+        breaker: Optional[CircuitBreaker] = None,
+        max_retries: int = LLM_MAX_RETRIES,
+        attempt_timeout: float = LLM_ATTEMPT_TIMEOUT_SECONDS,
+        deadline: float = LLM_CALL_DEADLINE_SECONDS,
+        stream_idle_timeout: float = LLM_STREAM_IDLE_TIMEOUT_SECONDS,
+        hedge_after: float = LLM_HEDGE_AFTER_SECONDS,
+    ):
+        self.client = client or AsyncTogether(base_url=LLM_BASE_URL, max_retries=0)
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.stream_idle_timeout = stream_idle_timeout
+        self.hedge_after = hedge_after
+
+    def _remaining(self, deadline_at: float) -> float:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded(f"LLM call did not finish within {self.deadline:.0f}s")
+        return remaining
+
+    async def _retry_wait(self, attempt: int, exc: BaseException, deadline_at: float):
+        """Waits before the next attempt, or records the call's failure and raises when it gives up."""
+        if attempt > self.max_retries or not is_retryable(exc):
+            self.breaker.record_outcome(exc)
+            raise exc
+        delay = backoff_delay(attempt)
+        if time.monotonic() + delay >= deadline_at:
+            self.breaker.record_outcome(exc)
+            raise LLMDeadlineExceeded(f"LLM call did not finish within {self.deadline:.0f}s") from exc
+        logger.warning(f"LLM attempt {attempt} failed ({type(exc).__name__}: {exc}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def _hedged(self, params: dict, timeout: float):
+        """Sends the request, and a duplicate if the first is still running after hedge_after seconds."""
+        first = asyncio.ensure_future(self.client.chat.completions.create(**params))
+        tasks = {first}
+        try:
+            if self.hedge_after and self.hedge_after < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    logger.info(f"LLM request slower than {self.hedge_after}s, sending a hedged duplicate")
+                    tasks.add(asyncio.ensure_future(self.client.chat.completions.create(**params)))
+            end = time.monotonic() + timeout
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=max(0, end - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _close_stream(self, stream: Any):
+        close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+        if close is None:
+            return
+        try:
+            await close()
+        except Exception as e:
+            logger.warning(f"Could not close LLM stream: {type(e).__name__}: {e}")
+
+    async def complete(self, stage: str = "unknown", **params):
+        """
+        Non-streaming chat completion; returns the provider response. The call
+        is recorded under `stage` for the current upload's usage accounting.
+        """
+        started = time.monotonic()
+        deadline_at = started + self.deadline
+        attempt = 0
+        response = None
+        probe = None
+        try:
+            while True:
+                attempt += 1
+                if attempt == 1:
+                    probe = self.breaker.before_call()
+                try:
+                    timeout = min(self.attempt_timeout, self._remaining(deadline_at))
+                    response = await self._hedged(params, timeout)
+                except LLMDeadlineExceeded:
+                    self.breaker.record_failure()
+                    raise
+                except Exception as e:
+                    await self._retry_wait(attempt, e, deadline_at)
+                    continue
+                self.breaker.record_success()
+                return response
+        finally:
+            self.breaker.release(probe)
+            content = response.choices[0].message.content if response is not None and response.choices else ""
+            record_call(
+                stage, params.get("model"), prompt_chars(params.get("messages")), len(content or ""),
+                getattr(response, "usage", None), time.monotonic() - started, attempt - 1, response is not None,
+            )
+
+    async def stream(self, stage: str = "unknown", **params) -> AsyncIterator[Any]:
+        """
+        Streaming chat completion yielding the provider's chunks. Failures
+        before the first chunk are retried like complete(); a failure after
+        content was delivered raises LLMStreamInterrupted, since replaying
+        it would duplicate what the caller already consumed.
+        """
+        started = time.monotonic()
+        deadline_at = started + self.deadline
+        attempt = 0
+        completion_size = 0
+        usage = None
+        success = False
+        probe = None
+        try:
+            while True:
+                attempt += 1
+                if attempt == 1:
+                    probe = self.breaker.before_call()
+                delivered = False
+                stream = None
+                try:
+                    timeout = min(self.attempt_timeout, self._remaining(deadline_at))
+                    stream = await asyncio.wait_for(self.client.chat.completions.create(**params, stream=True), timeout)
+                    iterator = stream.__aiter__()
+                    while True:
+                        idle = min(self.stream_idle_timeout, self._remaining(deadline_at))
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), idle)
+                        except StopAsyncIteration:
+                            break
+                        delivered = True
+                        # The provider reports token counts on the final chunk.
+                        usage = getattr(chunk, "usage", None) or usage
+                        if chunk.choices:
+                            completion_size += len(chunk.choices[0].delta.content or "")
+                        yield chunk
+                except LLMDeadlineExceeded:
+                    self.breaker.record_failure()
+                    raise
+                except Exception as e:
+                    if delivered:
+                        self.breaker.record_failure()
+                        raise LLMStreamInterrupted(f"LLM stream failed part way: {type(e).__name__}: {e}") from e
+                    await self._retry_wait(attempt, e, deadline_at)
+                    continue
+                finally:
+                    # Abandoned, timed out or retried streams would otherwise keep their connection open.
+                    await self._close_stream(stream)
+                self.breaker.record_success()
+                success = True
+                return
+        finally:
+            self.breaker.release(probe)
+            record_call(
+                stage, params.get("model"), prompt_chars(params.get("messages")), completion_size,
+                usage, time.monotonic() - started, attempt - 1, success,
+            )
+
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,87 @@
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger("transaction_processor")
+
+USAGE_FIELDS = ("prompt_chars", "completion_chars", "prompt_tokens", "completion_tokens", "duration_ms", "retries")
+
+
+class UsageRecorder:
+    """Collects the LLM calls made on behalf of one upload."""
+
+    def __init__(self, user_id: str, job_id: str):
+        self.user_id = user_id
+        self.job_id = job_id
+        self.calls: List[Dict[str, Any]] = []
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return [{"user_id": self.user_id, "job_id": self.job_id, **call} for call in self.calls]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Totals per stage, as shown on the upload job."""
+        stages: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"calls": 0, "cached": 0, "failed": 0, **dict.fromkeys(USAGE_FIELDS, 0)})
+        for call in self.calls:
+            totals = stages[call["stage"]]
+            totals["calls"] += 1
+            totals["cached"] += call["cached"]
+            totals["failed"] += not call["success"]
+            for field in USAGE_FIELDS:
+                totals[field] += call[field] or 0
+        return dict(stages)
+
+
+_current_recorder: ContextVar[Optional[UsageRecorder]] = ContextVar("llm_usage_recorder", default=None)
+
+
+@contextmanager
+def record_usage(user_id: str, job_id: str):
+    """Attributes every LLM call made inside the block, including from tasks it spawns, to one upload."""
+    recorder = UsageRecorder(user_id, job_id)
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+def prompt_chars(messages) -> int:
+    return sum(len(m.get("content") or "") for m in messages or [])
+
+
+def record_call(
+    stage: str,
+    model: Optional[str],
+    prompt_size: int,
+    completion_size: int,
+    usage: Any,
+    seconds: float,
+    retries: int,
+    success: bool,
+    cached: bool = False,
+):
+    """Records one LLM stage run against the current upload, if any; usage is the provider's token counts."""
+    call = {
+        "stage": stage,
+        "model": model,
+        "prompt_chars": prompt_size,
+        "completion_chars": completion_size,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "duration_ms": round(seconds * 1000),
+        "retries": retries,
+        "success": success,
+        "cached": cached,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    logger.info(
+        f"LLM {stage} on {model}: {call['prompt_tokens']} prompt / {call['completion_tokens']} completion tokens, "
+        f"{call['duration_ms']} ms, {retries} retries, {'ok' if success else 'failed'}{' (cached)' if cached else ''}"
+    )
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.calls.append(call)
@@ -0,0 +1,103 @@
+import logging
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from supabase import Client
+
+from lib import get_supabase_client
+from service.llm_usage import UsageRecorder
+
+
+logger = logging.getLogger("upload_processor")
+supabase: Client = get_supabase_client()
+
+USAGE_PAGE_SIZE = 1000
+PERCENTILES = (50, 90, 99)
+PERCENTILE_FIELDS = ("duration_ms", "prompt_tokens", "completion_tokens", "prompt_chars", "completion_chars")
+
+
+def persist_usage(recorder: UsageRecorder):
+    """Stores one row per LLM call of an upload in the llm_usage table."""
+    rows = recorder.rows()
+    if rows:
+        supabase.table("llm_usage").insert(rows).execute()
+
+
+def fetch_usage(since: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    rows, offset = [], 0
+    while True:
+        query = supabase.table("llm_usage").select("*").gte("created_at", since)
+        if user_id:
+            query = query.eq("user_id", str(user_id))
+        page = query.order("created_at").range(offset, offset + USAGE_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < USAGE_PAGE_SIZE:
+            return rows
+        offset += USAGE_PAGE_SIZE
+
+
+def percentile(values: List[float], q: int) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    return {**{f"p{q}": percentile(values, q) for q in PERCENTILES}, "max": max(values) if values else None}
+
+
+def usage_report(rows: List[Dict[str, Any]], top: int = 10) -> Dict[str, Any]:
+    """
+    Percentiles per stage over provider calls (cache hits are only counted),
+    token totals per user and the uploads that cost the most tokens and time.
+    """
+    stages: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    users: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"uploads": set(), "prompt_tokens": 0, "completion_tokens": 0, "calls": 0})
+    uploads: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"prompt_tokens": 0, "completion_tokens": 0, "duration_ms": 0, "retries": 0})
+
+    for row in rows:
+        stages[row["stage"]].append(row)
+        if row.get("cached"):
+            continue
+        user = users[row["user_id"]]
+        user["uploads"].add(row["job_id"])
+        user["calls"] += 1
+        upload = uploads[row["job_id"]]
+        upload["user_id"] = row["user_id"]
+        for field in ("prompt_tokens", "completion_tokens"):
+            user[field] += row.get(field) or 0
+            upload[field] += row.get(field) or 0
+        upload["duration_ms"] += row.get("duration_ms") or 0
+        upload["retries"] += row.get("retries") or 0
+
+    stage_report = {}
+    for stage, stage_rows in stages.items():
+        calls = [row for row in stage_rows if not row.get("cached")]
+        stage_report[stage] = {
+            "calls": len(calls),
+            "cached": len(stage_rows) - len(calls),
+            "failed": sum(not row.get("success") for row in calls),
+            "retries": sum(row.get("retries") or 0 for row in calls),
+            **{field: distribution([row[field] for row in calls if row.get(field) is not None]) for field in PERCENTILE_FIELDS},
+        }
+
+    user_report = sorted(
+        ({"user_id": user_id, **totals, "uploads": len(totals["uploads"])} for user_id, totals in users.items()),
+        key=lambda u: u["prompt_tokens"] + u["completion_tokens"], reverse=True,
+    )
+    return {
+        "calls": len(rows),
+        "stages": stage_report,
+        "users": user_report,
+        "most_tokens": sorted(
+            ({"job_id": job_id, **totals} for job_id, totals in uploads.items()),
+            key=lambda u: u["prompt_tokens"] + u["completion_tokens"], reverse=True,
+        )[:top],
+        "slowest": sorted(
+            ({"job_id": job_id, **totals} for job_id, totals in uploads.items()),
+            key=lambda u: u["duration_ms"], reverse=True,
+        )[:top],
+    }
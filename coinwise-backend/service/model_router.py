@@ -0,0 +1,49 @@
+import logging
+import os
+from typing import Dict, Optional
+
+
+logger = logging.getLogger("transaction_processor")
+
+LLM_MODEL = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo")
+
+STAGES = ("sections", "normalize", "extract", "repair")
+
+# "tiered" sends section isolation and line flattening, which only copy text around, to the small model.
+# It is opt-in until benchmarks/bench_model_routing.py shows on a recorded corpus that accuracy holds.
+ROUTING_PRESETS: Dict[str, Dict[str, str]] = {
+    "single": {"sections": LLM_MODEL, "normalize": LLM_MODEL, "extract": LLM_MODEL, "repair": LLM_MODEL},
+    "tiered": {"sections": LLM_SMALL_MODEL, "normalize": LLM_SMALL_MODEL, "extract": LLM_MODEL, "repair": LLM_MODEL},
+}
+
+
+class ModelRouter:
+    """Maps each LLM stage of the extraction pipeline to the model that serves it."""
+
+    def __init__(self, routes: Dict[str, str]):
+        unknown = set(routes) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown LLM stages in routing: {sorted(unknown)}")
+        self.routes = {stage: routes.get(stage, LLM_MODEL) for stage in STAGES}
+
+    @classmethod
+    def from_spec(cls, preset: str = "single", overrides: Optional[str] = None) -> "ModelRouter":
+        """
+        Builds a router from a preset name and optional per-stage overrides
+        written as "stage=model,stage=model".
+        """
+        if preset not in ROUTING_PRESETS:
+            raise ValueError(f"Unknown LLM routing preset {preset!r}, expected one of {sorted(ROUTING_PRESETS)}")
+        routes = dict(ROUTING_PRESETS[preset])
+        for item in filter(None, (overrides or "").split(",")):
+            stage, _, model = item.partition("=")
+            routes[stage.strip()] = model.strip()
+        return cls(routes)
+
+    def model_for(self, stage: str) -> str:
+        return self.routes[stage]
+
+
+model_router = ModelRouter.from_spec(os.getenv("LLM_ROUTING", "single"), os.getenv("LLM_MODEL_ROUTES"))
+logger.info(f"LLM model routing: {model_router.routes}")
@@ -0,0 +1,106 @@
+import logging
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Set, Tuple
+
+
+logger = logging.getLogger("upload_processor")
+
+BANK_STATEMENT_KEYWORDS = [
+    r"\bCont(?:ul)?\b", r"\bIBAN\b", r"\bSold\b", r"\bData\b", r"\bTranzacții\b",
+    r"\bPlată\b", r"\bComision\b", r"\bSumă\b",
+    r"\bStatement\b", r"\bBalance\b", r"\bAccount\b", r"\bTransaction\b",
+    r"\bAmount\b", r"\bPayment\b"
+]
+
+SUMMARY_KEYWORDS = re.compile(
+    r"\b(?:Total(?:uri)?|Rulaj|Sold final|Money in|Money out|Total credit|Total debit|Closing balance)\b",
+    re.IGNORECASE,
+)
+DATE_PATTERN = re.compile(
+    r"\b(?:\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}\s+[^\W\d_]{3,}\.?,?\s+\d{4}|[A-Z][a-z]{2} \d{1,2}, \d{4})\b"
+)
+AMOUNT_PATTERN = re.compile(r"\d{1,3}(?:[.,\s]\d{3})*[.,]\d{2}\b")
+
+MIN_TRANSACTION_LINES = int(os.getenv("PAGE_FILTER_MIN_TRANSACTION_LINES", "2"))
+EDGE_LINES = 5
+REPEATED_LINE_MIN_SHARE = 0.6
+REPEATED_LINE_MIN_PAGES = 3
+CHARS_PER_TOKEN = 4
+
+
+def is_probably_bank_statement(text: str) -> bool:
+    hits = sum(bool(re.search(p, text, flags=re.IGNORECASE)) for p in BANK_STATEMENT_KEYWORDS)
+    return hits >= 2
+
+
+def transaction_line_count(page: str) -> int:
+    """Number of lines carrying both a date and an amount."""
+    return sum(1 for line in page.splitlines() if DATE_PATTERN.search(line) and AMOUNT_PATTERN.search(line))
+
+
+def is_transactional_page(page: str) -> bool:
+    return transaction_line_count(page) >= MIN_TRANSACTION_LINES
+
+
+def _line_signature(line: str) -> str:
+    """Normalizes a line so per-page headers like 'Page 3 of 12' compare equal."""
+    return re.sub(r"\d+", "#", line.strip().lower())
+
+
+def find_repeated_lines(pages: List[str]) -> Set[str]:
+    """Signatures of lines that appear near the top or bottom of most pages."""
+    if len(pages) < REPEATED_LINE_MIN_PAGES:
+        return set()
+    counts: Counter = Counter()
+    for page in pages:
+        lines = [l for l in page.splitlines() if l.strip()]
+        edges = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        counts.update({
+            _line_signature(l) for l in edges
+            if not (DATE_PATTERN.search(l) and AMOUNT_PATTERN.search(l))
+        })
+    threshold = max(REPEATED_LINE_MIN_PAGES, REPEATED_LINE_MIN_SHARE * len(pages))
+    return {sig for sig, count in counts.items() if count >= threshold}
+
+
+def strip_lines(page: str, signatures: Set[str]) -> str:
+    if not signatures:
+        return page
+    return "\n".join(l for l in page.splitlines() if _line_signature(l) not in signatures)
+
+
+def filter_statement_pages(pages: List[str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Drops pages without transaction lines (cover pages, disclaimers, fee
+    schedules) except those carrying the final totals, strips headers and
+    footers repeated across pages, and reports the estimated token savings.
+    Falls back to all pages when none looks transactional.
+    """
+    repeated = find_repeated_lines(pages)
+    kept = [
+        i for i, page in enumerate(pages)
+        if is_transactional_page(page) or SUMMARY_KEYWORDS.search(page)
+    ]
+    if not any(is_transactional_page(pages[i]) for i in kept):
+        kept = list(range(len(pages)))
+
+    filtered = "\n".join(strip_lines(pages[i], repeated) for i in kept)
+    chars_before = sum(len(p) for p in pages) + max(len(pages) - 1, 0)
+    report = {
+        "pages_total": len(pages),
+        "pages_kept": len(kept),
+        "repeated_lines_removed": len(repeated),
+        "chars_before": chars_before,
+        "chars_after": len(filtered),
+        "estimated_tokens_before": chars_before // CHARS_PER_TOKEN,
+        "estimated_tokens_after": len(filtered) // CHARS_PER_TOKEN,
+        "token_reduction_pct": round(100 * (1 - len(filtered) / chars_before), 1) if chars_before else 0.0,
+    }
+    logger.info(
+        f"Page filter kept {report['pages_kept']}/{report['pages_total']} pages, "
+        f"~{report['estimated_tokens_before']} -> ~{report['estimated_tokens_after']} tokens "
+        f"({report['token_reduction_pct']}% fewer)"
+    )
+    return filtered, report
@@ -0,0 +1,280 @@
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import pdfplumber
+
+
+logger = logging.getLogger("upload_processor")
+
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+# "parallel" uses the process pool for documents with many pages, "streaming" always extracts
+# in-process one page at a time, "auto" streams files above PDF_PARALLEL_MAX_BYTES.
+PDF_EXTRACTION_MODE = os.getenv("PDF_EXTRACTION_MODE", "auto")
+# Every worker parses its own copy of the file, so large files are streamed instead.
+PDF_PARALLEL_MAX_BYTES = int(os.getenv("PDF_PARALLEL_MAX_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_MEMORY_BUDGET_BYTES = int(os.getenv("UPLOAD_MEMORY_BUDGET_BYTES", str(512 * 1024 * 1024)))
+# Rough cost of one parsed layout object (a character, line or rect in pdfminer plus pdfplumber's dict for it).
+PAGE_OBJECT_BYTES = int(os.getenv("PDF_PAGE_OBJECT_BYTES", "1500"))
+# Form feed keeps page boundaries recoverable; splitlines() treats it as a line break.
+PAGE_SEPARATOR = "\f"
+
+# A path, raw bytes, or a seekable binary file-like object such as an UploadBuffer source.
+PdfSource = Union[str, bytes, BinaryIO]
+# Called with (pages extracted so far, total pages).
+PageProgress = Callable[[int, int], None]
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when an upload's estimated extraction memory outgrows its budget."""
+
+
+class MemoryBudget:
+    """
+    Estimates the memory one upload's extraction holds at its peak and checks
+    it against a fixed budget: the copies of the file being parsed, the
+    layout objects of the pages parsed at the same time (one per worker;
+    each page's objects are released before the next), and the text retained
+    so far. The estimate covers worker processes too, which the process's
+    own resource counters do not.
+    """
+
+    def __init__(self, limit_bytes: int = UPLOAD_MEMORY_BUDGET_BYTES):
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+        self.input_bytes = 0
+        self.page_bytes = 0
+        self.peak_bytes = 0
+
+    def _check(self):
+        estimate = self.input_bytes + self.page_bytes + self.used_bytes
+        self.peak_bytes = max(self.peak_bytes, estimate)
+        if estimate > self.limit_bytes:
+            raise MemoryBudgetExceeded(
+                f"Statement needs more than the memory budget of {self.limit_bytes // (1024 * 1024)} MB to extract."
+            )
+
+    def charge_input(self, size: int, copies: int = 1):
+        """Sets the file copies held while parsing: one per worker process, or one in-process."""
+        self.input_bytes = size * copies
+        self._check()
+
+    def charge(self, text: str, objects: int = 0, concurrent_pages: int = 1):
+        """Adds a page's retained text; its layout objects count as held by each of concurrent_pages pages."""
+        self.used_bytes += len(text.encode("utf-8"))
+        self.page_bytes = max(self.page_bytes, objects * PAGE_OBJECT_BYTES * concurrent_pages)
+        self._check()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "text_bytes": self.used_bytes,
+            "input_bytes": self.input_bytes,
+            "page_object_bytes": self.page_bytes,
+            "estimated_peak_bytes": self.peak_bytes,
+            "budget_bytes": self.limit_bytes,
+        }
+
+
+def _new_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    A pool whose workers start from a clean interpreter: forking the threaded
+    server could copy locks held by other threads into the children.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = _new_pool(PDF_EXTRACTION_WORKERS)
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drops a broken shared pool so the next extraction starts a fresh one."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def open_pdf(source: PdfSource, **kwargs):
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    elif not isinstance(source, str):
+        source.seek(0)
+    return pdfplumber.open(source, **kwargs)
+
+
+def iter_pages(source: PdfSource, pages: Optional[List[int]] = None) -> Iterator[Tuple[str, int]]:
+    """
+    Yields each page's text and layout object count one page at a time,
+    closing each page afterwards so pdfplumber drops its cached layout
+    objects instead of keeping every parsed page alive until the document
+    is closed.
+    """
+    with open_pdf(source, pages=pages) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            objects = sum(len(items) for items in page.objects.values())
+            page.close()
+            yield text, objects
+
+
+def iter_page_texts(source: PdfSource, pages: Optional[List[int]] = None) -> Iterator[str]:
+    return (text for text, _ in iter_pages(source, pages))
+
+
+def _extract_page_range(source: Union[str, bytes], start: int, end: int) -> List[Tuple[str, int]]:
+    """Runs in a worker process: extracts pages [start, end) of the PDF with their object counts."""
+    return list(iter_pages(source, pages=list(range(start + 1, end + 1))))
+
+
+def source_size(source: PdfSource) -> int:
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    if isinstance(source, bytes):
+        return len(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+
+def count_pages(source: PdfSource) -> int:
+    with open_pdf(source) as pdf:
+        return len(pdf.pages)
+
+
+def split_page_ranges(page_count: int, parts: int) -> List[Tuple[int, int]]:
+    """Splits [0, page_count) into at most `parts` contiguous, near-equal ranges."""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def extract_pages_serial(
+    source: PdfSource,
+    budget: Optional[MemoryBudget] = None,
+    on_page: Optional[PageProgress] = None,
+) -> List[str]:
+    page_count = count_pages(source) if on_page else 0
+    if budget:
+        # A path is parsed from disk; a file held in memory counts once.
+        budget.charge_input(0 if isinstance(source, str) else source_size(source))
+    pages = []
+    for i, (page_text, objects) in enumerate(iter_pages(source)):
+        if budget:
+            budget.charge(page_text, objects)
+        pages.append(page_text)
+        logger.debug(f"Extracted page {i+1}: {len(page_text)} characters")
+        if on_page:
+            on_page(i + 1, page_count)
+    return pages
+
+
+def extract_pages(
+    source: PdfSource,
+    workers: Optional[int] = None,
+    budget: Optional[MemoryBudget] = None,
+    on_page: Optional[PageProgress] = None,
+) -> List[str]:
+    """
+    Extracts the text of every page in page order. Documents with at least
+    PDF_PARALLEL_MIN_PAGES pages are split across a process pool; smaller
+    ones are extracted serially since the pool overhead would dominate.
+    In-memory sources are shipped to the workers as bytes. In streaming
+    mode, and in auto mode for files above PDF_PARALLEL_MAX_BYTES, pages are
+    always extracted in-process, one at a time. Each worker's file copy and
+    page objects are charged to the budget as pages arrive, and on_page is
+    told how many pages are done after each page (serially) or each
+    finished range.
+    """
+    workers = PDF_EXTRACTION_WORKERS if workers is None else workers
+    if PDF_EXTRACTION_MODE == "streaming" or workers <= 1:
+        return extract_pages_serial(source, budget, on_page)
+    size = source_size(source)
+    if PDF_EXTRACTION_MODE == "auto" and size > PDF_PARALLEL_MAX_BYTES:
+        logger.info(f"Extracting a {size}-byte PDF in-process, above the {PDF_PARALLEL_MAX_BYTES}-byte parallel limit")
+        return extract_pages_serial(source, budget, on_page)
+
+    page_count = count_pages(source)
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        return extract_pages_serial(source, budget, on_page)
+
+    ranges = split_page_ranges(page_count, workers)
+    starts, ends = zip(*ranges)
+    shipped = source
+    if not isinstance(source, (str, bytes)):
+        source.seek(0)
+        shipped = source.read()
+    sources = [shipped] * len(ranges)
+    logger.info(f"Extracting {page_count} pages across {len(ranges)} worker processes")
+
+    if budget:
+        budget.charge_input(size, copies=len(ranges) + (0 if isinstance(source, str) else 1))
+    shared = workers == PDF_EXTRACTION_WORKERS
+    pool = _get_pool() if shared else _new_pool(workers)
+    charged = budget.used_bytes if budget else 0
+    try:
+        return _collect(pool.map(_extract_page_range, sources, starts, ends), budget, on_page, page_count, len(ranges))
+    except BrokenProcessPool as e:
+        # A worker died (e.g. killed for memory); the pool is unusable from now on.
+        logger.error(f"PDF extraction worker died ({e}), replacing the pool and extracting serially")
+        _discard_pool(pool)
+        shared = False
+        if budget:
+            budget.used_bytes, budget.page_bytes = charged, 0
+        return extract_pages_serial(source, budget, on_page)
+    finally:
+        if not shared:
+            pool.shutdown(wait=False)
+
+
+def _collect(
+    results,
+    budget: Optional[MemoryBudget],
+    on_page: Optional[PageProgress] = None,
+    page_count: int = 0,
+    concurrent_pages: int = 1,
+) -> List[str]:
+    pages = []
+    for chunk in results:
+        for text, objects in chunk:
+            if budget:
+                budget.charge(text, objects, concurrent_pages)
+            pages.append(text)
+        if on_page:
+            on_page(len(pages), page_count)
+    return pages
+
+
+def extract_preview_text(source: PdfSource, max_pages: int) -> str:
+    """Extracts only the first max_pages pages of a PDF."""
+    return PAGE_SEPARATOR.join(iter_page_texts(source, pages=list(range(1, max_pages + 1))))
+
+
+def extract_pdf_text(
+    source: PdfSource,
+    budget: Optional[MemoryBudget] = None,
+    on_page: Optional[PageProgress] = None,
+) -> Tuple[str, int]:
+    """Extracts the text of every page of a PDF, returning it with the page count."""
+    pages = extract_pages(source, budget=budget, on_page=on_page)
+    raw_text = PAGE_SEPARATOR.join(pages)
+    logger.info(f"Extracted {len(raw_text)} characters from {len(pages)} pages")
+    return raw_text, len(pages)
@@ -0,0 +1,106 @@
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from service.statement_fingerprint_service import line_date
+from service.statement_parsers import parse_amount
+
+
+logger = logging.getLogger("upload_processor")
+
+RECONCILIATION_TOLERANCE = float(os.getenv("RECONCILIATION_TOLERANCE", "0.05"))
+# A chunk is flagged when it yields fewer rows than this share of its dated amount lines;
+# balance lines also carry a date and an amount, so the expected count is an over-estimate.
+MIN_ROWS_PER_DATED_LINE = 0.5
+
+SOURCE_AMOUNT_PATTERN = re.compile(r"\d+(?:[.,\s]\d{3})*[.,]\d{2}\b")
+
+
+def parse_total(value: Any) -> Optional[float]:
+    """Parses a money_in/money_out total returned by the sections stage."""
+    if isinstance(value, (int, float)):
+        return abs(float(value))
+    if not isinstance(value, str):
+        return None
+    match = SOURCE_AMOUNT_PATTERN.search(value)
+    amount = parse_amount(match.group(0)) if match else None
+    return abs(amount) if amount is not None else None
+
+
+def source_amounts(text: str) -> Set[float]:
+    amounts = set()
+    for match in SOURCE_AMOUNT_PATTERN.finditer(text):
+        amount = parse_amount(match.group(0))
+        if amount is not None:
+            amounts.add(round(abs(amount), 2))
+    return amounts
+
+
+def is_money_in(tx: Dict, own_names: Iterable[str]) -> bool:
+    """Income and deposits are incoming; a transfer is incoming when the user is its receiver."""
+    if tx.get("type") in ("income", "deposit"):
+        return True
+    if tx.get("type") == "transfer":
+        receiver = (tx.get("receiver") or "").lower()
+        return any(name.lower() in receiver for name in own_names if name)
+    return False
+
+
+def sum_by_direction(transactions: Iterable[Dict], own_names: Iterable[str] = ()) -> Tuple[float, float]:
+    own_names = list(own_names)
+    money_in = money_out = 0.0
+    for tx in transactions:
+        try:
+            amount = abs(float(tx.get("amount")))
+        except (TypeError, ValueError):
+            continue
+        if is_money_in(tx, own_names):
+            money_in += amount
+        else:
+            money_out += amount
+    return round(money_in, 2), round(money_out, 2)
+
+
+def chunk_issues(chunk_text: str, rows: List[Dict], check_row_count: bool = True) -> List[str]:
+    """
+    Local checks of one chunk's extraction against its source text: every
+    extracted amount must appear in the chunk, and with check_row_count the
+    chunk must yield a plausible number of rows for its dated amount lines.
+    """
+    issues = []
+    amounts = source_amounts(chunk_text)
+    missing = [tx.get("amount") for tx in rows if round(abs(float(tx.get("amount") or 0)), 2) not in amounts]
+    if missing:
+        issues.append(f"{len(missing)} amounts not found in the source text")
+    if check_row_count:
+        dated_lines = sum(1 for line in chunk_text.splitlines() if line_date(line))
+        if len(rows) < MIN_ROWS_PER_DATED_LINE * dated_lines:
+            issues.append(f"{len(rows)} rows extracted from {dated_lines} dated lines")
+    return issues
+
+
+def compare_totals(
+    transactions: List[Dict],
+    money_in: Any,
+    money_out: Any,
+    own_names: Iterable[str] = (),
+) -> Dict[str, Any]:
+    """Extracted money in/out against the statement totals; balanced is None when no totals are available."""
+    extracted_in, extracted_out = sum_by_direction(transactions, own_names)
+    expected_in, expected_out = parse_total(money_in), parse_total(money_out)
+    report: Dict[str, Any] = {
+        "extracted_in": extracted_in,
+        "extracted_out": extracted_out,
+        "expected_in": expected_in,
+        "expected_out": expected_out,
+        "balanced": None,
+    }
+    if expected_in is None and expected_out is None:
+        return report
+    report["balanced"] = all(
+        abs(expected - extracted) <= RECONCILIATION_TOLERANCE
+        for expected, extracted in ((expected_in, extracted_in), (expected_out, extracted_out))
+        if expected is not None
+    )
+    return report
@@ -0,0 +1,78 @@
+import os
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+SIMILARITY_MODE = os.getenv("DEDUP_SIMILARITY_MODE", "bounded")  # "bounded" or "reference"
+
+FIELDS_BY_TYPE: Dict[str, Tuple[str, ...]] = {
+    "expense": ("description", "merchant"),
+    "income": ("description",),
+    "deposit": ("description",),
+    "transfer": ("description", "sender", "receiver"),
+}
+
+
+class NormalizedText(NamedTuple):
+    text: str
+    chars: Counter
+
+
+def normalize_str(value: str) -> str:
+    """Lowercase and strip a string for comparison."""
+    return value.strip().lower() if isinstance(value, str) else ""
+
+
+def normalize_text(value: str) -> NormalizedText:
+    """Normalized text and its character counts, computed once per value."""
+    text = normalize_str(value)
+    return NormalizedText(text, Counter(text))
+
+
+def normalize_transaction(tx: Dict) -> Dict[str, NormalizedText]:
+    """Normalizes the text fields the transaction's type is compared on."""
+    return {field: normalize_text(tx.get(field, "")) for field in FIELDS_BY_TYPE.get(tx.get("type"), ())}
+
+
+def bounded_similar(a: NormalizedText, b: NormalizedText, threshold: float = 0.9) -> bool:
+    """
+    Same answer as reference_similar, computed cheaply for most pairs. The
+    SequenceMatcher ratio 2*M/(len(a)+len(b)) is bounded above by the length
+    ratio and by the character multiset overlap, so pairs failing either bound
+    are rejected without matching; the overlap count stops as soon as too many
+    characters are missing. Equal texts are accepted immediately.
+    """
+    if a.text == b.text:
+        return True
+    total = len(a.text) + len(b.text)
+    if 2 * min(len(a.text), len(b.text)) < threshold * total:
+        return False
+    allowed_misses = len(a.text) - threshold * total / 2
+    misses = 0
+    for char, count in a.chars.items():
+        missing = count - b.chars.get(char, 0)
+        if missing > 0:
+            misses += missing
+            if misses > allowed_misses:
+                return False
+    return reference_similar(a, b, threshold)
+
+
+def reference_similar(a: NormalizedText, b: NormalizedText, threshold: float = 0.9) -> bool:
+    """The original SequenceMatcher ratio, kept as the reference semantics."""
+    return SequenceMatcher(None, a.text, b.text).ratio() >= threshold
+
+
+SIMILARITY_FUNCTIONS = {"bounded": bounded_similar, "reference": reference_similar}
+
+
+def fields_similar(
+    a: Dict[str, NormalizedText],
+    b: Dict[str, NormalizedText],
+    threshold: float = 0.9,
+    mode: Optional[str] = None,
+) -> bool:
+    """True when every compared field of two normalized transactions of the same type is similar."""
+    similar = SIMILARITY_FUNCTIONS[mode or SIMILARITY_MODE]
+    return all(similar(a[field], b[field], threshold) for field in a)
@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from supabase import Client
+
+from lib import get_supabase_client
+from service.anonymization_service import IBAN_PATTERN
+from service.page_filter_service import AMOUNT_PATTERN, DATE_PATTERN
+from service.statement_parsers import parse_date
+
+
+logger = logging.getLogger("upload_processor")
+supabase: Client = get_supabase_client()
+
+TEXT_DATE_FORMATS = [
+    "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%y", "%d/%m/%y",
+    "%d %m %Y", "%d %b %Y", "%d %B %Y", "%b %d, %Y",
+]
+
+Period = Tuple[str, str]
+
+
+def text_hash(raw_text: str) -> str:
+    """Hash of the extracted text with whitespace and case normalized, so re-exports of the same statement match."""
+    normalized = " ".join(raw_text.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def account_hash(raw_text: str) -> Optional[str]:
+    """Hash of the first IBAN in the statement, used to scope period overlaps to one account."""
+    match = re.search(IBAN_PATTERN, raw_text)
+    return hashlib.sha256(match.group(0).encode("utf-8")).hexdigest() if match else None
+
+
+def line_date(line: str) -> Optional[str]:
+    """ISO date of a transaction line (one carrying a date and an amount), otherwise None."""
+    match = DATE_PATTERN.search(line)
+    if not match or not AMOUNT_PATTERN.search(line):
+        return None
+    return parse_date(re.sub(r"(?<=[^\W\d_])\.", "", match.group(0)), TEXT_DATE_FORMATS)
+
+
+def text_period(text: str) -> Optional[Period]:
+    """First and last transaction date found in the text."""
+    dates = [d for d in map(line_date, text.splitlines()) if d]
+    return (min(dates), max(dates)) if dates else None
+
+
+def transactions_period(transactions: Iterable[Dict]) -> Optional[Period]:
+    dates = [tx["date"] for tx in transactions if tx.get("date")]
+    return (min(dates), max(dates)) if dates else None
+
+
+def merge_periods(*periods: Optional[Period]) -> Optional[Period]:
+    periods = [p for p in periods if p]
+    if not periods:
+        return None
+    return min(p[0] for p in periods), max(p[1] for p in periods)
+
+
+def is_covered(date: str, covered: List[Period]) -> bool:
+    """
+    True when the date lies strictly inside a covered period. Boundary days
+    are never treated as covered because a statement may end or start part
+    way through a day; the insert-time duplicate check handles those rows.
+    """
+    return any(start < date < end for start, end in covered)
+
+
+def drop_covered_lines(text: str, covered: List[Period]) -> Tuple[str, int]:
+    """
+    Removes transaction lines dated inside a covered period, together with the
+    continuation lines that follow them, up to the next transaction line.
+    Returns the remaining text and the number of transaction lines removed.
+    """
+    if not covered:
+        return text, 0
+    kept = []
+    dropping = False
+    dropped = 0
+    for line in text.splitlines():
+        date = line_date(line)
+        if date:
+            dropping = is_covered(date, covered)
+            dropped += dropping
+        if not dropping:
+            kept.append(line)
+    return "\n".join(kept), dropped
+
+
+def find_fingerprint(user_id: str, file_sha256: Optional[str] = None, text_sha256: Optional[str] = None) -> Optional[Dict]:
+    """The user's earlier statement with the same file or text hash, if any."""
+    for column, value in (("file_hash", file_sha256), ("text_hash", text_sha256)):
+        if not value:
+            continue
+        res = (
+            supabase.table("statement_fingerprints")
+            .select("*")
+            .eq("user_id", str(user_id))
+            .eq(column, value)
+            .limit(1)
+            .execute()
+        )
+        if res.data:
+            return res.data[0]
+    return None
+
+
+def find_covered_periods(user_id: str, account: Optional[str], period: Period) -> List[Period]:
+    """
+    Periods of the user's stored statements for the same account that overlap
+    the given period. Without an account hash two statements cannot be told
+    apart as the same account, so nothing is reported as covered.
+    """
+    if not account:
+        return []
+    query = (
+        supabase.table("statement_fingerprints")
+        .select("period_start, period_end")
+        .eq("user_id", str(user_id))
+        .lte("period_start", period[1])
+        .gte("period_end", period[0])
+    )
+    query = query.eq("account_hash", account)
+    return [(row["period_start"], row["period_end"]) for row in query.execute().data or []]
+
+
+def record_fingerprint(
+    user_id: str,
+    job_id: str,
+    file_sha256: str,
+    text_sha256: str,
+    account: Optional[str],
+    period: Optional[Period],
+    transaction_count: int,
+):
+    supabase.table("statement_fingerprints").insert({
+        "user_id": str(user_id),
+        "job_id": job_id,
+        "file_hash": file_sha256,
+        "text_hash": text_sha256,
+        "account_hash": account,
+        "period_start": period[0] if period else None,
+        "period_end": period[1] if period else None,
+        "transaction_count": transaction_count,
+        "created_at": datetime.now().isoformat(),
+    }).execute()
+    logger.info(f"Recorded statement fingerprint for job {job_id}, period {period}")
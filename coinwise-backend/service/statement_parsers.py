@@ -0,0 +1,313 @@
+import logging
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger("transaction_processor")
+
+LLM_PATH = "llm"
+
+AMOUNT_PATTERN = r"[-−]?(?:[€$£]\s?)?\d{1,3}(?:[.,\s]\d{3})*[.,]\d{2}(?:\s?[A-Z]{3})?"
+# Largest difference, in currency units, accepted between a balance delta or statement total and the parsed amounts.
+PARSER_AMOUNT_TOLERANCE = 0.05
+
+RO_MONTHS = {
+    "ianuarie": 1, "februarie": 2, "martie": 3, "aprilie": 4, "mai": 5, "iunie": 6,
+    "iulie": 7, "august": 8, "septembrie": 9, "octombrie": 10, "noiembrie": 11, "decembrie": 12,
+}
+
+CATEGORY_KEYWORDS = {
+    "Groceries": ["lidl", "kaufland", "mega image", "carrefour", "auchan", "profi", "penny", "la doi pasi"],
+    "Food & Takeout": ["glovo", "tazz", "mcdonald", "kfc", "starbucks", "restaurant", "cafe", "bolt food"],
+    "Transportation": ["uber", "bolt", "omv", "petrom", "mol ", "rompetrol", "stb", "metrorex", "cfr"],
+    "Subscriptions": ["netflix", "spotify", "youtube", "apple.com", "google", "hbo", "disney"],
+    "Utilities": ["enel", "engie", "e.on", "digi", "orange", "vodafone", "telekom", "apa nova"],
+    "Health": ["catena", "dr. max", "help net", "sensiblu", "farmacia", "regina maria", "medlife", "world class"],
+    "Shopping": ["emag", "zara", "h&m", "decathlon", "ikea", "dedeman", "altex", "amazon"],
+    "Travel": ["booking", "airbnb", "wizz", "ryanair", "tarom", "hotel"],
+    "Entertainment": ["cinema", "steam", "playstation", "eventim", "iabilet"],
+}
+
+INCOME_KEYWORDS = ["incasare", "încasare", "salariu", "salary", "refund", "rambursare", "dobanda", "interest", "top-up", "payment from"]
+DEPOSIT_KEYWORDS = ["depunere", "cash deposit", "dep numerar"]
+TRANSFER_KEYWORDS = ["transfer", "catre", "către", "p2p"]
+
+
+def parse_amount(raw: str) -> Optional[float]:
+    """Parses amounts written as 1,234.56 / 1.234,56 / 1 234,56, ignoring currency markers."""
+    value = re.sub(r"[€$£A-Z\s]", "", raw).replace("−", "-")
+    if not value:
+        return None
+    if "," in value and "." in value:
+        decimal_sep = "," if value.rfind(",") > value.rfind(".") else "."
+    elif "," in value:
+        decimal_sep = "," if len(value) - value.rfind(",") == 3 else "."
+    else:
+        decimal_sep = "."
+    thousands_sep = "." if decimal_sep == "," else ","
+    value = value.replace(thousands_sep, "").replace(decimal_sep, ".")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_date(raw: str, formats: List[str]) -> Optional[str]:
+    raw = raw.strip()
+    lowered = raw.lower()
+    for name, month in RO_MONTHS.items():
+        if name in lowered:
+            lowered = lowered.replace(name, f"{month:02d}")
+            raw = lowered
+            break
+    for fmt in formats:
+        try:
+            return datetime.strptime(raw, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def guess_category(description: str) -> str:
+    lowered = description.lower()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(k in lowered for k in keywords):
+            return category
+    return "Other"
+
+
+def guess_type(description: str) -> str:
+    lowered = description.lower()
+    if any(k in lowered for k in DEPOSIT_KEYWORDS):
+        return "deposit"
+    if any(k in lowered for k in INCOME_KEYWORDS):
+        return "income"
+    if any(k in lowered for k in TRANSFER_KEYWORDS) or lowered.startswith(("to ", "from ")):
+        return "transfer"
+    return "expense"
+
+
+class StatementParser:
+    """
+    Deterministic parser for one bank's statement layout.
+
+    A layout matches when every fingerprint pattern is found in the text. Rows
+    are lines of the form `<date> <description> <amount> [<balance>]`; lines
+    that do not start a row are appended to the previous row's description.
+    When a balance column is present, direction comes from the balance delta
+    (the first row's from the opening balance in the summary), otherwise from
+    the amount's sign or description keywords. Keyword-guessed directions are
+    only trusted when the summary's money in/out totals match them. The parser
+    gives up (and the caller falls back to the LLM) if any date-leading line
+    is not a complete row or a direction cannot be established.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fingerprints: List[str],
+        date_pattern: str,
+        date_formats: List[str],
+        default_currency: str = "RON",
+        start_marker: Optional[str] = None,
+        end_marker: Optional[str] = None,
+        ignore_pattern: Optional[str] = None,
+        has_balance: bool = False,
+        summary_patterns: Optional[List[str]] = None,
+    ):
+        self.name = name
+        self.fingerprints = [re.compile(p, re.IGNORECASE) for p in fingerprints]
+        balance = rf"\s+(?P<balance>{AMOUNT_PATTERN})" if has_balance else ""
+        self.date_prefix = re.compile(rf"^{date_pattern}\b")
+        self.row_pattern = re.compile(
+            rf"^(?P<date>{date_pattern})\s+(?P<description>.+?)\s+(?P<amount>{AMOUNT_PATTERN}){balance}$"
+        )
+        self.date_formats = date_formats
+        self.default_currency = default_currency
+        self.start_marker = re.compile(start_marker, re.IGNORECASE) if start_marker else None
+        self.end_marker = re.compile(end_marker, re.IGNORECASE) if end_marker else None
+        self.ignore_pattern = re.compile(ignore_pattern, re.IGNORECASE) if ignore_pattern else None
+        # Searched in the whole text; named groups opening_balance, money_in and money_out are read from them.
+        self.summary_patterns = [
+            re.compile(p.replace("AMOUNT", AMOUNT_PATTERN), re.IGNORECASE | re.MULTILINE) for p in summary_patterns or []
+        ]
+
+    def matches(self, text: str) -> bool:
+        return all(p.search(text) for p in self.fingerprints)
+
+    def _body_lines(self, text: str) -> List[str]:
+        lines = text.splitlines()
+        if self.start_marker:
+            starts = [i for i, l in enumerate(lines) if self.start_marker.search(l)]
+            if starts:
+                lines = lines[starts[0] + 1:]
+        if self.end_marker:
+            ends = [i for i, l in enumerate(lines) if self.end_marker.search(l)]
+            if ends:
+                lines = lines[:ends[-1]]
+        return [l for l in lines if l.strip() and not (self.ignore_pattern and self.ignore_pattern.search(l))]
+
+    def summary(self, text: str) -> Dict[str, Optional[float]]:
+        """Opening balance and money in/out totals printed on the statement, where found."""
+        found: Dict[str, Optional[float]] = {}
+        for pattern in self.summary_patterns:
+            match = pattern.search(text)
+            if match:
+                found.update({key: parse_amount(value) for key, value in match.groupdict().items() if value})
+        return found
+
+    def parse(self, text: str) -> Optional[List[Dict]]:
+        rows = []
+        for line in self._body_lines(text):
+            m = self.row_pattern.match(line.strip())
+            if m:
+                rows.append(dict(m.groupdict(), description=m.group("description").strip()))
+            elif self.date_prefix.match(line.strip()):
+                logger.info(f"{self.name} parser found an incomplete row, falling back")
+                return None
+            elif rows:
+                rows[-1]["description"] = f"{rows[-1]['description']} {line.strip()}"
+        if not rows:
+            return None
+
+        summary = self.summary(text)
+        transactions = []
+        guessed = 0
+        previous_balance = summary.get("opening_balance")
+        for row in rows:
+            date = parse_date(row["date"], self.date_formats)
+            amount = parse_amount(row["amount"])
+            if date is None or amount is None:
+                logger.info(f"{self.name} parser could not parse row {row}, falling back")
+                return None
+
+            balance = parse_amount(row["balance"]) if row.get("balance") else None
+            description = re.sub(r"\s+", " ", row["description"])
+            tx_type = guess_type(description)
+            if balance is not None and previous_balance is not None:
+                delta = balance - previous_balance
+                if abs(abs(delta) - abs(amount)) > PARSER_AMOUNT_TOLERANCE:
+                    logger.info(f"{self.name} parser found a balance change that does not match row {row}, falling back")
+                    return None
+                if tx_type != "transfer":
+                    tx_type = "income" if delta > 0 else "expense"
+            elif amount < 0 and tx_type != "transfer":
+                tx_type = "expense"
+            else:
+                guessed += 1
+            previous_balance = balance
+
+            currency_match = re.search(r"[A-Z]{3}", row["amount"])
+            currency = currency_match.group(0) if currency_match else self.default_currency
+            tx = {
+                "date": date,
+                "amount": abs(amount),
+                "currency": currency,
+                "type": tx_type,
+                "description": description,
+            }
+            if tx_type == "expense":
+                tx["merchant"] = description
+                tx["category"] = guess_category(description)
+            transactions.append(tx)
+
+        if guessed and not self._totals_match(transactions, summary):
+            logger.info(f"{self.name} parser could not establish the direction of {guessed} rows, falling back")
+            return None
+        return transactions
+
+    @staticmethod
+    def _totals_match(transactions: List[Dict], summary: Dict[str, Optional[float]]) -> bool:
+        """Whether the statement's money in/out totals agree with the parsed directions."""
+        if summary.get("money_in") is None or summary.get("money_out") is None:
+            return False
+        money_in = sum(tx["amount"] for tx in transactions if tx["type"] in ("income", "deposit"))
+        money_out = sum(tx["amount"] for tx in transactions if tx["type"] not in ("income", "deposit"))
+        return (
+            abs(abs(summary["money_in"]) - money_in) <= PARSER_AMOUNT_TOLERANCE
+            and abs(abs(summary["money_out"]) - money_out) <= PARSER_AMOUNT_TOLERANCE
+        )
+
+
+_PARSERS: List[StatementParser] = []
+path_counts: Counter = Counter()
+
+
+def register_parser(parser: StatementParser) -> StatementParser:
+    _PARSERS.append(parser)
+    return parser
+
+
+def detect_layout(text: str) -> Optional[StatementParser]:
+    return next((p for p in _PARSERS if p.matches(text)), None)
+
+
+def parse_statement(text: str) -> Tuple[str, Optional[List[Dict]]]:
+    """
+    Runs the deterministic parser for a recognised layout. Returns the path
+    taken and the parsed transactions, or (LLM_PATH, None) when the layout is
+    unknown or the parser rejected the text.
+    """
+    parser = detect_layout(text)
+    transactions = None
+    if parser:
+        try:
+            transactions = parser.parse(text)
+        except Exception as e:
+            logger.warning(f"{parser.name} parser failed: {e}")
+    path = parser.name if transactions else LLM_PATH
+    path_counts[path] += 1
+    logger.info(f"Statement extraction path: {path}")
+    return path, transactions
+
+
+register_parser(StatementParser(
+    name="revolut",
+    fingerprints=[r"Revolut (?:Bank UAB|Ltd)", r"Date\s+Description\s+Money out\s+Money in\s+Balance"],
+    date_pattern=r"[A-Z][a-z]{2} \d{1,2}, \d{4}",
+    has_balance=True,
+    date_formats=["%b %d, %Y"],
+    default_currency="EUR",
+    start_marker=r"Date\s+Description\s+Money out\s+Money in\s+Balance",
+    end_marker=r"^Reverted from|^Pending from|Report lost or stolen card",
+    summary_patterns=[
+        r"^Total\s+(?P<opening_balance>AMOUNT)\s+(?P<money_out>AMOUNT)\s+(?P<money_in>AMOUNT)\s+AMOUNT\s*$",
+    ],
+))
+
+register_parser(StatementParser(
+    name="bt",
+    fingerprints=[r"Banca Transilvania", r"Data\s+Descriere\s+Debit\s+Credit"],
+    date_pattern=r"\d{2}/\d{2}/\d{4}",
+    date_formats=["%d/%m/%Y"],
+    start_marker=r"Data\s+Descriere\s+Debit\s+Credit",
+    end_marker=r"RULAJ TOTAL CONT|SOLD FINAL CONT",
+    ignore_pattern=r"^SOLD (?:ANTERIOR|FINAL ZI)|^RULAJ ZI",
+    summary_patterns=[r"RULAJ TOTAL CONT\s+(?P<money_out>AMOUNT)\s+(?P<money_in>AMOUNT)"],
+))
+
+register_parser(StatementParser(
+    name="bcr",
+    fingerprints=[r"Banca Comercial[aă] Rom[aâ]n[aă]|\bBCR\b", r"Data\s+(?:tranzac[tț]iei|procesarii)"],
+    date_pattern=r"\d{2}\.\d{2}\.\d{4}",
+    date_formats=["%d.%m.%Y"],
+    start_marker=r"Data\s+(?:tranzac[tț]iei|procesarii)",
+    end_marker=r"Total (?:debit|rulaj)|Sold final",
+    ignore_pattern=r"^Sold (?:initial|inițial|anterior)",
+    summary_patterns=[r"Total debit\s*:?\s*(?P<money_out>AMOUNT)", r"Total credit\s*:?\s*(?P<money_in>AMOUNT)"],
+))
+
+register_parser(StatementParser(
+    name="ing",
+    fingerprints=[r"ING Bank N\.?V\.?", r"Detalii tranzac[tț]ie"],
+    date_pattern=rf"\d{{2}} (?:{'|'.join(RO_MONTHS)}) \d{{4}}",
+    date_formats=["%d %m %Y"],
+    start_marker=r"Detalii tranzac[tț]ie",
+    end_marker=r"Sold final|Total",
+    ignore_pattern=r"^Sold (?:initial|ini[tț]ial)",
+    summary_patterns=[
+        r"Total debit(?:[aă]ri)?\s*:?\s*(?P<money_out>AMOUNT)", r"Total credit(?:[aă]ri)?\s*:?\s*(?P<money_in>AMOUNT)",
+    ],
+))
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from supabase import Client
+
+from lib import get_supabase_client
+
+
+logger = logging.getLogger("transaction_processor")
+supabase: Client = get_supabase_client()
+
+TRANSACTION_WRITE_CHUNK_SIZE = int(os.getenv("TRANSACTION_WRITE_CHUNK_SIZE", "200"))
+TRANSACTION_WRITE_CONCURRENCY = int(os.getenv("TRANSACTION_WRITE_CONCURRENCY", "4"))
+TRANSIENT_ERROR_NAMES = ("Timeout", "Connect", "Network", "RemoteProtocol")
+# Keys per lookup query; they are sent in the URL.
+NATURAL_KEY_LOOKUP_SIZE = 100
+
+
+def description_hash(description: Optional[str]) -> str:
+    normalized = " ".join((description or "").lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def natural_key_base(user_id: str, tx: Dict[str, Any]) -> str:
+    try:
+        amount = f"{float(tx.get('amount')):.2f}"
+    except (TypeError, ValueError):
+        amount = str(tx.get("amount"))
+    return f"{user_id}|{tx.get('date')}|{amount}|{tx.get('type')}|{description_hash(tx.get('description'))}"
+
+
+def assign_natural_keys(rows: List[Dict[str, Any]], user_id: str, occurrences: Optional[Counter] = None):
+    """
+    Sets natural_key on each row: a hash of user, date, amount, type and
+    normalized description, plus the row's occurrence number among identical
+    rows, so two genuine identical payments on one day stay distinct while a
+    retried write maps onto the rows it already stored. Pass the same
+    occurrences counter for every write of one upload to number rows across
+    its batches.
+    """
+    occurrences = Counter() if occurrences is None else occurrences
+    for row in rows:
+        base = natural_key_base(user_id, row)
+        row["natural_key"] = hashlib.sha256(f"{base}|{occurrences[base]}".encode("utf-8")).hexdigest()
+        occurrences[base] += 1
+
+
+def fetch_stored_ids(user_id: str, keys: List[str], job_id: Optional[str]) -> Dict[str, str]:
+    """
+    Ids of the transactions with the given natural keys that the upload job
+    itself wrote, by key. A row another upload stored under the same key is
+    not returned, as it is not the job's to claim.
+    """
+    stored = {}
+    if not job_id:
+        return stored
+    for i in range(0, len(keys), NATURAL_KEY_LOOKUP_SIZE):
+        response = (
+            supabase.table("transactions")
+            .select("id, natural_key")
+            .eq("user_id", str(user_id))
+            .eq("import_job_id", job_id)
+            .in_("natural_key", keys[i:i + NATURAL_KEY_LOOKUP_SIZE])
+            .execute()
+        )
+        stored.update({row["natural_key"]: row["id"] for row in response.data or []})
+    return stored
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+    return any(name in type(exc).__name__ for name in TRANSIENT_ERROR_NAMES)
+
+
+def upsert_chunk(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Inserts the rows whose natural key is new; returns only the inserted rows."""
+    response = (
+        supabase.table("transactions")
+        .upsert(rows, on_conflict="user_id,natural_key", ignore_duplicates=True)
+        .execute()
+    )
+    return response.data or []
+
+
+def write_chunk(rows: List[Dict[str, Any]], retried: bool = False) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict, str]]]:
+    """
+    Writes one chunk. A transient failure is retried once; any other failure
+    is narrowed down by splitting the chunk until the offending rows are
+    isolated, so one bad row does not cost the rest. Returns the inserted
+    rows and the (row, error) pairs that could not be written.
+    """
+    try:
+        return upsert_chunk(rows), []
+    except Exception as e:
+        if is_transient(e):
+            if not retried:
+                time.sleep(0.5)
+                return write_chunk(rows, retried=True)
+            return [], [(row, str(e)) for row in rows]
+        if len(rows) == 1:
+            return [], [(rows[0], str(e))]
+        middle = len(rows) // 2
+        first_inserted, first_failed = write_chunk(rows[:middle], retried)
+        second_inserted, second_failed = write_chunk(rows[middle:], retried)
+        return first_inserted + second_inserted, first_failed + second_failed
+
+
+def write_transactions(
+    rows: List[Dict[str, Any]],
+    chunk_size: int = TRANSACTION_WRITE_CHUNK_SIZE,
+    concurrency: int = TRANSACTION_WRITE_CONCURRENCY,
+) -> Dict[str, Any]:
+    """
+    Upserts rows carrying a natural_key in fixed-size chunks, several chunks
+    at a time. Rows whose key is already stored are not written again. When
+    the same job stored them, e.g. in an attempt whose response was lost,
+    their ids are looked up and returned as existing_ids, which makes a
+    retried write idempotent; otherwise they are skipped. Returns
+    the inserted ids, the existing ids, the rows that were neither (skipped),
+    the failed (row, error) pairs and the chunk count.
+    """
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    if not chunks:
+        return {"inserted_ids": [], "existing_ids": [], "skipped": [], "failed": [], "chunks": 0}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as pool:
+        results = list(pool.map(write_chunk, chunks))
+
+    inserted_ids, skipped, failed = [], [], []
+    for chunk, (inserted, chunk_failed) in zip(chunks, results):
+        written = {row.get("natural_key") for row in inserted} | {row["natural_key"] for row, _ in chunk_failed}
+        inserted_ids.extend(row["id"] for row in inserted if "id" in row)
+        skipped.extend(row for row in chunk if row["natural_key"] not in written)
+        failed.extend(chunk_failed)
+
+    existing_ids = []
+    if skipped:
+        stored = fetch_stored_ids(
+            skipped[0]["user_id"], [row["natural_key"] for row in skipped], skipped[0].get("import_job_id")
+        )
+        existing_ids = [stored[row["natural_key"]] for row in skipped if row["natural_key"] in stored]
+        skipped = [row for row in skipped if row["natural_key"] not in stored]
+
+    logger.info(
+        f"Wrote {len(rows)} transactions in {len(chunks)} chunks: {len(inserted_ids)} inserted, "
+        f"{len(existing_ids)} already stored, {len(skipped)} skipped, {len(failed)} failed"
+    )
+    for row, error in failed[:5]:
+        logger.error(f"Could not store transaction dated {row.get('date')} of {row.get('amount')}: {error}")
+    return {
+        "inserted_ids": inserted_ids, "existing_ids": existing_ids, "skipped": skipped, "failed": failed,
+        "chunks": len(chunks),
+    }
@@ -1,59 +1,91 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from collections import defaultdict
-from difflib import SequenceMatcher
 
-def normalize_str(value: str) -> str:
-    """Lowercase and strip a string for comparison."""
-    return value.strip().lower() if isinstance(value, str) else ""
+from service.similarity_service import (
+    FIELDS_BY_TYPE,
+    SIMILARITY_FUNCTIONS,
+    SIMILARITY_MODE,
+    fields_similar,
+    normalize_text,
+    normalize_transaction,
+)
 
-def similar(a: str, b: str, threshold: float = 0.9) -> bool:
+def similar(a: str, b: str, threshold: float = 0.9, mode: Optional[str] = None) -> bool:
     """Return True if two strings are similar above a given threshold."""
-    return SequenceMatcher(None, normalize_str(a), normalize_str(b)).ratio() >= threshold
+    return SIMILARITY_FUNCTIONS[mode or SIMILARITY_MODE](normalize_text(a), normalize_text(b), threshold)
 
-def is_duplicate(tx1: Dict, tx2: Dict, threshold: float = 0.9) -> bool:
+def is_duplicate(tx1: Dict, tx2: Dict, threshold: float = 0.9, mode: Optional[str] = None) -> bool:
     """Determine if two transactions are considered duplicates."""
-    if tx1["type"] != tx2["type"]:
+    if tx1["type"] not in FIELDS_BY_TYPE or blocking_key(tx1) != blocking_key(tx2):
         return False
+    return fields_similar(normalize_transaction(tx1), normalize_transaction(tx2), threshold, mode)
 
-    if round(tx1["amount"], 2) != round(tx2["amount"], 2):
-        return False
+def blocking_key(tx: Dict) -> Tuple:
+    """Fields is_duplicate requires to match exactly; only transactions sharing it are compared."""
+    return (tx["type"], tx["date"], round(tx["amount"], 2))
 
-    if tx1["date"] != tx2["date"]:
-        return False
+def find_near_duplicate_transactions(transactions: List[Dict], threshold: float = 0.9, mode: Optional[str] = None) -> List[str]:
+    """
+    Detect near-duplicate transactions across expenses, income, deposits, and transfers.
 
-    tx_type = tx1["type"]
-    
-    if tx_type == "expense":
-        return (
-            similar(tx1.get("description", ""), tx2.get("description", ""), threshold)
-            and similar(tx1.get("merchant", ""), tx2.get("merchant", ""), threshold)
-        )
-    elif tx_type == "income" or tx_type == "deposit":
-        return similar(tx1.get("description", ""), tx2.get("description", ""), threshold)
-    elif tx_type == "transfer":
-        return (
-            similar(tx1.get("description", ""), tx2.get("description", ""), threshold)
-            and similar(tx1.get("sender", ""), tx2.get("sender", ""), threshold)
-            and similar(tx1.get("receiver", ""), tx2.get("receiver", ""), threshold)
-        )
-
-    return False
-
-def find_near_duplicate_transactions(transactions: List[Dict], threshold: float = 0.9) -> List[str]:
-    """Detect near-duplicate transactions across expenses, income, deposits, and transfers."""
-    duplicates = []
-    visited = set()
+    Transactions are grouped by (type, date, rounded amount) and fuzzy string
+    similarity is only computed within each group, so the cost grows with the
+    size of the groups rather than with the square of the history. Text
+    fields are normalized once per transaction, only for groups with more
+    than one member.
+    """
+    blocks: Dict[Tuple, List[Dict]] = defaultdict(list)
+    for tx in transactions:
+        blocks[blocking_key(tx)].append(tx)
 
-    for i in range(len(transactions)):
-        for j in range(i + 1, len(transactions)):
-            tx1, tx2 = transactions[i], transactions[j]
-            key_pair = tuple(sorted([tx1["id"], tx2["id"]]))
+    duplicates = []
+    seen = set()
 
-            if key_pair in visited:
-                continue
+    for (tx_type, _, _), block in blocks.items():
+        if len(block) < 2 or tx_type not in FIELDS_BY_TYPE:
+            continue
+        normalized = [normalize_transaction(tx) for tx in block]
+        for i in range(len(block)):
+            for j in range(i + 1, len(block)):
+                if block[j]["id"] in seen:
+                    continue
 
-            if is_duplicate(tx1, tx2, threshold):
-                duplicates.append(tx2["id"]) 
-                visited.add(key_pair)
+                if fields_similar(normalized[i], normalized[j], threshold, mode):
+                    duplicates.append(block[j]["id"])
+                    seen.add(block[j]["id"])
 
     return duplicates
+
+def find_existing_duplicates(
+    new_transactions: List[Dict],
+    existing_transactions: List[Dict],
+    threshold: float = 0.9,
+    mode: Optional[str] = None,
+) -> List[Tuple[Dict, Dict]]:
+    """
+    Match new transactions against existing ones using an index keyed on
+    (type, date, rounded amount). Returns (new, existing) pairs for every new
+    transaction that duplicates an existing one; new transactions are not
+    compared with each other.
+    """
+    index: Dict[Tuple, List[Dict]] = defaultdict(list)
+    for tx in existing_transactions:
+        index[blocking_key(tx)].append(tx)
+
+    normalized: Dict[int, Dict] = {}
+
+    def normalized_fields(tx: Dict) -> Dict:
+        if id(tx) not in normalized:
+            normalized[id(tx)] = normalize_transaction(tx)
+        return normalized[id(tx)]
+
+    matches = []
+    for tx in new_transactions:
+        candidates = index.get(blocking_key(tx), [])
+        if not candidates or tx["type"] not in FIELDS_BY_TYPE:
+            continue
+        for existing in candidates:
+            if fields_similar(normalized_fields(existing), normalized_fields(tx), threshold, mode):
+                matches.append((tx, existing))
+                break
+    return matches
@@ -0,0 +1,83 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+
+logger = logging.getLogger("upload_processor")
+
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "coinwise_uploads"))
+
+
+class UploadBuffer:
+    """
+    Holds an uploaded PDF in memory and hands it to the PDF parser as a
+    file-like object. Above max_bytes the content spills to a uniquely named
+    temporary file. close() releases the memory or removes the file and is
+    safe to call more than once. The SHA-256 of the content is computed while
+    it is written.
+    """
+
+    def __init__(self, max_bytes: int = UPLOAD_SPOOL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.path: Optional[str] = None
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[BinaryIO] = None
+        self._digest = hashlib.sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._digest.update(chunk)
+        if self._memory is not None and self.size > self.max_bytes:
+            self._spill()
+        (self._file or self._memory).write(chunk)
+
+    def _spill(self):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".pdf", dir=UPLOAD_DIR, delete=False)
+        self.path = self._file.name
+        self._file.write(self._memory.getbuffer())
+        self._memory.close()
+        self._memory = None
+        logger.info(f"Upload exceeded {self.max_bytes} bytes, spilled to {self.path}")
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def head(self, n: int) -> bytes:
+        if self._memory is not None:
+            return bytes(self._memory.getbuffer()[:n])
+        with open(self.path, "rb") as f:
+            return f.read(n)
+
+    @property
+    def source(self) -> Union[str, io.BytesIO]:
+        """A path when spilled to disk, otherwise the in-memory buffer rewound to the start."""
+        if self._file is not None:
+            self._file.flush()
+            return self.path
+        self._memory.seek(0)
+        return self._memory
+
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+            logger.info(f"Removed temporary file: {self.path}")
+        self.path = None
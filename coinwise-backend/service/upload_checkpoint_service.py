@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from supabase import Client
+
+from lib import get_supabase_client
+
+
+logger = logging.getLogger("upload_processor")
+supabase: Client = get_supabase_client()
+
+# Holds the statement text before anonymization; dropped once the job completes.
+RAW_TEXT_CHECKPOINTS = ("extract_text",)
+# A failed job can be resumed for this long; after that its raw text is deleted.
+RAW_TEXT_CHECKPOINT_TTL_SECONDS = int(os.getenv("RAW_TEXT_CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+
+
+def save_checkpoint(job_id: str, user_id: str, stage: str, payload: Dict[str, Any]):
+    """Stores the output of a completed pipeline stage, replacing an earlier one for the same stage."""
+    supabase.table("upload_checkpoints").upsert({
+        "job_id": job_id,
+        "user_id": str(user_id),
+        "stage": stage,
+        "payload": payload,
+        "created_at": datetime.utcnow().isoformat(),
+    }, on_conflict="job_id,stage").execute()
+    logger.info(f"Job {job_id}: checkpointed stage {stage}")
+
+
+def load_checkpoints(job_id: str, user_id: str) -> Dict[str, Dict[str, Any]]:
+    """Checkpointed stage outputs of a job, by stage name."""
+    response = (
+        supabase.table("upload_checkpoints")
+        .select("stage, payload")
+        .eq("job_id", job_id)
+        .eq("user_id", str(user_id))
+        .execute()
+    )
+    return {row["stage"]: row["payload"] for row in response.data or []}
+
+
+def checkpoint_owner(job_id: str) -> Optional[str]:
+    response = supabase.table("upload_checkpoints").select("user_id").eq("job_id", job_id).limit(1).execute()
+    return response.data[0]["user_id"] if response.data else None
+
+
+def delete_checkpoints(job_id: str, stages: Iterable[str]):
+    supabase.table("upload_checkpoints").delete().eq("job_id", job_id).in_("stage", list(stages)).execute()
+
+
+def delete_expired_raw_checkpoints() -> int:
+    """Deletes raw text checkpoints older than RAW_TEXT_CHECKPOINT_TTL_SECONDS; returns how many."""
+    cutoff = (datetime.utcnow() - timedelta(seconds=RAW_TEXT_CHECKPOINT_TTL_SECONDS)).isoformat()
+    response = (
+        supabase.table("upload_checkpoints")
+        .delete()
+        .in_("stage", list(RAW_TEXT_CHECKPOINTS))
+        .lt("created_at", cutoff)
+        .execute()
+    )
+    deleted = len(response.data or [])
+    if deleted:
+        logger.info(f"Deleted {deleted} raw text checkpoints older than {cutoff}")
+    return deleted
+
+
+def load_entity_map(entity_map_id: str, user_id: str) -> Dict[str, str]:
+    response = (
+        supabase.table("entity_maps")
+        .select("entity_map")
+        .eq("id", entity_map_id)
+        .eq("user_id", str(user_id))
+        .execute()
+    )
+    if not response.data:
+        raise LookupError(f"Entity map {entity_map_id} not found")
+    entity_map = response.data[0]["entity_map"]
+    return json.loads(entity_map) if isinstance(entity_map, str) else entity_map
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+EVENT_KEEPALIVE_SECONDS = 15
+
+
+class JobEventLog:
+    """
+    Append-only log of progress events for one upload job. Events may be
+    published from the event loop or from worker threads; subscribers replay
+    the log from any position and then wait for new events, so a client that
+    connects late or reconnects still sees every stage transition.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._changed = asyncio.Event()
+        self._start = time.time()
+
+    def publish(self, event_type: str, **data):
+        with self._lock:
+            if self.closed:
+                return
+            self.events.append({
+                "id": len(self.events),
+                "event": event_type,
+                "at": datetime.now().isoformat(),
+                "elapsed_seconds": round(time.time() - self._start, 3),
+                **data,
+            })
+        self._loop.call_soon_threadsafe(self._notify)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        self._loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def stream(self, start: int = 0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yields events from position start until the log is closed; yields None as a keepalive."""
+        index = start
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.closed:
+                return
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
@@ -0,0 +1,915 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from models.uploads import UploadBatch, UploadBatchFile, UploadJob, UploadStage
+from routes.auth import User
+from service.anonymization_service import Deanonymizer
+from service.budget_service import auto_link_transactions_to_budgets
+from service.llm_usage import record_usage
+from service.llm_usage_service import persist_usage
+from service.page_filter_service import filter_statement_pages, is_probably_bank_statement
+from service.pdf_extraction_service import (
+    PAGE_SEPARATOR,
+    MemoryBudget,
+    MemoryBudgetExceeded,
+    extract_pdf_text,
+    extract_preview_text,
+)
+from service.reconciliation_service import chunk_issues, compare_totals
+from service.statement_fingerprint_service import (
+    account_hash,
+    drop_covered_lines,
+    find_covered_periods,
+    find_fingerprint,
+    is_covered,
+    merge_periods,
+    record_fingerprint,
+    text_hash,
+    text_period,
+    transactions_period,
+)
+from service.statement_parsers import parse_statement
+from service.upload_checkpoint_service import (
+    RAW_TEXT_CHECKPOINTS,
+    checkpoint_owner,
+    delete_checkpoints,
+    delete_expired_raw_checkpoints,
+    load_checkpoints,
+    load_entity_map,
+    save_checkpoint,
+)
+from service.upload_buffer import UploadBuffer
+from service.upload_events import JobEventLog
+from service.upload_service import (
+    anonymize_text,
+    delete_transactions_in_db,
+    extract_transactions_chunked,
+    reextract_chunk,
+    llm_slots,
+    sections_extraction,
+    store_transactions_in_db,
+)
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("upload.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("upload_processor")
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "20"))
+UPLOAD_JOB_TTL_SECONDS = int(os.getenv("UPLOAD_JOB_TTL_SECONDS", "3600"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_PREVIEW_PAGES = int(os.getenv("UPLOAD_PREVIEW_PAGES", "2"))
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "24"))
+# Process-wide cap on files of batches that have not finished; batches bypass the upload queue.
+UPLOAD_BATCH_MAX_PENDING_FILES = int(os.getenv("UPLOAD_BATCH_MAX_PENDING_FILES", "48"))
+# Process-wide cap on concurrent full-document PDF extractions, shared by every job and batch.
+PDF_EXTRACTION_CONCURRENCY = int(os.getenv("PDF_EXTRACTION_CONCURRENCY", "2"))
+
+PIPELINE_STAGES = [
+    "check_duplicate_file",
+    "extract_text",
+    "validate",
+    "check_statement_period",
+    "anonymize",
+    "parse_known_layout",
+    "filter_pages",
+    "extract_sections",
+    "normalize_and_extract",
+    "store_transactions",
+    "reconcile",
+    "link_budgets",
+    "record_fingerprint",
+]
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is not a processable bank statement."""
+
+
+class UploadQueueFull(Exception):
+    """Raised when the ingestion queue cannot accept another job."""
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+class UploadNotResumable(Exception):
+    """Raised when a job cannot be resumed or replayed from its checkpoints."""
+
+
+_jobs: Dict[str, UploadJob] = {}
+_job_events: Dict[str, JobEventLog] = {}
+_batches: Dict[str, UploadBatch] = {}
+_background_tasks: Set[asyncio.Task] = set()
+_pending_batch_files = 0
+# Seconds between sweeps for expired raw text checkpoints.
+CHECKPOINT_SWEEP_INTERVAL_SECONDS = 600
+_last_checkpoint_sweep = 0.0
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+extraction_slots = asyncio.Semaphore(PDF_EXTRACTION_CONCURRENCY)
+
+
+def get_job(job_id: str) -> Optional[UploadJob]:
+    return _jobs.get(job_id)
+
+
+def get_job_events(job_id: str) -> Optional[JobEventLog]:
+    return _job_events.get(job_id)
+
+
+def publish_event(job: UploadJob, event_type: str, **data):
+    events = _job_events.get(job.id)
+    if events:
+        events.publish(event_type, **data)
+
+
+def publish_progress(job: UploadJob, stage: str, current: int, total: Optional[int], unit: str):
+    """Progress within a stage, e.g. pages 3/12 or chunks 2/5; safe to call from worker threads."""
+    publish_event(job, "progress", stage=stage, current=current, total=total, unit=unit)
+
+
+def get_batch(batch_id: str) -> Optional[UploadBatch]:
+    batch = _batches.get(batch_id)
+    if batch:
+        _refresh_batch_files(batch)
+    return batch
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _get_stage(job: UploadJob, name: str) -> UploadStage:
+    return next(s for s in job.stages if s.name == name)
+
+
+@contextmanager
+def track_stage(job: UploadJob, name: str):
+    """Marks a pipeline stage as running and records its outcome and timing."""
+    stage = _get_stage(job, name)
+    stage.status = "running"
+    stage.started_at = _now()
+    start = time.time()
+    publish_event(job, "stage", stage=name, status="running")
+    try:
+        yield stage
+    except Exception as e:
+        stage.status = "failed"
+        stage.detail = str(e)
+        raise
+    else:
+        stage.status = "completed"
+    finally:
+        stage.finished_at = _now()
+        stage.duration_seconds = round(time.time() - start, 3)
+        logger.info(f"Job {job.id}: stage {name} {stage.status} in {stage.duration_seconds:.2f}s")
+        publish_event(
+            job, "stage", stage=name, status=stage.status,
+            duration_seconds=stage.duration_seconds, detail=stage.detail,
+        )
+
+
+def skip_stage(job: UploadJob, name: str, detail: Optional[str] = None):
+    stage = _get_stage(job, name)
+    stage.status = "skipped"
+    stage.detail = detail
+    publish_event(job, "stage", stage=name, status="skipped", detail=detail)
+
+
+def finish_as_duplicate(job: UploadJob, previous: Dict, reason: str):
+    """Completes a job for a statement that was already imported, skipping all remaining stages."""
+    job.duplicate_of = previous.get("job_id")
+    for stage in job.stages:
+        if stage.status == "pending":
+            skip_stage(job, stage.name, f"statement already imported ({reason})")
+    job.status = "completed"
+    logger.info(f"Job {job.id}: {reason} matches statement imported by job {job.duplicate_of}, nothing to do")
+
+
+def _evict_expired_jobs():
+    cutoff = time.time() - UPLOAD_JOB_TTL_SECONDS
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished_at and datetime.fromisoformat(job.finished_at).timestamp() < cutoff
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+        _job_events.pop(job_id, None)
+    expired = [
+        batch_id for batch_id, batch in _batches.items()
+        if batch.finished_at and datetime.fromisoformat(batch.finished_at).timestamp() < cutoff
+    ]
+    for batch_id in expired:
+        del _batches[batch_id]
+    _sweep_raw_checkpoints()
+
+
+def _sweep_raw_checkpoints():
+    """Drops expired raw text checkpoints of failed jobs in the background, at most every sweep interval."""
+    global _last_checkpoint_sweep
+    if time.time() - _last_checkpoint_sweep < CHECKPOINT_SWEEP_INTERVAL_SECONDS:
+        return
+    _last_checkpoint_sweep = time.time()
+
+    async def sweep():
+        try:
+            await asyncio.to_thread(delete_expired_raw_checkpoints)
+        except Exception as e:
+            logger.error(f"Could not delete expired raw text checkpoints: {e}")
+
+    task = asyncio.create_task(sweep())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _ensure_workers():
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+    alive = [w for w in _workers if not w.done()]
+    _workers[:] = alive
+    for _ in range(UPLOAD_WORKERS - len(alive)):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def read_upload(file, chunk_size: int = 1024 * 1024) -> UploadBuffer:
+    """
+    Reads an UploadFile in chunks into an UploadBuffer, aborting as soon as
+    MAX_UPLOAD_BYTES is exceeded.
+    """
+    buffer = UploadBuffer()
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            if buffer.size + len(chunk) > MAX_UPLOAD_BYTES:
+                raise UploadTooLarge(f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+            buffer.write(chunk)
+    except Exception:
+        buffer.close()
+        raise
+    return buffer
+
+
+async def validate_upload(buffer: UploadBuffer):
+    """
+    Cheap checks run before a job is queued: the PDF signature and the bank
+    statement keyword heuristic on the first UPLOAD_PREVIEW_PAGES pages only,
+    so non-statements are rejected without extracting the whole document.
+    """
+    if b"%PDF-" not in buffer.head(1024):
+        raise UploadRejected("The uploaded file is not a PDF.")
+    try:
+        preview = await asyncio.to_thread(extract_preview_text, buffer.source, UPLOAD_PREVIEW_PAGES)
+    except Exception as e:
+        raise UploadRejected(f"Error extracting text from PDF: {e}")
+    if not is_probably_bank_statement(preview):
+        raise UploadRejected("This PDF does not appear to be a bank statement.")
+
+
+def _new_job(filename: str, current_user: User, job_id: Optional[str] = None) -> UploadJob:
+    job = UploadJob(
+        id=job_id or str(uuid4()),
+        user_id=str(current_user.id),
+        filename=filename,
+        created_at=_now(),
+        stages=[UploadStage(name=name) for name in PIPELINE_STAGES],
+    )
+    _job_events[job.id] = JobEventLog(asyncio.get_running_loop())
+    publish_event(job, "job", status=job.status)
+    return job
+
+
+async def submit_upload_job(buffer: UploadBuffer, filename: str, current_user: User) -> UploadJob:
+    """
+    Queues an uploaded file for background processing. The job takes
+    ownership of the buffer and closes it when the pipeline finishes.
+    """
+    _evict_expired_jobs()
+    _ensure_workers()
+    if _queue.full():
+        raise UploadQueueFull("Too many uploads are being processed, please retry shortly.")
+
+    job = _new_job(filename, current_user)
+    logger.info(f"Job {job.id}: accepted {filename} ({buffer.size} bytes, {'on disk' if buffer.path else 'in memory'})")
+
+    _jobs[job.id] = job
+    _queue.put_nowait((job, buffer, current_user, None))
+    return job
+
+
+async def resume_upload_job(job_id: str, current_user: User) -> UploadJob:
+    """
+    Queues a failed job again under the same id. Stages with a checkpoint
+    are restored rather than re-run, so LLM work that finished is not paid
+    for twice.
+    """
+    job = _jobs.get(job_id)
+    if job and (job.status in ("queued", "running") or not job.resumable):
+        raise UploadNotResumable(f"Upload job is {job.status} and cannot be resumed.")
+    checkpoints = await asyncio.to_thread(load_checkpoints, job_id, current_user.id)
+    if "extract_text" not in checkpoints:
+        raise UploadNotResumable("This upload was not saved or has expired, please upload the statement again.")
+
+    _evict_expired_jobs()
+    _ensure_workers()
+    if _queue.full():
+        raise UploadQueueFull("Too many uploads are being processed, please retry shortly.")
+    job = _new_job(checkpoints["extract_text"]["filename"], current_user, job_id)
+    logger.info(f"Job {job.id}: resuming from checkpoints {sorted(checkpoints)}")
+    _jobs[job.id] = job
+    _queue.put_nowait((job, None, current_user, checkpoints))
+    return job
+
+
+async def replay_storage_stages(job_id: str) -> UploadJob:
+    """
+    Operator tool: stores a job's checkpointed transactions again and links
+    them to budgets, as a new job, without repeating any extraction. Rows
+    that are already stored are skipped by the duplicate check and existing
+    budget links are kept, so a replay can be repeated safely.
+    """
+    user_id = await asyncio.to_thread(checkpoint_owner, job_id)
+    checkpoints = await asyncio.to_thread(load_checkpoints, job_id, user_id) if user_id else {}
+    if "transactions" in checkpoints:
+        transactions = checkpoints["transactions"]["transactions"]
+        previous_ids = checkpoints["transactions"]["inserted_transaction_ids"]
+    elif "normalize_and_extract" in checkpoints:
+        transactions = [tx for rows in checkpoints["normalize_and_extract"]["chunk_rows"] for tx in rows]
+        previous_ids = [i for ids in checkpoints["normalize_and_extract"]["chunk_ids"].values() for i in ids]
+    else:
+        raise UploadNotResumable("No extracted transactions were saved for this upload.")
+    entity_map = await asyncio.to_thread(load_entity_map, checkpoints["anonymize"]["entity_map_id"], user_id)
+
+    job = _new_job(f"replay of {job_id}", User(id=user_id, email=None))
+    job.replay_of = job_id
+    _jobs[job.id] = job
+    task = asyncio.create_task(run_storage_replay(job, transactions, previous_ids, entity_map))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return job
+
+
+async def run_storage_replay(job: UploadJob, transactions: List[dict], previous_ids: List[str], entity_map: Dict[str, str]):
+    job.status = "running"
+    job.started_at = _now()
+    start_time = time.time()
+    publish_event(job, "job", status=job.status)
+    try:
+        for stage in job.stages:
+            if stage.name not in ("store_transactions", "link_budgets"):
+                skip_stage(job, stage.name, f"replaying the storage stages of job {job.replay_of}")
+
+        with track_stage(job, "store_transactions") as stage:
+            ids, skipped = await asyncio.to_thread(
+                store_transactions_in_db, transactions, job.user_id, entity_map, Deanonymizer(entity_map),
+                job_id=job.replay_of,
+            )
+            job.inserted_transaction_ids = ids
+            job.skipped_duplicates = len(skipped)
+            stage.detail = f"{len(ids)} transactions inserted, {len(skipped)} already stored"
+
+        with track_stage(job, "link_budgets"):
+            await asyncio.to_thread(auto_link_transactions_to_budgets, job.user_id, list(previous_ids) + ids)
+        job.status = "completed"
+    except Exception as e:
+        job.status = "failed"
+        job.error = f"Replay failed: {e}"
+        logger.exception(f"Job {job.id}: replay of job {job.replay_of} failed")
+    finally:
+        job.finished_at = _now()
+        job.duration_seconds = round(time.time() - start_time, 3)
+        logger.info(f"Job {job.id}: replay of job {job.replay_of} {job.status} in {job.duration_seconds:.2f} seconds")
+        publish_event(job, "job", status=job.status, error=job.error, duration_seconds=job.duration_seconds)
+        events = _job_events.get(job.id)
+        if events:
+            events.close()
+
+
+def submit_upload_batch(
+    accepted: List[Tuple[UploadBuffer, str]],
+    rejected: List[UploadBatchFile],
+    current_user: User,
+) -> UploadBatch:
+    """
+    Starts processing a batch of validated uploads in the background. The
+    files bypass the upload queue and run concurrently, bounded by the
+    process-wide PDF extraction and LLM caps, and raise UploadQueueFull
+    when UPLOAD_BATCH_MAX_PENDING_FILES would be exceeded. Once accepted,
+    the batch takes ownership of the buffers.
+    """
+    global _pending_batch_files
+    _evict_expired_jobs()
+    if accepted and _pending_batch_files + len(accepted) > UPLOAD_BATCH_MAX_PENDING_FILES:
+        raise UploadQueueFull("Too many uploads are being processed, please retry shortly.")
+    batch = UploadBatch(id=str(uuid4()), user_id=str(current_user.id), created_at=_now(), files=list(rejected))
+    items = []
+    for buffer, filename in accepted:
+        job = _new_job(filename, current_user)
+        _jobs[job.id] = job
+        batch.files.append(UploadBatchFile(filename=filename, job_id=job.id))
+        items.append((job, buffer))
+    _batches[batch.id] = batch
+    logger.info(f"Batch {batch.id}: accepted {len(items)} files, rejected {len(rejected)}")
+
+    _pending_batch_files += len(items)
+    task = asyncio.create_task(run_upload_batch(batch, items, current_user))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(lambda _: _release_batch_files(len(items)))
+    return batch
+
+
+def _release_batch_files(count: int):
+    global _pending_batch_files
+    _pending_batch_files -= count
+
+
+def _refresh_batch_files(batch: UploadBatch):
+    for entry in batch.files:
+        job = _jobs.get(entry.job_id) if entry.job_id else None
+        if job is None:
+            continue
+        entry.status = job.status
+        entry.error = job.error
+        entry.inserted_transactions = len(job.inserted_transaction_ids)
+        entry.skipped_duplicates = job.skipped_duplicates
+        entry.duplicate_of = job.duplicate_of
+        entry.duration_seconds = job.duration_seconds
+
+
+async def run_upload_batch(batch: UploadBatch, items: List[Tuple[UploadJob, UploadBuffer]], current_user: User):
+    """Runs every file's pipeline concurrently, then links budgets once over all inserted transactions."""
+    batch.status = "running"
+    batch.started_at = _now()
+    start_time = time.time()
+    try:
+        await asyncio.gather(*(
+            run_upload_pipeline(job, buffer, current_user, link_budgets=False) for job, buffer in items
+        ))
+        inserted_ids = [i for job, _ in items for i in job.inserted_transaction_ids]
+        batch.inserted_transactions = len(inserted_ids)
+
+        link_start = time.time()
+        if inserted_ids:
+            await asyncio.to_thread(auto_link_transactions_to_budgets, current_user.id, inserted_ids)
+        batch.link_budgets_seconds = round(time.time() - link_start, 3)
+
+        batch.status = "completed" if any(job.status == "completed" for job, _ in items) else "failed"
+    except Exception as e:
+        batch.status = "failed"
+        batch.error = f"Batch processing failed: {e}"
+        logger.exception(f"Batch {batch.id}: failed")
+    finally:
+        for _, buffer in items:
+            buffer.close()
+        _refresh_batch_files(batch)
+        batch.finished_at = _now()
+        batch.duration_seconds = round(time.time() - start_time, 3)
+        logger.info(f"Batch {batch.id}: {batch.status} in {batch.duration_seconds:.2f} seconds")
+
+
+async def _worker():
+    while True:
+        job, buffer, current_user, checkpoints = await _queue.get()
+        try:
+            await run_upload_pipeline(job, buffer, current_user, checkpoints=checkpoints)
+        except Exception:
+            logger.exception(f"Job {job.id}: unexpected worker error")
+        finally:
+            _queue.task_done()
+
+
+async def reconcile_chunks(
+    job: UploadJob,
+    current_user: User,
+    entity_map: Dict[str, str],
+    deanonymizer: Deanonymizer,
+    money_in,
+    money_out,
+    chunks: List[str],
+    chunk_rows: List[List[dict]],
+    chunk_ids: Dict[int, List[str]],
+    stored_counts: Dict[int, int],
+    occurrences: Counter,
+) -> List[dict]:
+    """
+    Compares the extracted money in/out with the statement totals and checks
+    each chunk against its source text. When the totals do not balance (or
+    are unavailable), chunks failing the local checks are extracted again with
+    the stricter prompt; a re-extraction with fewer issues replaces the rows
+    that chunk stored. The replacement is stored before the old rows are
+    deleted and the extraction checkpoint is refreshed after each swap. A
+    chunk whose re-extraction or swap fails keeps its original rows. Returns
+    the final rows in statement order.
+    """
+    own_names = list(entity_map) + list(entity_map.values())
+    # Totals cover the whole statement, so they cannot be compared once already imported lines were dropped.
+    use_totals = not (job.overlap or {}).get("lines_dropped")
+    rows = [tx for chunk in chunk_rows for tx in chunk]
+    before = compare_totals(rows, money_in if use_totals else None, money_out if use_totals else None, own_names)
+
+    flagged = {}
+    if before["balanced"] is not True:
+        for index, chunk in enumerate(chunks):
+            issues = chunk_issues(chunk, chunk_rows[index], check_row_count=before["balanced"] is False)
+            if issues:
+                flagged[index] = issues
+    if flagged:
+        logger.info(f"Job {job.id}: re-extracting chunks {sorted(flagged)}: {flagged}")
+
+    reextracted = await asyncio.gather(*(reextract_chunk(chunks[index]) for index in flagged), return_exceptions=True)
+    replaced, failed = [], {}
+    for index, new_rows in zip(flagged, reextracted):
+        if isinstance(new_rows, BaseException):
+            logger.error(f"Job {job.id}: re-extraction of chunk {index} failed, keeping it: {new_rows}")
+            failed[str(index)] = str(new_rows)
+            continue
+        new_issues = chunk_issues(chunks[index], new_rows, check_row_count=before["balanced"] is False)
+        if len(new_issues) >= len(flagged[index]):
+            logger.info(f"Job {job.id}: re-extraction of chunk {index} did not improve ({new_issues}), keeping it")
+            continue
+        old_ids = set(chunk_ids.get(index, []))
+        try:
+            ids, skipped = await asyncio.to_thread(
+                store_transactions_in_db, new_rows, current_user.id, entity_map, deanonymizer,
+                job.inserted_transaction_ids, occurrences, job.id,
+            )
+        except Exception as e:
+            logger.error(f"Job {job.id}: storing the re-extraction of chunk {index} failed, keeping it: {e}")
+            failed[str(index)] = str(e)
+            continue
+        try:
+            await asyncio.to_thread(delete_transactions_in_db, list(old_ids), current_user.id)
+        except Exception as e:
+            logger.error(f"Job {job.id}: could not delete the old rows of chunk {index}, keeping them: {e}")
+            failed[str(index)] = str(e)
+            try:
+                await asyncio.to_thread(delete_transactions_in_db, ids, current_user.id)
+            except Exception as e:
+                logger.error(f"Job {job.id}: chunk {index} is stored twice, could not delete its re-extraction {ids}: {e}")
+            continue
+        job.inserted_transaction_ids = [i for i in job.inserted_transaction_ids if i not in old_ids] + ids
+        job.skipped_duplicates += len(skipped)
+        chunk_ids[index] = ids
+        chunk_rows[index] = new_rows
+        stored_counts[index] = len(new_rows)
+        replaced.append(index)
+        await checkpoint(job, "normalize_and_extract", extraction_checkpoint(
+            chunks, chunk_rows, chunk_ids, stored_counts, occurrences
+        ))
+
+    rows = [tx for chunk in chunk_rows for tx in chunk]
+    after = compare_totals(rows, money_in if use_totals else None, money_out if use_totals else None, own_names)
+    job.reconciliation = {
+        **after,
+        "balanced_before": before["balanced"],
+        "chunks_flagged": {str(index): issues for index, issues in flagged.items()},
+        "chunks_reextracted": replaced,
+        "chunks_failed": failed,
+    }
+    return rows
+
+
+RESTORED = "restored from checkpoint"
+# Stages whose results the "transactions" checkpoint holds.
+STORED_STAGES = (
+    "parse_known_layout", "filter_pages", "extract_sections", "normalize_and_extract", "store_transactions", "reconcile",
+)
+
+
+def extraction_checkpoint(chunks, chunk_rows, chunk_ids, stored_counts, occurrences) -> Dict:
+    """Payload of the normalize_and_extract checkpoint."""
+    return {
+        "chunks": chunks, "chunk_rows": chunk_rows, "chunk_ids": chunk_ids, "stored_counts": stored_counts,
+        "occurrences": dict(occurrences),
+    }
+
+
+async def checkpoint(job: UploadJob, stage: str, payload: Dict):
+    """Saves a stage's output; a failed write is only logged, as it merely limits what a resume can skip."""
+    try:
+        await asyncio.to_thread(save_checkpoint, job.id, job.user_id, stage, payload)
+    except Exception as e:
+        logger.error(f"Job {job.id}: could not checkpoint stage {stage}: {e}")
+
+
+async def extract_and_store(
+    job: UploadJob,
+    current_user: User,
+    anonymized_text: str,
+    entity_map: Dict[str, str],
+    deanonymizer: Deanonymizer,
+    covered: List,
+    checkpoints: Dict[str, Dict],
+) -> List[dict]:
+    """
+    Extracts transactions with a layout parser or the LLM stages and stores
+    them. The sections and extracted rows are checkpointed; a store failure
+    during streaming stops further inserts but lets extraction finish, so a
+    resume only has to store the rows that were not written.
+    """
+    with track_stage(job, "parse_known_layout") as stage:
+        job.extraction_path, transactions = parse_statement(anonymized_text)
+        stage.detail = f"path: {job.extraction_path}"
+
+    if transactions:
+        parsed_count = len(transactions)
+        transactions = [tx for tx in transactions if not is_covered(tx.get("date") or "", covered)]
+        job.overlap["transactions_dropped"] = parsed_count - len(transactions)
+        skip_stage(job, "filter_pages", f"parsed by {job.extraction_path} layout parser")
+        skip_stage(job, "extract_sections", f"parsed by {job.extraction_path} layout parser")
+        skip_stage(job, "normalize_and_extract", f"parsed by {job.extraction_path} layout parser")
+        skip_stage(job, "reconcile", f"parsed by {job.extraction_path} layout parser")
+
+        with track_stage(job, "store_transactions") as stage:
+            inserted_transaction_ids, skipped = await asyncio.to_thread(
+                store_transactions_in_db, transactions, current_user.id, entity_map, deanonymizer, job_id=job.id
+            )
+            job.inserted_transaction_ids = inserted_transaction_ids
+            job.skipped_duplicates = len(skipped)
+            stage.detail = f"{len(inserted_transaction_ids)} transactions inserted, {len(skipped)} duplicates skipped"
+        return transactions
+
+    with track_stage(job, "filter_pages") as stage:
+        statement_text, job.page_filter = filter_statement_pages(anonymized_text.split(PAGE_SEPARATOR))
+        statement_text, job.overlap["lines_dropped"] = drop_covered_lines(statement_text, covered)
+        stage.detail = (
+            f"kept {job.page_filter['pages_kept']}/{job.page_filter['pages_total']} pages, "
+            f"{job.page_filter['token_reduction_pct']}% fewer tokens, "
+            f"{job.overlap['lines_dropped']} lines already imported"
+        )
+
+    if "extract_sections" in checkpoints:
+        saved = checkpoints["extract_sections"]
+        transactions_text, money_in, money_out = saved["transactions"], saved["money_in"], saved["money_out"]
+        skip_stage(job, "extract_sections", RESTORED)
+    else:
+        with track_stage(job, "extract_sections"):
+            async with llm_slots:
+                transactions_text, money_in, money_out = await sections_extraction(statement_text)
+        await checkpoint(job, "extract_sections", {
+            "transactions": transactions_text, "money_in": money_in, "money_out": money_out,
+        })
+    job.money_in, job.money_out = money_in, money_out
+    logger.info(f"Job {job.id}: total money in: {money_in}, total money out: {money_out}")
+
+    chunk_ids: Dict[int, List[str]] = {}
+    # Rows of each chunk already handed to the database; chunks are stored in order, so these are a prefix.
+    stored_counts: Dict[int, int] = {}
+    # Numbers identical rows across batches so their natural keys stay distinct.
+    occurrences: Counter = Counter()
+
+    def store_batch(index: int, rows: List[dict]):
+        ids, skipped = store_transactions_in_db(
+            rows, current_user.id, entity_map, deanonymizer,
+            exclude_ids=job.inserted_transaction_ids, occurrences=occurrences, job_id=job.id,
+        )
+        job.inserted_transaction_ids.extend(ids)
+        chunk_ids.setdefault(index, []).extend(ids)
+        stored_counts[index] = stored_counts.get(index, 0) + len(rows)
+        job.skipped_duplicates += len(skipped)
+        publish_progress(job, "store_transactions", len(job.inserted_transaction_ids), None, "transactions")
+
+    if "normalize_and_extract" in checkpoints:
+        saved = checkpoints["normalize_and_extract"]
+        chunks, chunk_rows = saved["chunks"], saved["chunk_rows"]
+        chunk_ids.update({int(index): ids for index, ids in saved["chunk_ids"].items()})
+        stored_counts.update({int(index): count for index, count in saved["stored_counts"].items()})
+        occurrences.update(saved.get("occurrences", {}))
+        job.inserted_transaction_ids = [i for ids in chunk_ids.values() for i in ids]
+        skip_stage(job, "normalize_and_extract", RESTORED)
+        with track_stage(job, "store_transactions") as store_stage:
+            for index, rows in enumerate(chunk_rows):
+                remaining = rows[stored_counts.get(index, 0):]
+                if remaining:
+                    await asyncio.to_thread(store_batch, index, remaining)
+            store_stage.detail = (
+                f"{len(job.inserted_transaction_ids)} transactions stored, "
+                f"{job.skipped_duplicates} duplicates skipped"
+            )
+    else:
+        store_error = None
+
+        def store_while_streaming(index: int, rows: List[dict]):
+            nonlocal store_error
+            if store_error is not None:
+                return
+            try:
+                store_batch(index, rows)
+            except Exception as e:
+                store_error = e
+                logger.error(f"Job {job.id}: storing transactions failed, finishing extraction without storing: {e}")
+
+        with track_stage(job, "store_transactions") as store_stage:
+            with track_stage(job, "normalize_and_extract") as stage:
+                transactions, chunks, chunk_rows = await extract_transactions_chunked(
+                    transactions_text,
+                    on_transactions=store_while_streaming,
+                    on_progress=lambda done, total: publish_progress(job, "normalize_and_extract", done, total, "chunks"),
+                )
+                stage.detail = f"{len(transactions)} transactions"
+            await checkpoint(job, "normalize_and_extract", extraction_checkpoint(
+                chunks, chunk_rows, chunk_ids, stored_counts, occurrences
+            ))
+            if store_error is not None:
+                raise store_error
+            store_stage.detail = (
+                f"{len(job.inserted_transaction_ids)} transactions inserted while streaming, "
+                f"{job.skipped_duplicates} duplicates skipped"
+            )
+
+    with track_stage(job, "reconcile") as stage:
+        transactions = await reconcile_chunks(
+            job, current_user, entity_map, deanonymizer, money_in, money_out,
+            chunks, chunk_rows, chunk_ids, stored_counts, occurrences,
+        )
+        stage.detail = (
+            f"balanced: {job.reconciliation['balanced']}, "
+            f"re-extracted {len(job.reconciliation['chunks_reextracted'])}/{len(chunks)} chunks"
+        )
+    return transactions
+
+
+async def run_upload_pipeline(
+    job: UploadJob,
+    buffer: Optional[UploadBuffer],
+    current_user: User,
+    link_budgets: bool = True,
+    checkpoints: Optional[Dict[str, Dict]] = None,
+):
+    """
+    Runs the ingestion stages for one upload. Stage outputs are checkpointed
+    as they complete; when resuming, `checkpoints` holds them by stage and
+    those stages are restored instead of run again (the buffer may then be None).
+    """
+    checkpoints = checkpoints or {}
+    job.status = "running"
+    job.started_at = _now()
+    start_time = time.time()
+    publish_event(job, "job", status=job.status)
+    logger.info(f"Job {job.id}: processing upload {job.filename}" + (f", resuming after {sorted(checkpoints)}" if checkpoints else ""))
+
+    with record_usage(current_user.id, job.id) as usage:
+        try:
+            if "extract_text" in checkpoints:
+                saved = checkpoints["extract_text"]
+                file_sha256, raw_text = saved["file_sha256"], saved["raw_text"]
+                skip_stage(job, "check_duplicate_file", RESTORED)
+                skip_stage(job, "extract_text", RESTORED)
+            else:
+                file_sha256 = buffer.sha256
+                with track_stage(job, "check_duplicate_file"):
+                    previous = await asyncio.to_thread(find_fingerprint, current_user.id, file_sha256)
+                if previous:
+                    finish_as_duplicate(job, previous, "identical file")
+                    return
+
+                with track_stage(job, "extract_text") as stage:
+                    budget = MemoryBudget()
+                    try:
+                        async with extraction_slots:
+                            raw_text, page_count = await asyncio.to_thread(
+                                extract_pdf_text, buffer.source, budget,
+                                lambda done, total: publish_progress(job, "extract_text", done, total, "pages"),
+                            )
+                    except MemoryBudgetExceeded as e:
+                        raise UploadRejected(str(e))
+                    finally:
+                        job.memory = budget.report()
+                    buffer.close()
+                    stage.detail = f"{len(raw_text)} characters from {page_count} pages"
+                await checkpoint(job, "extract_text", {
+                    "filename": job.filename, "file_sha256": file_sha256, "raw_text": raw_text, "page_count": page_count,
+                })
+
+            with track_stage(job, "validate"):
+                if len(raw_text.strip()) < 500:
+                    raise UploadRejected("This PDF is too short to be a valid bank statement.")
+                if not is_probably_bank_statement(raw_text):
+                    raise UploadRejected("This PDF does not appear to be a bank statement.")
+
+            with track_stage(job, "check_statement_period") as stage:
+                text_sha256 = text_hash(raw_text)
+                previous = await asyncio.to_thread(find_fingerprint, current_user.id, None, text_sha256)
+                account = account_hash(raw_text)
+                period = text_period(raw_text)
+                # Without an account number, overlapping lines are left to the insert-time duplicate check.
+                covered = (
+                    await asyncio.to_thread(find_covered_periods, current_user.id, account, period)
+                    if period and account and not previous else []
+                )
+                job.overlap = {"covered_periods": covered}
+                stage.detail = (
+                    f"period {period}, overlaps {len(covered)} imported statements" if account
+                    else f"period {period}, no account number found, overlap not checked"
+                )
+            if previous:
+                finish_as_duplicate(job, previous, "identical text")
+                return
+
+            if "anonymize" in checkpoints:
+                saved = checkpoints["anonymize"]
+                anonymized_text, entity_map_id = saved["anonymized_text"], saved["entity_map_id"]
+                entity_map = await asyncio.to_thread(load_entity_map, entity_map_id, current_user.id)
+                skip_stage(job, "anonymize", RESTORED)
+            else:
+                with track_stage(job, "anonymize") as stage:
+                    anonymized_text, entity_map_id, entity_map = await anonymize_text(raw_text, current_user)
+                    stage.detail = f"entity map {entity_map_id}"
+                await checkpoint(job, "anonymize", {"anonymized_text": anonymized_text, "entity_map_id": entity_map_id})
+            deanonymizer = Deanonymizer(entity_map)
+
+            if "transactions" in checkpoints:
+                saved = checkpoints["transactions"]
+                transactions = saved["transactions"]
+                job.extraction_path = saved["extraction_path"]
+                job.inserted_transaction_ids = saved["inserted_transaction_ids"]
+                job.skipped_duplicates = saved["skipped_duplicates"]
+                job.reconciliation = saved["reconciliation"]
+                job.money_in, job.money_out = saved["money_in"], saved["money_out"]
+                for name in STORED_STAGES:
+                    skip_stage(job, name, RESTORED)
+            else:
+                transactions = await extract_and_store(
+                    job, current_user, anonymized_text, entity_map, deanonymizer, covered, checkpoints
+                )
+                await checkpoint(job, "transactions", {
+                    "transactions": transactions,
+                    "extraction_path": job.extraction_path,
+                    "inserted_transaction_ids": job.inserted_transaction_ids,
+                    "skipped_duplicates": job.skipped_duplicates,
+                    "reconciliation": job.reconciliation,
+                    "money_in": job.money_in,
+                    "money_out": job.money_out,
+                })
+
+            if "link_budgets" in checkpoints:
+                skip_stage(job, "link_budgets", RESTORED)
+            elif link_budgets:
+                with track_stage(job, "link_budgets"):
+                    await asyncio.to_thread(auto_link_transactions_to_budgets, current_user.id, job.inserted_transaction_ids)
+                await checkpoint(job, "link_budgets", {"transaction_ids": job.inserted_transaction_ids})
+            else:
+                skip_stage(job, "link_budgets", "linked once for the whole batch")
+
+            with track_stage(job, "record_fingerprint") as stage:
+                period = merge_periods(period, transactions_period(transactions))
+                job.period_start, job.period_end = period or (None, None)
+                await asyncio.to_thread(
+                    record_fingerprint, current_user.id, job.id, file_sha256, text_sha256,
+                    account, period, len(job.inserted_transaction_ids),
+                )
+                stage.detail = f"period {job.period_start} to {job.period_end}"
+
+            job.status = "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) if isinstance(e, UploadRejected) else f"Upload processing failed: {e}"
+            job.resumable = not isinstance(e, UploadRejected)
+            for stage in job.stages:
+                if stage.status == "pending":
+                    stage.status = "skipped"
+            if not isinstance(e, UploadRejected):
+                logger.exception(f"Job {job.id}: pipeline failed")
+        finally:
+            job.finished_at = _now()
+            job.duration_seconds = round(time.time() - start_time, 3)
+            if buffer:
+                buffer.close()
+            if not job.resumable:
+                try:
+                    await asyncio.to_thread(delete_checkpoints, job.id, RAW_TEXT_CHECKPOINTS)
+                except Exception as e:
+                    logger.error(f"Job {job.id}: could not drop the raw text checkpoint: {e}")
+            if usage.calls:
+                job.llm_usage = usage.summary()
+                try:
+                    await asyncio.to_thread(persist_usage, usage)
+                except Exception as e:
+                    logger.error(f"Job {job.id}: could not store LLM usage: {e}")
+            logger.info(f"Job {job.id}: {job.status} in {job.duration_seconds:.2f} seconds")
+            publish_event(
+                job, "job", status=job.status, error=job.error, duration_seconds=job.duration_seconds,
+                inserted_transactions=len(job.inserted_transaction_ids),
+            )
+            events = _job_events.get(job.id)
+            if events:
+                events.close()
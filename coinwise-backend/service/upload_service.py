@@ -1,15 +1,26 @@
 from datetime import datetime
 from fastapi.security import HTTPBearer
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from supabase import Client
-from together import Together
 from lib import get_supabase_client
 from routes.auth import User
+from service.anonymization_service import Deanonymizer, get_anonymizer
+from service.duplicate_check_service import split_existing_duplicates
+from service.incremental_json import IncrementalJSONArrayParser
+from service.llm_cache_service import llm_cache
+from service.llm_gateway import LLMStreamInterrupted, llm_gateway
+from service.llm_usage import record_call
+from service.model_router import model_router
+from service.transaction_writer import assign_natural_keys, fetch_stored_ids, write_transactions
 import re
 import json
 import time
+import asyncio
+import os
+import threading
+from collections import Counter
 from uuid import uuid4
-from typing import List, Optional, Tuple, Dict
+from typing import Callable, List, Optional, Tuple, Dict
 import logging
 from routes.auth import User
 from lib import get_supabase_client
@@ -25,10 +36,26 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger("transaction_processor")
-client = Together()
 
 supabase: Client = get_supabase_client()
 
+EXTRACTION_CHUNK_CHARS = int(os.getenv("EXTRACTION_CHUNK_CHARS", "6000"))
+# Process-wide cap on concurrent LLM requests, shared by every upload job and batch.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+STREAM_INSERT_BATCH_SIZE = int(os.getenv("STREAM_INSERT_BATCH_SIZE", "25"))
+# Source lines before the first unparsed one that are sent again with a cut-off tail, in case lines and rows drifted.
+REPAIR_TAIL_OVERLAP = 2
+
+# Bump whenever a prompt changes so cached stage outputs are not reused.
+PROMPT_VERSION = "1"
+
+TRANSACTION_START_PATTERN = re.compile(
+    r"^\s*(?:\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}\s+[^\W\d_]{3,}\.?\s+\d{4})"
+)
+
+
+TRANSACTION_TYPES = ("expense", "income", "transfer", "deposit")
 
 
 class Transaction(BaseModel):
@@ -42,53 +69,30 @@ class Transaction(BaseModel):
     sender: Optional[str] = Field(None, description="Sender name (for transfers).")
     receiver: Optional[str] = Field(None, description="Receiver name (for transfers).")
 
+    @field_validator("date")
+    @classmethod
+    def date_is_iso(cls, value: str) -> str:
+        datetime.strptime(value, "%Y-%m-%d")
+        return value
+
+    @field_validator("type")
+    @classmethod
+    def type_is_known(cls, value: str) -> str:
+        value = value.strip().lower()
+        if value not in TRANSACTION_TYPES:
+            raise ValueError(f"type must be one of {', '.join(TRANSACTION_TYPES)}")
+        return value
+
 class TransactionList(BaseModel):
     root : List[Transaction]
 
-def generate_flexible_name_pattern(full_name: str) -> str:
-    """Creates a regex pattern to match name with optional spaces, hyphens, or newlines."""
-    parts = re.split(r'\s+', full_name.strip())
-    return r'[\s\-]*'.join(map(re.escape, parts))
-
 async def anonymize_text(text: str, current_user: User) -> Tuple[str, str, Dict[str, str]]:
     logger.info("Starting text anonymization process")
     start_time = time.time()
 
-    new_text = text
-    entity_map = {}
-    user_full_name = current_user.full_name
-
-
-    logger.info("Anonymizing user's full name: %s", user_full_name)
-
-    name_pattern = generate_flexible_name_pattern(user_full_name)
-    name_regex = re.compile(name_pattern, flags=re.IGNORECASE | re.MULTILINE)
-
-    match = name_regex.search(new_text)
-    if match:
-        anon_name = f"@name_{uuid4().hex[:6]}"
-        new_text = name_regex.sub(anon_name, new_text)
-        entity_map[anon_name] = user_full_name
-        logger.info(f"Anonymized user name: {user_full_name} -> {anon_name}")
-    else:
-        logger.warning("User's name not found in the text.")
-
-
-    logger.info("Anonymizing IBANs and card numbers")
-
-    patterns = [
-        (r"\b[A-Z]{2}\d{2}[A-Z0-9]{11,30}\b", "@iban_"),
-        (r"\b(?:\d[ -]*?){13,16}\b", "@card_")
-    ]
-
-    for pattern, prefix in patterns:
-        matches = re.findall(pattern, new_text)
-        logger.debug(f"Found {len(matches)} matches for pattern {pattern}")
-
-        for match in matches:
-            anon_id = f"{prefix}{uuid4().hex[:6]}"
-            new_text = new_text.replace(match, anon_id)
-
+    logger.info("Anonymizing user's full name, IBANs and card numbers")
+    anonymizer = get_anonymizer(str(current_user.id), current_user.full_name)
+    new_text, entity_map = await asyncio.to_thread(anonymizer.anonymize, text)
 
     entity_map_id = str(uuid4())
     try:
@@ -106,11 +110,7 @@ async def anonymize_text(text: str, current_user: User) -> Tuple[str, str, Dict[
 
     return new_text, entity_map_id, entity_map
 
-def sections_extraction(raw_text):
-    logger.info("Starting transaction sections extraction")
-    
-
-    sections_system_prompt = """
+SECTIONS_SYSTEM_PROMPT = """
    You are a financial document extraction engine specialized in identifying and isolating only the transaction-related content from messy and unstructured Romanian and international bank statements (including Revolut). 
 
     Your task is to accurately identify and extract :
@@ -138,50 +138,8 @@ def sections_extraction(raw_text):
     "money_out": "<total money out from final summary>"
     }
     """
-    sections_user_prompt = f"""
-    Below is the full raw text extracted from a Romanian bank statement PDF. Extract:
-
-    1. Only the lines representing transactions — skip any intermediate or daily totals, balances, or non-transaction lines.
-    2. The final total money in and money out values from the end of the statement.
-
-    Return a JSON object as explained.
-    
-    {raw_text}
-   
-    """
-
-    logger.info("Sending request to Together API for sections extraction")
-    response = client.chat.completions.create(
-        model="meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
-        messages=[
-            {"role": "system", "content": sections_system_prompt},
-            {"role": "user", "content": sections_user_prompt}
-        ],
-        temperature=0.01,
-        max_tokens=50000,
-        stream=False,
-        
-        )
-    raw_content = response.choices[0].message.content
-    print("Raw content from Together API:", raw_content)
-    cleaned_json_str = re.sub(r'^```json\n|```$', '', raw_content.strip())
-
-   
-    try:
-        parsed_data = json.loads(cleaned_json_str)
-        
-        return parsed_data["transactions"], parsed_data["money_in"], parsed_data["money_out"]
-    except json.JSONDecodeError as e:
-        print("JSON parsing failed:", e)
-
 
-  
-
-def normalize_and_extract(raw_text: str):
-    logger.info("Starting transaction preprocessing and classification")
-    
-
-    normalization_system_prompt = """
+NORMALIZATION_SYSTEM_PROMPT = """
    You are a text normalization engine for financial data. Your job is to take raw transaction text extracted from a bank statement and restructure it so that each transaction is placed entirely on a single line.
     Instructions:
     - Join any multi-line transactions into one single line per transaction.
@@ -193,24 +151,8 @@ def normalize_and_extract(raw_text: str):
 
     Your output must look like a list of transactions, one per line, fully flattened.
     """
-    normalization_user_prompt = f"""
-   Here is the transaction section. Flatten each transaction so it appears entirely on one line:
-    {raw_text}
-    """
 
-    norm_response = client.chat.completions.create(
-        model="meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
-        messages=[
-            {"role": "system", "content": normalization_system_prompt},
-            {"role": "user", "content": normalization_user_prompt}
-        ],
-        temperature=0.01,
-        max_tokens=50000
-    )
-
-    normalized_text = norm_response.choices[0].message.content.strip()
-    print("Normalized text:", normalized_text)
-    extraction_system_prompt = """
+EXTRACTION_SYSTEM_PROMPT = """
    You are a financial transaction parser.
 
 You will receive a block of text where each line represents a single normalized bank transaction. Your task is to extract all valid transactions and return a list of structured JSON objects — one for each line.
@@ -300,17 +242,134 @@ Do summarize what a human would expect to see in a finance app.
 - NEVER include card numbers, IBANs, metadata, RRN, TID, or technical codes.
 - NEVER generate keys outside the allowed schema.
 
-    """ 
+    """
+
+STRICT_EXTRACTION_SYSTEM_PROMPT = EXTRACTION_SYSTEM_PROMPT + """
+**Re-extraction Rules (a previous extraction of this text did not reconcile):**
+- Return exactly one object per transaction line, in order; never skip or merge lines.
+- Copy every `"amount"` digit for digit from the line; never compute, convert or round amounts.
+- Skip balances, daily totals, opening and closing amounts and any other non-transaction line.
+- A line without an amount is not a transaction.
+    """
+
+
+REPAIR_SYSTEM_PROMPT = EXTRACTION_SYSTEM_PROMPT + """
+**Repair Rules (you are fixing part of an earlier extraction):**
+- You receive rejected transaction objects with the validation error and, when known, the source line; and/or source lines whose output was cut off.
+- Return a JSON object {"root": [...]} with one corrected transaction per rejected object and one per transaction source line.
+- Take values from the source line when one is given; never invent a date or amount.
+- Return nothing for lines that are not transactions.
+    """
+
+
+async def sections_extraction(raw_text):
+    logger.info("Starting transaction sections extraction")
+    model = model_router.model_for("sections")
+    cache_key = llm_cache.make_key("sections", model, PROMPT_VERSION, SECTIONS_SYSTEM_PROMPT, raw_text)
+    cached = await asyncio.to_thread(llm_cache.get, cache_key, "sections")
+    if cached is not None:
+        record_call("sections", model, len(raw_text), 0, None, 0.0, 0, True, cached=True)
+        return cached["transactions"], cached["money_in"], cached["money_out"]
+
+    sections_user_prompt = f"""
+    Below is the full raw text extracted from a Romanian bank statement PDF. Extract:
+
+    1. Only the lines representing transactions — skip any intermediate or daily totals, balances, or non-transaction lines.
+    2. The final total money in and money out values from the end of the statement.
+
+    Return a JSON object as explained.
+    
+    {raw_text}
+   
+    """
+
+    logger.info("Sending request to Together API for sections extraction")
+    response = await llm_gateway.complete(
+        stage="sections",
+        model=model,
+        messages=[
+            {"role": "system", "content": SECTIONS_SYSTEM_PROMPT},
+            {"role": "user", "content": sections_user_prompt}
+        ],
+        temperature=0.01,
+        max_tokens=50000,
+        )
+    raw_content = response.choices[0].message.content
+    print("Raw content from Together API:", raw_content)
+    cleaned_json_str = re.sub(r'^```json\n|```$', '', raw_content.strip())
+
+   
+    try:
+        parsed_data = json.loads(cleaned_json_str)
+        await asyncio.to_thread(llm_cache.put, cache_key, "sections", {
+            "transactions": parsed_data["transactions"],
+            "money_in": parsed_data["money_in"],
+            "money_out": parsed_data["money_out"],
+        })
+        return parsed_data["transactions"], parsed_data["money_in"], parsed_data["money_out"]
+    except (json.JSONDecodeError, KeyError) as e:
+        logger.error(f"Sections extraction returned an unusable response: {e}")
+        raise ValueError(f"Sections extraction returned an unusable response: {e}")
+
+
+  
+
+async def normalize_and_extract(
+    raw_text: str,
+    on_transactions: Optional[Callable[[List[dict]], None]] = None,
+    extraction_prompt: str = EXTRACTION_SYSTEM_PROMPT,
+):
+    """
+    Flattens a transaction section and extracts structured transactions from it.
+    The extraction response is streamed; when on_transactions is given it is
+    called (in a worker thread, as it usually writes to the database) with
+    batches of validated rows while the model is still generating.
+    """
+    logger.info("Starting transaction preprocessing and classification")
+    start_time = time.time()
+    normalize_model = model_router.model_for("normalize")
+    extract_model = model_router.model_for("extract")
+    cache_key = llm_cache.make_key(
+        "normalize_extract", f"{normalize_model}+{extract_model}", PROMPT_VERSION,
+        NORMALIZATION_SYSTEM_PROMPT + extraction_prompt, raw_text,
+    )
+    cached = await asyncio.to_thread(llm_cache.get, cache_key, "normalize_extract")
+    if cached is not None:
+        record_call("normalize", normalize_model, len(raw_text), 0, None, 0.0, 0, True, cached=True)
+        record_call("extract", extract_model, 0, 0, None, 0.0, 0, True, cached=True)
+        if on_transactions and cached["root"]:
+            await asyncio.to_thread(on_transactions, cached["root"])
+        return cached
+
+    normalization_user_prompt = f"""
+   Here is the transaction section. Flatten each transaction so it appears entirely on one line:
+    {raw_text}
+    """
+
+    norm_response = await llm_gateway.complete(
+        stage="normalize",
+        model=normalize_model,
+        messages=[
+            {"role": "system", "content": NORMALIZATION_SYSTEM_PROMPT},
+            {"role": "user", "content": normalization_user_prompt}
+        ],
+        temperature=0.01,
+        max_tokens=50000
+    )
+
+    normalized_text = norm_response.choices[0].message.content.strip()
+    print("Normalized text:", normalized_text)
     extraction_user_prompt = f"""
     Here are the cleaned transactions, one per line. Extract structured transactions as described:
 
     {normalized_text}
     """
 
-    extract_response = client.chat.completions.create(
-        model="meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
+    stream = llm_gateway.stream(
+        stage="extract",
+        model=extract_model,
         messages=[
-            {"role": "system", "content": extraction_system_prompt},
+            {"role": "system", "content": extraction_prompt},
             {"role": "user", "content": extraction_user_prompt}
         ],
         temperature=0.01,
@@ -318,21 +377,132 @@ Do summarize what a human would expect to see in a finance app.
         response_format={
             "type":"json_object",
             "schema": TransactionList.model_json_schema(),
-        }
-       
+        },
     )
 
-    result_text = extract_response.choices[0].message.content
-    logger.info("Received response from Together API for transaction extraction")
-    print("Raw result from Together API:", result_text)
-    cleaned = re.sub(r'^```json\\n|```$', '', result_text.strip())
-
+    parser = IncrementalJSONArrayParser()
+    transactions = []
+    rejected = []
+    batch = []
+    first_row_at = None
+    interrupted = False
     try:
-        print("Cleaned JSON string:", cleaned)
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        logger.error("JSON parsing failed: %s", e)
-        raise
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            first_index = parser.objects_seen
+            objects = parser.feed(delta)
+            malformed = {index for index, _ in parser.malformed}
+            positions = [i for i in range(first_index, parser.objects_seen) if i not in malformed]
+            for position, obj in zip(positions, objects):
+                row, error = check_transaction(obj)
+                if row is None:
+                    rejected.append({"position": position, "object": obj, "error": error})
+                    continue
+                if first_row_at is None:
+                    first_row_at = time.time()
+                    logger.info(f"First transaction streamed after {first_row_at - start_time:.2f}s")
+                transactions.append(row)
+                batch.append(row)
+                if on_transactions and len(batch) >= STREAM_INSERT_BATCH_SIZE:
+                    await asyncio.to_thread(on_transactions, batch)
+                    batch = []
+    except LLMStreamInterrupted as e:
+        logger.error(str(e))
+        interrupted = True
+
+    logger.info(f"Extraction stream finished with {len(transactions)} transactions in {time.time() - start_time:.2f}s")
+
+    source_lines = [line.strip() for line in normalized_text.splitlines() if line.strip()]
+    rejected.extend(
+        {"position": index, "object": raw, "error": "not valid JSON"} for index, raw in parser.malformed
+    )
+    for item in rejected:
+        if item["position"] < len(source_lines):
+            item["source_line"] = source_lines[item["position"]]
+    tail_lines = []
+    if interrupted or parser.pending_text or not parser.found_array:
+        tail_lines = source_lines[max(0, parser.objects_seen - REPAIR_TAIL_OVERLAP):]
+        logger.error(f"Extraction output ended early after {parser.objects_seen} objects, {len(tail_lines)} lines left")
+
+    complete = True
+    if rejected or tail_lines:
+        accepted = {transaction_key(tx) for tx in transactions}
+        repaired, complete = await repair_transactions(rejected, tail_lines, model_router.model_for("repair"))
+        repaired = [tx for tx in repaired if transaction_key(tx) not in accepted]
+        transactions.extend(repaired)
+        batch.extend(repaired)
+
+    if on_transactions and batch:
+        await asyncio.to_thread(on_transactions, batch)
+
+    if not transactions and source_lines and not complete:
+        raise ValueError("Transaction extraction returned no parseable transactions")
+
+    parsed = {"root": transactions}
+    if complete:
+        await asyncio.to_thread(llm_cache.put, cache_key, "normalize_extract", parsed)
+    return parsed
+
+
+async def repair_transactions(rejected: List[dict], tail_lines: List[str], model: str) -> Tuple[List[dict], bool]:
+    """
+    Sends only the rows that failed validation, and the source lines left
+    without output when the extraction was cut off, back to the model in one
+    small call. Returns the valid repaired rows and whether every rejected row
+    and tail line was accounted for.
+    """
+    logger.info(f"Repairing {len(rejected)} rejected rows and {len(tail_lines)} unextracted lines")
+    parts = []
+    if rejected:
+        parts.append("Rejected transaction objects:")
+        for item in rejected:
+            parts.append(json.dumps({key: item[key] for key in ("object", "error", "source_line") if key in item}, ensure_ascii=False))
+    if tail_lines:
+        parts.append("Source lines whose extraction was cut off:")
+        parts.extend(tail_lines)
+    try:
+        response = await llm_gateway.complete(
+            stage="repair",
+            model=model,
+            messages=[
+                {"role": "system", "content": REPAIR_SYSTEM_PROMPT},
+                {"role": "user", "content": "\n".join(parts)},
+            ],
+            temperature=0.01,
+            max_tokens=200 * (len(rejected) + len(tail_lines)) + 200,
+            response_format={
+                "type": "json_object",
+                "schema": TransactionList.model_json_schema(),
+            },
+        )
+        content = re.sub(r'^```json\n|```$', '', response.choices[0].message.content.strip())
+        objects = json.loads(content)
+        objects = objects.get("root", []) if isinstance(objects, dict) else objects
+    except Exception as e:
+        logger.error(f"Repair call failed, dropping {len(rejected)} rows and {len(tail_lines)} lines: {e}")
+        return [], False
+
+    repaired = []
+    for obj in objects if isinstance(objects, list) else []:
+        row, error = check_transaction(obj)
+        if row is None:
+            logger.warning(f"Dropping transaction that is still invalid after repair {obj}: {error}")
+            continue
+        repaired.append(row)
+    logger.info(f"Repair returned {len(repaired)} valid rows")
+    return repaired, len(repaired) >= len(rejected)
+
+
+def check_transaction(obj) -> Tuple[Optional[dict], Optional[str]]:
+    """Validates one extracted transaction against the Transaction schema; returns the row or the error."""
+    try:
+        return Transaction.model_validate(obj).model_dump(exclude_none=True), None
+    except Exception as e:
+        logger.warning(f"Rejected extracted transaction {obj}: {e}")
+        return None, str(e)
+
 
 def safe_parse_date(raw_date: str) -> Optional[str]:
     try:
@@ -341,25 +511,50 @@ def safe_parse_date(raw_date: str) -> Optional[str]:
         return None
 
 
-def deanonymize_value(value: str, entity_map: dict) -> str:
-    """Replaces anonymized placeholders in a string with their original values."""
-    if not isinstance(value, str):
-        return value
-    for placeholder, original in entity_map.items():
-        value = value.replace(placeholder, original)
-    return value
+DEANONYMIZED_FIELDS = ["description", "merchant", "sender", "receiver"]
 
-def store_transactions_in_db(transactions: list[dict], user_id: str, entity_map: dict):
-    enriched_transactions = []
-
-    for tx in transactions:
-        for key in ["description", "merchant", "sender", "receiver"]:
-            if tx.get(key):
-                tx[key] = deanonymize_value(tx[key], entity_map)
 
+def deanonymize_transactions(transactions: list[dict], deanonymizer: Deanonymizer) -> list[dict]:
+    """
+    Returns copies of the transactions with placeholders restored in every
+    text field, in one pass. The given rows are left untouched, as they are
+    also cached and checkpointed and must stay anonymized.
+    """
+    copies = [dict(tx) for tx in transactions]
+    slots = [(tx, key) for tx in copies for key in DEANONYMIZED_FIELDS if tx.get(key)]
+    restored = deanonymizer.restore_many([tx[key] for tx, key in slots])
+    for (tx, key), value in zip(slots, restored):
+        tx[key] = value
+    return copies
+
+
+def store_transactions_in_db(
+    transactions: list[dict],
+    user_id: str,
+    entity_map: dict,
+    deanonymizer: Optional[Deanonymizer] = None,
+    exclude_ids: Optional[List[str]] = None,
+    occurrences: Optional[Counter] = None,
+    job_id: Optional[str] = None,
+) -> Tuple[List[str], List[dict]]:
+    """
+    Stores extracted transactions for the upload job job_id, skipping rows
+    that duplicate transactions the user already has in the same date window.
+    Rows an earlier attempt of the same job already wrote (same natural key)
+    are not written again but their ids are returned with the inserted ones,
+    so a retry is idempotent. Returns those ids and the skipped rows. Rows
+    that fail on their own are logged and left out; the call only raises when
+    nothing could be written.
+    """
+    enriched_transactions = []
+    for tx in deanonymize_transactions(transactions, deanonymizer or Deanonymizer(entity_map)):
+        date = safe_parse_date(tx.get("date"))
+        if date is None:
+            logger.warning(f"Not storing a {tx.get('type')} of {tx.get('amount')} without a valid date ({tx.get('date')!r})")
+            continue
         enriched = {
             "user_id": user_id,
-           "date": safe_parse_date(tx.get("date")),
+            "date": date,
             "amount": tx.get("amount"),
             "currency": tx.get("currency", "unknown"),
             "description": tx.get("description", ""),
@@ -368,18 +563,149 @@ def store_transactions_in_db(transactions: list[dict], user_id: str, entity_map:
             "merchant": tx.get("merchant"),
             "sender": tx.get("sender"),
             "receiver": tx.get("receiver"),
+            "import_job_id": job_id,
         }
         enriched_transactions.append(enriched)
 
+    assign_natural_keys(enriched_transactions, user_id, occurrences)
+    stored = fetch_stored_ids(user_id, [tx["natural_key"] for tx in enriched_transactions], job_id)
+    stored_ids = [stored[tx["natural_key"]] for tx in enriched_transactions if tx["natural_key"] in stored]
+    if stored_ids:
+        logger.info(f"{len(stored_ids)} transactions were already written by an earlier attempt")
+    enriched_transactions = [tx for tx in enriched_transactions if tx["natural_key"] not in stored]
+
+    enriched_transactions, duplicates = split_existing_duplicates(
+        enriched_transactions, user_id, list(exclude_ids or []) + stored_ids
+    )
+    skipped = [new for new, _ in duplicates]
+    if not enriched_transactions:
+        logger.info(f"All {len(skipped) + len(stored_ids)} transactions were already stored")
+        return stored_ids, skipped
+
+    summary = write_transactions(enriched_transactions)
+    if summary["failed"] and len(summary["failed"]) == len(enriched_transactions):
+        raise RuntimeError(f"Could not store any of {len(enriched_transactions)} transactions: {summary['failed'][0][1]}")
+    return stored_ids + summary["existing_ids"] + summary["inserted_ids"], skipped + summary["skipped"]
+
+
+def delete_transactions_in_db(transaction_ids: List[str], user_id: str):
+    if not transaction_ids:
+        return
+    supabase.table("transactions").delete().in_("id", transaction_ids).eq("user_id", str(user_id)).execute()
+    logger.info(f"Deleted {len(transaction_ids)} transactions for user {user_id}")
+
+
+def split_transaction_chunks(text: str, max_chars: int = EXTRACTION_CHUNK_CHARS) -> List[str]:
+    """
+    Splits the transaction section into line-aligned chunks of roughly max_chars.
+    Chunks are cut before a line that starts with a date so a multi-line
+    transaction is not split; a chunk with no such line for 2 * max_chars is cut
+    at the next line boundary.
+    """
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines():
+        over_budget = size + len(line) > max_chars
+        if current and over_budget and (TRANSACTION_START_PATTERN.match(line) or size > 2 * max_chars):
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if any(l.strip() for l in current):
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def transaction_key(tx: dict) -> tuple:
+    description = (tx.get("description") or "").strip().lower()
     try:
-        response = supabase.table("transactions").insert(enriched_transactions).execute()
-        logger.info(f"Response from Supabase: {response.model_dump_json()}")
-        logger.info("Transactions stored successfully")
-        inserted_ids = [item["id"] for item in response.data if "id" in item]
-        return inserted_ids
-    except Exception as e:
-        logger.exception(f"Exception while inserting transactions: {e}")
-        raise
+        amount = round(float(tx.get("amount")), 2)
+    except (TypeError, ValueError):
+        amount = tx.get("amount")
+    return (tx.get("date"), amount, tx.get("type"), description)
 
 
+class OrderedChunkEmitter:
+    """
+    Releases rows streamed by concurrently running chunks in chunk order.
+    Rows of the earliest unfinished chunk are passed on as soon as they arrive;
+    later chunks are buffered until every chunk before them has completed.
+    Chunks never share a source line, so rows are released as extracted.
+    on_transactions is called with the chunk index and the released rows.
+    """
 
+    def __init__(self, chunk_count: int, on_transactions: Optional[Callable[[int, List[dict]], None]] = None):
+        self._lock = threading.Lock()
+        self._buffers: List[List[dict]] = [[] for _ in range(chunk_count)]
+        self._done = [False] * chunk_count
+        self._active = 0
+        self._on_transactions = on_transactions
+        self.merged: List[dict] = []
+        self.chunk_rows: List[List[dict]] = [[] for _ in range(chunk_count)]
+
+    def add(self, index: int, rows: List[dict]):
+        with self._lock:
+            self._buffers[index].extend(rows)
+            self._drain()
+
+    def complete(self, index: int):
+        with self._lock:
+            self._done[index] = True
+            self._drain()
+
+    def _drain(self):
+        while self._active < len(self._buffers):
+            buffer = self._buffers[self._active]
+            done = self._done[self._active]
+            if buffer:
+                rows = buffer[:]
+                buffer.clear()
+                self.merged.extend(rows)
+                self.chunk_rows[self._active].extend(rows)
+                if self._on_transactions:
+                    self._on_transactions(self._active, rows)
+            if not done:
+                return
+            self._active += 1
+
+
+async def extract_transactions_chunked(
+    transactions_text: str,
+    on_transactions: Optional[Callable[[int, List[dict]], None]] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[List[dict], List[str], List[List[dict]]]:
+    """
+    Runs normalize_and_extract concurrently per chunk and merges the results in
+    order. on_transactions receives the chunk index and rows in statement order
+    as they stream in; on_progress receives (chunks done, chunk count). Returns
+    the merged rows, the chunk texts and the rows kept for each chunk.
+    """
+    chunks = split_transaction_chunks(transactions_text)
+    logger.info(f"Split transaction section into {len(chunks)} chunks")
+    emitter = OrderedChunkEmitter(len(chunks), on_transactions)
+    done = 0
+    if on_progress:
+        on_progress(0, len(chunks))
+
+    async def run(index: int, chunk: str):
+        nonlocal done
+        async with llm_slots:
+            start = time.time()
+            await normalize_and_extract(chunk, lambda rows: emitter.add(index, rows))
+            logger.info(f"Chunk {index + 1}/{len(chunks)} extracted in {time.time() - start:.2f}s")
+        # Completing a chunk can release buffered rows of later chunks into storage, so it runs off the loop.
+        await asyncio.to_thread(emitter.complete, index)
+        done += 1
+        if on_progress:
+            on_progress(done, len(chunks))
+
+    await asyncio.gather(*(run(i, c) for i, c in enumerate(chunks)))
+    return emitter.merged, chunks, emitter.chunk_rows
+
+
+async def reextract_chunk(chunk: str) -> List[dict]:
+    """Extracts one chunk again with the stricter re-extraction prompt."""
+    async with llm_slots:
+        parsed = await normalize_and_extract(chunk, None, STRICT_EXTRACTION_SYSTEM_PROMPT)
+    return parsed["root"]
@@ -41,7 +41,7 @@ export default function TransactionsListScreen() {
     showFilters,
     setShowFilters,
   } = useTransactionUIState();
-  const { uploadDocument, isLoading, processingStage } =
+  const { uploadDocument, isLoading, processingStage, processingProgress } =
     useDocumentUpload(uploadBankStatement);
 
   const { filters, handleFilterChange } =
@@ -172,7 +172,11 @@ export default function TransactionsListScreen() {
         }}
       />
 
-      <ProcessingModal visible={isLoading} currentStage={processingStage} />
+      <ProcessingModal
+        visible={isLoading}
+        currentStage={processingStage}
+        progress={processingProgress}
+      />
 
       <DeleteConfirmModal
         visible={modalVisible}
@@ -4,19 +4,24 @@ import React from "react";
 import { ActivityIndicator, Modal, StyleSheet, Text, View } from "react-native";
 
 const stages = [
-  { key: "anonymizing", label: "Anonymizing sensitive data..." },
-  { key: "extracting_sections", label: "Extracting transaction sections..." },
-  { key: "normalizing", label: "Normalizing document text..." },
-  { key: "extracting_transactions", label: "Extracting transactions..." },
+  { key: "uploading", label: "Uploading statement..." },
+  { key: "extract_text", label: "Reading PDF pages..." },
+  { key: "anonymize", label: "Anonymizing sensitive data..." },
+  { key: "extract_sections", label: "Extracting transaction sections..." },
+  { key: "normalize_and_extract", label: "Extracting transactions..." },
+  { key: "reconcile", label: "Checking statement totals..." },
+  { key: "link_budgets", label: "Linking budgets..." },
   { key: "done", label: "Finished processing!" },
 ];
 
 export default function ProcessingModal({
   visible,
   currentStage,
+  progress,
 }: {
   visible: boolean;
   currentStage: string;
+  progress?: string;
 }) {
   return (
     <Modal visible={visible} transparent animationType="fade">
@@ -32,6 +37,7 @@ export default function ProcessingModal({
                 ]}
               >
                 {stage.label}
+                {currentStage === stage.key && progress ? ` (${progress})` : ""}
               </Text>
               {currentStage === stage.key && (
                 <ActivityIndicator size="small" color={colors.primary[500]} />
@@ -9,8 +9,22 @@ import React, {
   useMemo,
   useState,
 } from "react";
+import { Alert } from "react-native";
 import { PaginatedResponse, TransactionModel } from "../models/transaction";
 
+const confirmDuplicate = (message: string) =>
+  new Promise<boolean>((resolve) =>
+    Alert.alert(
+      "Possible duplicate",
+      `${message}. Add this transaction anyway?`,
+      [
+        { text: "Cancel", style: "cancel", onPress: () => resolve(false) },
+        { text: "Add anyway", onPress: () => resolve(true) },
+      ],
+      { cancelable: true, onDismiss: () => resolve(false) }
+    )
+  );
+
 export interface TransactionFilterOptions {
   transactionClass?: TransactionType;
   category?: string;
@@ -20,6 +34,19 @@ export interface TransactionFilterOptions {
   sortOrder?: "asc" | "desc";
 }
 
+export interface UploadProgressEvent {
+  id: number;
+  event: "job" | "stage" | "progress";
+  elapsed_seconds: number;
+  status?: string;
+  stage?: string;
+  current?: number;
+  total?: number | null;
+  unit?: string;
+  duration_seconds?: number;
+  detail?: string | null;
+}
+
 interface TransactionContextType {
   transactions: TransactionModel[];
   isLoading: boolean;
@@ -37,7 +64,10 @@ interface TransactionContextType {
     page?: number,
     filters?: TransactionFilterOptions
   ) => Promise<void>;
-  uploadBankStatement: (file: FormData) => Promise<any>;
+  uploadBankStatement: (
+    file: FormData,
+    onProgress?: (event: UploadProgressEvent) => void
+  ) => Promise<any>;
   deleteTransaction: (id: string) => Promise<void>;
   updateTransaction: (
     id: string,
@@ -71,6 +101,7 @@ export const TransactionProvider: React.FC<{ children: React.ReactNode }> = ({
 
   const pageSize = 100;
   const maxTransactionCache = 250;
+  const uploadPollIntervalMs = 2000;
   const hasMore = currentPage < totalPages;
 
   const transactionsCleanup = useCallback(() => {
@@ -186,16 +217,26 @@ export const TransactionProvider: React.FC<{ children: React.ReactNode }> = ({
       try {
         const token = await SecureStore.getItem("auth_token");
         const { id, ...dataToSend } = transaction;
-        const response = await axios.post(
-          `${TRANSACTIONS_API_URL}/add`,
-          dataToSend,
-          {
+        const post = (allowDuplicate: boolean) =>
+          axios.post(`${TRANSACTIONS_API_URL}/add`, dataToSend, {
             headers: {
               Authorization: `Bearer ${token}`,
               "Content-Type": "application/json",
             },
-          }
-        );
+            params: allowDuplicate ? { allow_duplicate: true } : undefined,
+          });
+
+        let response;
+        try {
+          response = await post(false);
+        } catch (e) {
+          if (!axios.isAxiosError(e) || e.response?.status !== 409) throw e;
+          const message =
+            e.response.data?.detail?.message ??
+            "A similar transaction already exists";
+          if (!(await confirmDuplicate(message))) return undefined;
+          response = await post(true);
+        }
 
         const addedTransaction = response.data;
         setTransactions((prev) =>
@@ -283,8 +324,67 @@ export const TransactionProvider: React.FC<{ children: React.ReactNode }> = ({
     }
   }, [handleApiError]);
 
+  const waitForUploadJob = useCallback(
+    async (jobId: string, token: string | null): Promise<any> => {
+      while (true) {
+        const response = await axios.get(`${UPLOAD_API_URL}/jobs/${jobId}`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        const job = response.data;
+        if (job.status === "completed" || job.status === "failed") {
+          return job;
+        }
+        await new Promise((res) => setTimeout(res, uploadPollIntervalMs));
+      }
+    },
+    []
+  );
+
+  const streamUploadJobEvents = useCallback(
+    (
+      jobId: string,
+      token: string | null,
+      onEvent: (event: UploadProgressEvent) => void
+    ): Promise<void> =>
+      new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        let consumed = 0;
+        const flush = () => {
+          const text = xhr.responseText;
+          const end = text.lastIndexOf("\n\n");
+          if (end < consumed) return;
+          text
+            .slice(consumed, end)
+            .split("\n\n")
+            .forEach((block) => {
+              const data = block
+                .split("\n")
+                .filter((line) => line.startsWith("data: "))
+                .map((line) => line.slice(6))
+                .join("\n");
+              if (data) onEvent(JSON.parse(data));
+            });
+          consumed = end + 2;
+        };
+        xhr.open("GET", `${UPLOAD_API_URL}/jobs/${jobId}/events`);
+        xhr.setRequestHeader("Authorization", `Bearer ${token}`);
+        xhr.setRequestHeader("Accept", "text/event-stream");
+        xhr.onprogress = flush;
+        xhr.onload = () => {
+          flush();
+          resolve();
+        };
+        xhr.onerror = () => reject(new Error("Upload progress stream failed"));
+        xhr.send();
+      }),
+    []
+  );
+
   const uploadBankStatement = useCallback(
-    async (formData: FormData): Promise<any> => {
+    async (
+      formData: FormData,
+      onProgress?: (event: UploadProgressEvent) => void
+    ): Promise<any> => {
       try {
         const token = await SecureStore.getItemAsync("auth_token");
         const response = await axios.post(`${UPLOAD_API_URL}/`, formData, {
@@ -295,6 +395,32 @@ export const TransactionProvider: React.FC<{ children: React.ReactNode }> = ({
         });
 
         console.log("Upload response:", response.data);
+        if (onProgress) {
+          // Falls back to polling below if the stream cannot be opened.
+          await streamUploadJobEvents(
+            response.data.job_id,
+            token,
+            onProgress
+          ).catch((e) => console.warn("Progress stream unavailable:", e));
+        }
+        const job = await waitForUploadJob(response.data.job_id, token);
+        if (job.status === "failed") {
+          const detail = job.error || "An unknown error occurred";
+          if (detail.includes("not appear to be a bank statement")) {
+            alert(
+              "⚠️ The uploaded file does not seem to be a valid bank statement."
+            );
+          } else {
+            alert(`Upload failed: ${detail}`);
+          }
+          console.warn("Upload job failed:", detail);
+          return null;
+        }
+        if (job.duplicate_of) {
+          alert("This statement has already been imported.");
+          return job;
+        }
+
         await fixTransferData();
         await fetchTransactions(1, lastUsedFilters);
       } catch (e: any) {
@@ -321,7 +447,13 @@ export const TransactionProvider: React.FC<{ children: React.ReactNode }> = ({
         return null;
       }
     },
-    [fetchTransactions, lastUsedFilters, fixTransferData]
+    [
+      fetchTransactions,
+      lastUsedFilters,
+      fixTransferData,
+      waitForUploadJob,
+      streamUploadJobEvents,
+    ]
   );
 
   const contextValue = useMemo(
@@ -69,10 +69,15 @@ export const useAddTransactionForm = (
 
     try {
       setIsSubmitting(true);
-      await addTransaction({
+      const addedId = await addTransaction({
         ...formData,
         amount: parseFloat(formData.amount),
       });
+      if (!addedId) {
+        // Not added: the request failed or the user kept the existing duplicate.
+        setIsSubmitting(false);
+        return;
+      }
 
       await Promise.all([
         fetchBudgetTransactions(),
@@ -1,25 +1,52 @@
 // hooks/useDocumentUpload.ts
+import { UploadProgressEvent } from "@/contexts/AppContext";
 import { useStatsContext } from "@/contexts/StatsContext";
 import * as DocumentPicker from "expo-document-picker";
 import { useEffect, useRef, useState } from "react";
 import { Alert } from "react-native";
 
 export type ProcessingStage =
-  | "anonymizing"
-  | "extracting_sections"
-  | "normalizing"
-  | "extracting_transactions"
+  | "uploading"
+  | "extract_text"
+  | "anonymize"
+  | "extract_sections"
+  | "normalize_and_extract"
+  | "reconcile"
+  | "link_budgets"
   | "done"
   | "";
 
+const displayedStages: ProcessingStage[] = [
+  "extract_text",
+  "anonymize",
+  "extract_sections",
+  "normalize_and_extract",
+  "reconcile",
+  "link_budgets",
+];
+
 export function useDocumentUpload(
-  uploadBankStatement: (data: FormData) => Promise<any>
+  uploadBankStatement: (
+    data: FormData,
+    onProgress?: (event: UploadProgressEvent) => void
+  ) => Promise<any>
 ) {
   const [processingStage, setProcessingStage] = useState<ProcessingStage>("");
+  const [processingProgress, setProcessingProgress] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const timeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const { refreshSummary } = useStatsContext();
-  const delay = (ms: number) => new Promise((res) => setTimeout(res, ms));
+
+  const handleProgress = (event: UploadProgressEvent) => {
+    const stage = event.stage as ProcessingStage;
+    if (!displayedStages.includes(stage)) return;
+    if (event.event === "stage" && event.status === "running") {
+      setProcessingStage(stage);
+      setProcessingProgress("");
+    } else if (event.event === "progress" && event.total) {
+      setProcessingProgress(`${event.current}/${event.total} ${event.unit}`);
+    }
+  };
 
   const uploadDocument = async () => {
     try {
@@ -32,16 +59,8 @@ export function useDocumentUpload(
 
       const document = result.assets[0];
       setIsLoading(true);
-      setProcessingStage("anonymizing");
-      await delay(1000);
-
-      setProcessingStage("extracting_sections");
-      await delay(1000);
-
-      setProcessingStage("normalizing");
-      await delay(1000);
-
-      setProcessingStage("extracting_transactions");
+      setProcessingStage("uploading");
+      setProcessingProgress("");
 
       const formData = new FormData();
       formData.append("file", {
@@ -50,9 +69,10 @@ export function useDocumentUpload(
         type: document.mimeType || "application/pdf",
       } as any);
 
-      await uploadBankStatement(formData);
+      await uploadBankStatement(formData, handleProgress);
       await refreshSummary();
       setProcessingStage("done");
+      setProcessingProgress("");
       timeoutRef.current = setTimeout(() => {
         setIsLoading(false);
         setProcessingStage("");
@@ -61,6 +81,7 @@ export function useDocumentUpload(
       console.error("Upload failed:", err);
       setIsLoading(false);
       setProcessingStage("");
+      setProcessingProgress("");
       Alert.alert("Upload Failed", err.message || "Unknown error occurred.");
     }
   };
@@ -75,5 +96,6 @@ export function useDocumentUpload(
     uploadDocument,
     isLoading,
     processingStage,
+    processingProgress,
   };
 }